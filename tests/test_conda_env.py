@@ -1,15 +1,43 @@
+import contextlib
+import http.server
 import io
+import json
 import os
 import pathlib
 import re
+import subprocess
+import sys
+import threading
+import time
 from unittest.mock import mock_open, patch
 
+import pytest
 import tox
 from ruamel.yaml import YAML
-from tox.venv import VirtualEnv
-
-from tox_conda.env_activator import PopenInActivatedEnv
-from tox_conda.plugin import tox_testenv_create, tox_testenv_install_deps
+from tox.config import DepConfig
+from tox.venv import VirtualEnv, getdigest
+
+from tox_conda import (
+    admission,
+    archive,
+    cleanup,
+    drift,
+    marker,
+    meta,
+    metrics,
+    pkgs,
+    plugin,
+    profiling,
+)
+from tox_conda.env_activator import ActivationEnv, PopenInActivatedEnv
+from tox_conda.plugin import (
+    get_conda_inputs,
+    get_python_packages,
+    schedule_prebuilds,
+    tox_testenv_create,
+    tox_testenv_install_deps,
+)
+from tox_conda.prebuild import Prebuilder, PrebuildJob
 
 
 def test_conda_create(newconfig, mocksession):
@@ -36,6 +64,850 @@ def test_conda_create(newconfig, mocksession):
     assert call.args[5].startswith("python=")
 
 
+def test_conda_create_moves_old_env_aside(newconfig, mocksession):
+    config = newconfig(
+        [],
+        """
+        [testenv:py123]
+    """,
+    )
+
+    venv = VirtualEnv(config.envconfigs["py123"])
+    venv.path.ensure("conda-meta", "history")
+    venv.path.ensure("lib", "libbig.so")
+    trash = venv.path.dirpath().join(cleanup.TRASH_DIR_NAME)
+    # Leftover of a previous run that was killed before its cleanup completed.
+    trash.ensure("stale", "libbig.so")
+
+    with mocksession.newaction(venv.name, "getenv") as action:
+        tox_testenv_create(action=action, venv=venv)
+    cleanup.wait()
+
+    assert not venv.path.join("lib").check()
+    assert trash.listdir() == []
+
+
+def test_conda_marker(newconfig, mocksession):
+    """Test that a complete conda env is reused when tox did not finish recording it."""
+    ini = """
+        [testenv:py123]
+        conda_deps=
+            numpy
+    """
+    config = newconfig([], ini)
+    venv, action, pcalls = create_test_env(config, mocksession, "py123")
+    tox_testenv_install_deps(action=action, venv=venv)
+    assert marker.is_complete(venv.path, venv.envconfig.conda_inputs) is False
+    venv.path.ensure("conda-meta", dir=1)
+    assert marker.is_complete(venv.path, venv.envconfig.conda_inputs)
+
+    # The run got interrupted before tox wrote its own config, nothing to redo on the conda side.
+    config = newconfig([], ini)
+    venv, action, pcalls = create_test_env(config, mocksession, "py123")
+    assert venv.envconfig.conda_reused
+    tox_testenv_install_deps(action=action, venv=venv)
+    assert not any("conda" in str(call.args[0]) for call in pcalls)
+
+    config = newconfig(["-r"], ini)
+    venv, action, pcalls = create_test_env(config, mocksession, "py123")
+    assert not venv.envconfig.conda_reused
+    assert not marker.is_complete(venv.path, venv.envconfig.conda_inputs)
+
+
+@pytest.mark.skipif(tox.INFO.IS_WIN, reason="relies on symlinks")
+def test_conda_marker_pip_change(newconfig, mocksession):
+    """Test that a change of the pip deps keeps the conda prefix."""
+    ini = """
+        [testenv:py123]
+        conda_deps=
+            numpy
+        deps=
+            {}
+    """
+    config = newconfig([], ini.format("astropy"))
+    venv, action, pcalls = create_test_env(config, mocksession, "py123")
+    tox_testenv_install_deps(action=action, venv=venv)
+    site_packages = "lib/python3.9/site-packages"
+    record = {"files": [site_packages + "/numpy-1.0.dist-info/METADATA"]}
+    venv.path.ensure("conda-meta", "numpy-1.0-0.json").write(json.dumps(record))
+    venv.path.ensure(site_packages, "numpy-1.0.dist-info", dir=1)
+    venv.path.ensure(site_packages, "astropy-4.0.dist-info", dir=1)
+    venv.path.ensure("bin", dir=1).join("python").mksymlinkto(sys.executable)
+    venv.path_config.ensure()
+
+    # tox recreates the env, the conda side is unchanged: only the pip deps are replaced.
+    config = newconfig([], ini.format("asdf"))
+    venv = VirtualEnv(config.envconfigs["py123"])
+    with mocksession.newaction(venv.name, "getenv") as action:
+        tox_testenv_create(action=action, venv=venv)
+        assert venv.envconfig.conda_reused
+        uninstall = [str(arg) for arg in pcalls[-1].args]
+        assert uninstall[1:] == ["-m", "pip", "uninstall", "--yes", "astropy"]
+        pcalls[:] = []
+        tox_testenv_install_deps(action=action, venv=venv)
+    assert not any("conda" in str(call.args[0]) for call in pcalls)
+
+    # A change of the conda deps creates the prefix again.
+    config = newconfig([], ini.format("asdf").replace("numpy", "scipy"))
+    venv, action, pcalls = create_test_env(config, mocksession, "py123")
+    assert not venv.envconfig.conda_reused
+
+
+def test_conda_inputs_change(newconfig, mocksession):
+    """Test that a change of the conda arguments alone makes tox create the env again."""
+    ini = """
+        [testenv:py123]
+        conda_create_args=
+            {}
+        conda_deps=
+            numpy
+    """
+
+    def tox_deps(config):
+        venv = VirtualEnv(config.envconfigs["py123"])
+        return {(getdigest(dep.name), dep.name) for dep in venv.get_resolved_dependencies()}
+
+    config = newconfig([], ini.format("--quiet"))
+    venv, action, pcalls = create_test_env(config, mocksession, "py123")
+    tox_testenv_install_deps(action=action, venv=venv)
+    venv.path.ensure("conda-meta", dir=1)
+    # Only the conda deps reach pip as they are, the conda inputs are left out.
+    assert not any("conda-inputs:" in str(call.args) for call in pcalls)
+    assert tox_deps(newconfig([], ini.format("--quiet"))) == tox_deps(config)
+
+    # tox compares the deps it recorded: they differ, so it calls the create hook.
+    changed = newconfig([], ini.format("--no-default-packages"))
+    assert tox_deps(changed) != tox_deps(config)
+    venv = VirtualEnv(changed.envconfigs["py123"])
+    mocksession._pcalls[:] = []
+    with mocksession.newaction(venv.name, "getenv") as action:
+        tox_testenv_create(action=action, venv=venv)
+    assert not venv.envconfig.conda_reused
+    assert "--no-default-packages" in [str(arg) for arg in mocksession._pcalls[0].args]
+
+
+@pytest.mark.skipif(tox.INFO.IS_WIN, reason="relies on symlinks")
+def test_conda_marker_pip_change_env_file(tmpdir, newconfig, mocksession):
+    """Test that the pip deps of an environment.yml file are kept on a change of the deps."""
+    env_file = tmpdir.join("environment.yml")
+    env_file.write("dependencies:\n  - numpy\n  - pip:\n    - astropy\n")
+    ini = """
+        [testenv:py123]
+        conda_env = {}
+        deps=
+            {{}}
+    """.format(
+        env_file
+    )
+    config = newconfig([], ini.format("pytest"))
+    venv, action, pcalls = create_test_env(config, mocksession, "py123")
+    tox_testenv_install_deps(action=action, venv=venv)
+    site_packages = "lib/python3.9/site-packages"
+    record = {"files": [site_packages + "/numpy-1.0.dist-info/METADATA"]}
+    venv.path.ensure("conda-meta", "numpy-1.0-0.json").write(json.dumps(record))
+    venv.path.ensure(site_packages, "numpy-1.0.dist-info", dir=1)
+    venv.path.ensure(site_packages, "astropy-4.0.dist-info", dir=1)
+    venv.path.ensure("bin", dir=1).join("python").mksymlinkto(sys.executable)
+    venv.path_config.ensure()
+
+    # tox recreates the env, the conda side is unchanged and pip uninstalls nothing.
+    config = newconfig([], ini.format("asdf"))
+    venv = VirtualEnv(config.envconfigs["py123"])
+    with mocksession.newaction(venv.name, "getenv") as action:
+        tox_testenv_create(action=action, venv=venv)
+    assert venv.envconfig.conda_reused
+    assert not any("uninstall" in map(str, call.args) for call in pcalls)
+
+
+def test_conda_plan(newconfig, mocksession, capfd):
+    ini = """
+        [testenv:py123]
+        conda_deps=
+            numpy
+        deps=
+            {}
+    """
+    config = newconfig([], ini.format("astropy"))
+    assert plugin.plan_env(config.envconfigs["py123"]) == ("create", ["no conda env"])
+
+    venv, action, pcalls = create_test_env(config, mocksession, "py123")
+    tox_testenv_install_deps(action=action, venv=venv)
+    venv.path.ensure("conda-meta", dir=1)
+    envconfig = venv.envconfig
+    plugin.get_live_config(venv).writeconfig(venv.path_config)
+    assert plugin.plan_env(envconfig) == ("reuse", [])
+
+    config = newconfig([], ini.format("asdf"))
+    assert plugin.plan_env(config.envconfigs["py123"]) == ("update", ["deps +asdf -astropy"])
+
+    config = newconfig([], ini.format("astropy").replace("numpy", "scipy"))
+    plan = ("recreate", ["conda_deps +scipy -numpy"])
+    assert plugin.plan_env(config.envconfigs["py123"]) == plan
+
+    config = newconfig(["-r"], ini.format("astropy"))
+    assert plugin.plan_env(config.envconfigs["py123"]) == ("recreate", ["-r flag"])
+
+    with pytest.raises(SystemExit) as exit_info:
+        newconfig(["--conda-plan"], ini.format("asdf"))
+    assert exit_info.value.code == 0
+    assert "py123: update (deps +asdf -astropy)" in capfd.readouterr().out
+
+
+def test_conda_plan_run(newconfig, mocksession):
+    """Test that the plan tells what tox then does with the env, change after change."""
+    ini = """
+        [testenv:py123]
+        conda_create_args=
+            {}
+        conda_deps=
+            numpy
+        deps=
+            {}
+    """
+    steps = [
+        (("--quiet", "astropy"), "create"),
+        (("--quiet", "astropy"), "reuse"),
+        (("--quiet", "asdf"), "update"),
+        (("--no-default-packages", "asdf"), "recreate"),
+        (("--no-default-packages", "asdf"), "reuse"),
+    ]
+    for args, expected in steps:
+        envconfig = newconfig([], ini.format(*args)).envconfigs["py123"]
+        assert plugin.plan_env(envconfig)[0] == expected
+        venv = VirtualEnv(envconfig)
+        with mocksession.newaction(venv.name, "getenv") as action:
+            venv.update(action)
+            if hasattr(envconfig, "conda_reused"):
+                venv.path.ensure("conda-meta", dir=1)
+        venv.finish()
+        done = {None: "reuse", True: "update", False: "recreate"}
+        if expected != "create":
+            assert done[getattr(envconfig, "conda_reused", None)] == expected
+
+    # An env tox recorded is reused as it is, with or without a marker.
+    os.remove(marker.marker_path(venv.path))
+    assert plugin.plan_env(envconfig) == ("reuse", [])
+
+
+def test_conda_repair(newconfig, mocksession):
+    """Test that the packages added to or removed from the env are, and only them."""
+    ini = """
+        [testenv:py123]
+        conda_repair = {}
+    """
+    for repair in ("false", "true"):
+        venv, action, pcalls = create_test_env(
+            newconfig(["-r"], ini.format(repair)), mocksession, "py123"
+        )
+        conda_meta = venv.path.ensure("conda-meta", dir=1)
+        for name in ("numpy", "scipy"):
+            url = "https://conda.io/{}-1.0-0.conda".format(name)
+            record = {"name": name, "url": url, "md5": "0"}
+            conda_meta.join("{}-1.0-0.json".format(name)).write(json.dumps(record))
+        tox_testenv_install_deps(action=action, venv=venv)
+        # Only the envs to repair are fingerprinted.
+        assert venv.path.join(drift.FINGERPRINT_NAME).check() is (repair == "true")
+    pcalls[:] = []
+    plugin.repair_env(venv, action)
+    assert pcalls == []
+
+    conda_meta.join("scipy-1.0-0.json").remove()
+    conda_meta.join("astropy-4.0-0.json").write(json.dumps({"name": "astropy"}))
+    assert drift.find_drift(venv.path).extra == ["astropy"]
+    plugin.repair_env(venv, action)
+    remove, install = [[str(arg) for arg in call.args] for call in pcalls]
+    assert remove[1:4] + remove[-1:] == ["remove", "--yes", "--force", "astropy"]
+    assert install[1:3] == ["install", "--yes"]
+    # The repaired env is fingerprinted again.
+    assert drift.find_drift(venv.path) is None
+
+
+def test_conda_profile(tmpdir, newconfig, mocksession, monkeypatch):
+    conda_exe = tmpdir.join("conda")
+    conda_exe.write("#!{}\nimport sys\n".format(sys.executable))
+    monkeypatch.setenv("_CONDA_EXE", str(conda_exe))
+    config = newconfig(["--conda-profile"], "[testenv:py123]")
+    venv = VirtualEnv(config.envconfigs["py123"])
+    with mocksession.newaction(venv.name, "getenv") as action:
+        tox_testenv_create(action=action, venv=venv)
+
+    args = [str(arg) for arg in mocksession._pcalls[0].args]
+    profile = venv.envconfig.envlogdir.join("01-conda-create.prof")
+    assert args[:4] == [sys.executable, "-c", profiling.PROFILE_SCRIPT, str(profile)]
+    assert args[4:6] == [str(conda_exe), "create"]
+    assert venv.envconfig.envlogdir.join("01-tox_testenv_create.prof").check()
+    summary = venv.envconfig.envlogdir.join(profiling.SUMMARY_NAME).read()
+    assert "tox_testenv_create" in summary
+    mocksession.report.expect("*", "*01-tox_testenv_create.prof*")
+
+    # The profiler is not measured as the peak memory of conda.
+    config = newconfig(["--conda-profile", "--conda-admission"], "[testenv:py123]")
+    venv = VirtualEnv(config.envconfigs["py123"])
+    mocksession._clearmocks()
+    with mocksession.newaction(venv.name, "getenv") as action:
+        tox_testenv_create(action=action, venv=venv)
+    args = [str(arg) for arg in mocksession._pcalls[0].args]
+    assert args[:3] == [sys.executable, "-c", profiling.PROFILE_SCRIPT]
+
+
+def test_conda_profile_exit_code(tmpdir):
+    """Test that a failing conda fails under the profiler too."""
+    conda_exe = tmpdir.join("conda")
+    conda_exe.write("import sys\n\ndef main():\n    sys.exit(3)\n\nmain()\n")
+    profile = tmpdir.join("conda.prof")
+    args = profiling.profile_command([conda_exe, "create"], sys.executable, profile)
+    assert subprocess.call(args) == 3
+    assert "main" in profiling.summarize(profile)
+
+
+def test_conda_metrics(tmpdir, newconfig, mocksession):
+    path = tmpdir.join("metrics", "tox_conda.prom")
+    for _ in range(2):
+        config = newconfig(["--conda-metrics-file", str(path)], "[testenv:py123]")
+        create_test_env(config, mocksession, "py123")
+        mocksession.new_config(config)
+        plugin.tox_cleanup(session=mocksession)
+
+    samples = metrics.parse(path.read())
+    assert samples["tox_conda_envs_total", (("outcome", "created"),)] == 2
+    assert samples["tox_conda_process_seconds_count", (("command", "create"),)] == 2
+    buckets = [key for key in samples if key[0] == "tox_conda_process_seconds_bucket"]
+    assert len(buckets) == len(metrics.BUCKETS)
+    assert "# TYPE tox_conda_process_seconds histogram" in path.read()
+
+
+@pytest.mark.skipif(tox.INFO.IS_WIN, reason="admission is only done on posix")
+def test_conda_admission(tmpdir, newconfig, mocksession):
+    gib = 1 << 30
+    ledger = admission.Ledger(tmpdir.join("ledger.json"), available=lambda: 3 * gib)
+    ledger.release(ledger.admit("create-b"), "create-b", 5 * gib // 2)
+    # Nothing else runs, a process is admitted whatever it needs.
+    first = ledger.admit("create-b")
+
+    waits = []
+
+    def sleep(seconds):
+        waits.append(seconds)
+        ledger.release(first, "create-b")
+
+    ledger._sleep = sleep
+    second = ledger.admit("create-b", on_wait=lambda *args: waits.append(args))
+    assert waits == [(5 * gib // 2, gib // 2), admission.POLL_INTERVAL]
+    ledger.release(second, "create-b")
+
+    # The memory the running processes use is only counted once, not as well as reserved.
+    available = [4 * gib]
+    ledger = admission.Ledger(
+        tmpdir.join("used.json"),
+        available=lambda: available[0],
+        sleep=lambda seconds: pytest.fail("not admitted"),
+    )
+    ledger.release(ledger.admit("create-b"), "create-b", 2 * gib)
+    first = ledger.admit("create-b")
+    available[0] -= 3 * gib // 2
+    # 2 GiB reserved and 1.5 GiB of them used: 0.5 GiB of the 2.5 GiB left are spoken for.
+    second = ledger.admit("create-b")
+    available[0] -= gib
+    waits = []
+
+    def sleep(seconds):
+        waits.append(seconds)
+        ledger.release(first, "create-b")
+        available[0] = 4 * gib
+
+    ledger._sleep = sleep
+    # 4 GiB reserved and 2.5 GiB of them used: 1.5 GiB of the 1.5 GiB left are spoken for.
+    third = ledger.admit("create-b", on_wait=lambda *args: waits.append(args))
+    assert waits == [(2 * gib, 0), admission.POLL_INTERVAL]
+    for name in (second, third):
+        ledger.release(name, "create-b")
+
+    # conda runs wrapped to record its peak memory.
+    config = newconfig(["--conda-admission"], "[testenv:py123]")
+    venv = VirtualEnv(config.envconfigs["py123"])
+    with mocksession.newaction(venv.name, "getenv") as action:
+        tox_testenv_create(action=action, venv=venv)
+    args = [str(arg) for arg in mocksession._pcalls[0].args]
+    assert args[:3] == [sys.executable, "-c", admission.PEAK_SCRIPT]
+    assert args[5] == "create"
+    ledger = json.loads(config.toxworkdir.join(plugin.MEMORY_LEDGER).read())
+    assert ledger["reservations"] == {}
+
+
+@pytest.mark.skipif(tox.INFO.IS_WIN, reason="the fake conda is a shell script")
+def test_conda_prebuild(tmpdir, newconfig, mocksession):
+    fake_conda = tmpdir.join("fake-conda")
+    fake_conda.write(
+        """#!/bin/sh
+        echo "$@" >> "$(dirname "$0")/calls"
+        while [ "$1" != "-p" ]; do shift; done
+        mkdir -p "$2/conda-meta"
+        """.replace(
+            "        ", ""
+        )
+    )
+    fake_conda.chmod(0o755)
+    config = newconfig(
+        ["-e", "py1,py2", "--conda-prebuild", "1", "--conda-admission"],
+        """
+        [testenv]
+        conda_deps=
+            numpy
+        [testenv:py1]
+        [testenv:py2]
+    """,
+    )
+    for envconfig in config.envconfigs.values():
+        envconfig.conda_exe = str(fake_conda)
+
+    env_log = mocksession.resultlog.get_envlog("py1")
+    schedule_prebuilds(
+        VirtualEnv(config.envconfigs["py1"], popen=subprocess.Popen, env_log=env_log)
+    )
+
+    venv = VirtualEnv(config.envconfigs["py2"])
+    with mocksession.newaction(venv.name, "getenv") as action:
+        tox_testenv_create(action=action, venv=venv)
+        tox_testenv_install_deps(action=action, venv=venv)
+    assert venv.envconfig.conda_reused
+    assert not any("conda" in str(call.args[0]) for call in mocksession._pcalls)
+    calls = tmpdir.join("calls").readlines()
+    assert [call.split()[0] for call in calls] == ["create", "install"]
+    assert venv.envconfig.envlogdir.join("conda-prebuild.log").check()
+    assert mocksession.resultlog.get_envlog("py2").dict["setup"]
+    # The background build was admitted, and recorded its peak, as the env itself.
+    ledger = json.loads(config.toxworkdir.join(plugin.MEMORY_LEDGER).read())
+    key = plugin.get_admission_key(venv.envconfig, "create")
+    assert key != "create"
+    assert key in ledger["peaks"]
+
+
+def test_conda_prebuild_shutdown(tmpdir):
+    started, release = threading.Event(), threading.Event()
+
+    def block(args):
+        started.set()
+        release.wait(5)
+
+    resources = [contextlib.ExitStack(), contextlib.ExitStack()]
+    closed = []
+    for index, stack in enumerate(resources):
+        stack.callback(closed.append, index)
+    prebuilder = Prebuilder(1)
+    for index, name in enumerate(["py1", "py2"]):
+        envdir = tmpdir.join(name)
+        job = PrebuildJob(
+            name,
+            envdir,
+            {},
+            [["create"], ["install"]],
+            block,
+            envdir.join("log"),
+            resources[index],
+        )
+        prebuilder.submit(job)
+    assert started.wait(5)
+    prebuilder.shutdown()
+    # The job that did not start is dropped at once, the running one after its step.
+    assert closed == [1]
+    assert not prebuilder.is_scheduled("py2")
+    release.set()
+    for _ in range(50):
+        if len(closed) == 2:
+            break
+        time.sleep(0.1)
+    assert closed == [1, 0]
+    assert tmpdir.join("py1", "log").readlines()[-1] == "cancelled\n"
+
+
+def test_conda_clone_identical_env(newconfig, mocksession):
+    config = newconfig(
+        [],
+        """
+        [testenv]
+        basepython = python3.9
+        conda_deps=
+            numpy
+        [testenv:unit]
+        [testenv:integration]
+    """,
+    )
+    venv, action, pcalls = create_test_env(config, mocksession, "unit")
+    tox_testenv_install_deps(action=action, venv=venv)
+    record = {"url": "https://repo.anaconda.com/pkgs/main/noarch/numpy-1.0-0.conda", "md5": "0f"}
+    venv.path.ensure("conda-meta", "numpy-1.0-0.json").write(json.dumps(record))
+    pcalls[:] = []
+
+    venv = VirtualEnv(config.envconfigs["integration"])
+    with mocksession.newaction(venv.name, "getenv") as action:
+        tox_testenv_create(action=action, venv=venv)
+        tox_testenv_install_deps(action=action, venv=venv)
+    conda_calls = [call.args for call in pcalls if "conda" in str(call.args[0])]
+    assert len(conda_calls) == 1
+    assert conda_calls[0][1:4] == ["create", "--yes", "-p"]
+    assert conda_calls[0][5] == "--file"
+    assert marker.read_marker(venv.path)["inputs"] == venv.envconfig.conda_inputs
+
+
+def test_conda_base_env(tmpdir, newconfig, mocksession):
+    base = tmpdir.mkdir("base")
+    record = {"url": "https://repo.anaconda.com/pkgs/main/noarch/numpy-1.0-0.conda", "md5": "0f"}
+    base.ensure("conda-meta", "numpy-1.0-0.json").write(json.dumps(record))
+    config = newconfig(
+        [],
+        """
+        [testenv:py123]
+        conda_base_env = {}
+        conda_deps=
+            astropy
+    """.format(
+            base
+        ),
+    )
+    venv, action, pcalls = create_test_env(config, mocksession, "py123")
+    tox_testenv_install_deps(action=action, venv=venv)
+    conda_calls = [call.args for call in pcalls if "conda" in str(call.args[0])]
+    assert len(conda_calls) == 1
+    assert conda_calls[0][1:3] == ["install", "--quiet"]
+    assert conda_calls[0][-1] == "astropy"
+    inputs = marker.read_marker(venv.path)["inputs"]
+    assert inputs["base_env"] == meta.prefix_digest(base)
+
+    # A change of the base env changes the conda inputs.
+    base.ensure("conda-meta", "scipy-1.0-0.json").write(json.dumps(record))
+    assert get_conda_inputs(venv.envconfig, ["python=3.9"])["base_env"] != inputs["base_env"]
+
+
+def test_conda_base_env_file(tmpdir, newconfig, mocksession):
+    tmpdir.join("base.yml").write("dependencies:\n  - numpy\n")
+    config = newconfig(
+        [],
+        """
+        [testenv]
+        basepython = python3.9
+        conda_base_env = base.yml
+        [testenv:unit]
+        [testenv:integration]
+    """,
+    )
+    assert str(config.envconfigs["unit"].deps[-1].name).endswith("base.yml")
+    pcalls = mocksession._pcalls
+
+    def provision(name):
+        venv = VirtualEnv(config.envconfigs[name])
+        with mocksession.newaction(venv.name, "getenv") as action:
+            tox_testenv_create(action=action, venv=venv)
+            conda_calls = [call.args for call in pcalls if "conda" in str(call.args[0])]
+            pcalls[:] = []
+            tox_testenv_install_deps(action=action, venv=venv)
+        # Neither conda nor pip has anything to install.
+        assert pcalls == []
+        return conda_calls
+
+    create_base, create_unit = provision("unit")
+    assert create_base[1:4] == ["env", "create", "-p"]
+    base = config.toxworkdir.join(".tox-conda-base").listdir(lambda path: path.check(dir=1))
+    assert create_unit[-2] == "--clone"
+    assert base == [config.toxworkdir.join(create_unit[-1])]
+
+    # The base env is created once, the other envs are created from it.
+    base[0].ensure("conda-meta", "numpy-1.0-0.json").write("{}")
+    (create_integration,) = provision("integration")
+    assert create_integration[-2:] == create_unit[-2:]
+
+
+def test_conda_base_env_and_env(newconfig):
+    with pytest.raises(tox.exception.ConfigError, match="conda_base_env"):
+        newconfig(
+            [],
+            """
+            [testenv:py123]
+            conda_env = env.yml
+            conda_base_env = base.yml
+        """,
+        )
+
+
+@pytest.mark.skipif(tox.INFO.IS_WIN, reason="the python of the prefix is a symlink")
+def test_conda_prefix(tmpdir, newconfig, mocksession, monkeypatch):
+    monkeypatch.delattr(PopenInActivatedEnv, "__del__", raising=False)
+    prefix = tmpdir.join("prefix")
+    for name in ("python-3.9.7-h12debd9_1.json", "numpy-1.21.2-py39h20f2e39_0.json"):
+        prefix.ensure("conda-meta", name)
+    python = prefix.ensure("bin", dir=1).join("python")
+    python.mksymlinkto(sys.executable)
+    config = newconfig(
+        [],
+        """
+        [testenv:py39]
+        conda_prefix = {}
+        conda_deps = conda-forge::numpy>=1.20
+        deps = pytest
+    """.format(
+            prefix
+        ),
+    )
+    envconfig = config.envconfigs["py39"]
+    assert envconfig.setenv["CONDA_DEFAULT_ENV"] == str(prefix)
+    assert envconfig.envbindir.dirpath() == prefix
+    venv = VirtualEnv(envconfig)
+    with mocksession.newaction(venv.name, "getenv") as action:
+        tox_testenv_create(action=action, venv=venv)
+        tox_testenv_install_deps(action=action, venv=venv)
+    # Only the pip deps are installed, into the activated prefix.
+    (call,) = mocksession._pcalls
+    with open(call.args[1]) as stream:
+        activate, command = stream.read().splitlines()
+    assert activate.endswith('activate {})"'.format(prefix))
+    assert command.split()[-5:] == [str(python), "-m", "pip", "install", "pytest"]
+    assert plugin.tox_get_python_executable(envconfig) == python
+    assert not venv.path.join("conda-meta").check()
+
+    prefix.join("conda-meta", "numpy-1.21.2-py39h20f2e39_0.json").remove()
+    with mocksession.newaction(venv.name, "getenv") as action:
+        with pytest.raises(plugin.UnusablePrefix, match="numpy>=1.20$"):
+            tox_testenv_create(action=action, venv=venv)
+
+    # The versions are checked too.
+    prefix.ensure("conda-meta", "numpy-1.19.5-py39h20f2e39_0.json")
+    with mocksession.newaction(venv.name, "getenv") as action:
+        with pytest.raises(plugin.UnusablePrefix, match=r"numpy>=1.20 \(1.19.5 installed\)"):
+            tox_testenv_create(action=action, venv=venv)
+
+
+def test_conda_prefix_and_spec(newconfig):
+    with pytest.raises(tox.exception.ConfigError, match="conda_prefix and conda_spec"):
+        newconfig(
+            [],
+            """
+            [testenv:py123]
+            conda_prefix = prefix
+            conda_spec = conda-spec.txt
+        """,
+        )
+
+
+@pytest.mark.parametrize("hardlink", [True, False])
+def test_conda_pkgs_dirs(tmpdir, newconfig, mocksession, monkeypatch, capfd, hardlink):
+    monkeypatch.delenv("CONDA_PKGS_DIRS", raising=False)
+    monkeypatch.setattr(pkgs, "find_pkgs_dirs", lambda conda_exe: [str(tmpdir)])
+    monkeypatch.setattr(pkgs, "can_hardlink", lambda pkgs_dirs, prefix: hardlink)
+    config = newconfig(
+        [],
+        """
+        [testenv:py123]
+        conda_deps=
+            numpy
+    """,
+    )
+    venv = VirtualEnv(config.envconfigs["py123"])
+    with mocksession.newaction(venv.name, "getenv") as action:
+        tox_testenv_create(action=action, venv=venv)
+        record = {"link": {"source": str(tmpdir), "type": 1 if hardlink else 3}}
+        venv.path.ensure("conda-meta", "numpy-1.0-0.json").write(json.dumps(record))
+        tox_testenv_install_deps(action=action, venv=venv)
+    create, install = [call for call in mocksession._pcalls if "conda" in str(call.args[0])]
+    if hardlink:
+        assert create.env is None or "CONDA_PKGS_DIRS" not in create.env
+    else:
+        # conda would copy every file into the env, it gets a package cache next to it.
+        pkgs_dir = str(config.toxworkdir.join(".tox-conda-pkgs"))
+        assert create.env["CONDA_PKGS_DIRS"] == install.env["CONDA_PKGS_DIRS"] == pkgs_dir
+    out, _ = capfd.readouterr()
+    assert "py123 condalink: {}".format("hardlink" if hardlink else "copy") in out
+
+
+def test_conda_offline(tmpdir, newconfig, mocksession, monkeypatch):
+    pkgs_dir = tmpdir.mkdir("pkgs")
+    record = {
+        "name": "numpy",
+        "version": "1.0",
+        "build": "0",
+        "subdir": "noarch",
+        "fn": "numpy-1.0-0.conda",
+        "url": "https://conda.anaconda.org/conda-forge/noarch/numpy-1.0-0.conda",
+        "depends": [],
+    }
+    pkgs_dir.ensure("numpy-1.0-0", "info", "repodata_record.json").write(json.dumps(record))
+    pkgs_dir.ensure("numpy-1.0-0.conda")
+    monkeypatch.setenv("CONDA_PKGS_DIRS", str(pkgs_dir))
+    config = newconfig(
+        [],
+        """
+        [testenv:py123]
+        conda_offline = true
+        conda_channels =
+            conda-forge
+        conda_deps =
+            numpy
+    """,
+    )
+
+    venv, action, pcalls = create_test_env(config, mocksession, "py123")
+    tox_testenv_install_deps(action=action, venv=venv)
+
+    channel_dir = config.toxworkdir.join(".tox-conda-offline-channel")
+    channel = pkgs.path_to_url(channel_dir)
+    conda_cmd = pcalls[-1].args
+    assert conda_cmd[1:10] == [
+        "install",
+        "--quiet",
+        "--yes",
+        "-p",
+        venv.path,
+        "--offline",
+        "--override-channels",
+        "--channel",
+        channel,
+    ]
+    assert "conda-forge" not in conda_cmd
+    repodata = json.loads(channel_dir.join("noarch", "repodata.json").read())
+    assert repodata["packages.conda"]["numpy-1.0-0.conda"]["name"] == "numpy"
+    assert "url" not in repodata["packages.conda"]["numpy-1.0-0.conda"]
+    assert channel_dir.join("noarch", "numpy-1.0-0.conda").check()
+
+
+@pytest.mark.skipif(tox.INFO.IS_WIN, reason="relies on symlinks")
+def test_conda_cache_dir(tmpdir, newconfig, mocksession):
+    config = newconfig(
+        [],
+        """
+        [testenv:py123]
+        conda_cache_dir = {}
+        conda_deps=
+            numpy
+    """.format(
+            tmpdir.join("cache")
+        ),
+    )
+    envconfig = config.envconfigs["py123"]
+    python_packages = get_python_packages(envconfig, None)
+    envconfig.conda_inputs = get_conda_inputs(envconfig, python_packages)
+
+    # An env built somewhere else, at a longer path.
+    old_prefix = tmpdir.join("somewhere", "much", "longer", ".tox", "py123")
+    paths = [
+        {"_path": "bin/script", "prefix_placeholder": "/opt/placeholder", "file_mode": "text"},
+        {
+            "_path": "lib/libfoo.so",
+            "prefix_placeholder": "/opt/placeholder",
+            "file_mode": "binary",
+        },
+    ]
+    record = {"name": "foo", "paths_data": {"paths": paths}}
+    old_prefix.ensure("conda-meta", "foo-1.0-0.json").write(json.dumps(record))
+    old_prefix.ensure("bin", "script").write("#!{}/bin/python\n".format(old_prefix))
+    binary = b"\x7fELF" + str(old_prefix).encode() + b"/lib\0rest"
+    old_prefix.ensure("lib", "libfoo.so").write_binary(binary)
+    old_prefix.join("bin", "link").mksymlinkto(old_prefix.join("lib", "libfoo.so"))
+    old_prefix.ensure("log", "1-create.log")
+    marker.write_marker(old_prefix, envconfig.conda_inputs)
+    path = archive.archive_path(envconfig.conda_cache_dir, envconfig.conda_inputs)
+    archive.pack(old_prefix, path)
+
+    venv = VirtualEnv(envconfig)
+    with mocksession.newaction(venv.name, "getenv") as action:
+        tox_testenv_create(action=action, venv=venv)
+    assert not any("conda" in str(call.args[0]) for call in mocksession._pcalls)
+    assert venv.envconfig.conda_reused
+    assert marker.is_complete(venv.path, venv.envconfig.conda_inputs)
+    assert not venv.path.join("log", "1-create.log").check()
+
+    assert venv.path.join("bin", "script").read() == "#!{}/bin/python\n".format(venv.path)
+    relocated = venv.path.join("lib", "libfoo.so").read_binary()
+    assert len(relocated) == len(binary)
+    assert relocated.startswith(b"\x7fELF" + str(venv.path).encode() + b"/lib\0")
+    assert relocated.endswith(b"\0rest")
+    assert venv.path.join("bin", "link").readlink() == str(venv.path.join("lib", "libfoo.so"))
+
+
+@pytest.mark.skipif(tox.INFO.IS_WIN, reason="relies on symlinks")
+def test_conda_cache_dir_symlinks(tmpdir, monkeypatch):
+    """Test that the absolute symlinks of a prefix survive the extraction filter."""
+    import tarfile
+
+    if hasattr(tarfile, "data_filter"):
+        # As strict with links as the tar filter of the latest Pythons.
+        monkeypatch.setattr(tarfile, "tar_filter", tarfile.data_filter)
+    old_prefix = tmpdir.join("old", "py123")
+    old_prefix.ensure("lib", "libfoo.so").write("foo")
+    old_prefix.join("lib", "libbar.so").mksymlinkto(old_prefix.join("lib", "libfoo.so"))
+    old_prefix.join("lib", "zoneinfo").mksymlinkto(tmpdir.ensure("share", "zoneinfo", dir=1))
+    old_prefix.ensure("conda-meta", dir=1)
+    path = str(tmpdir.join("cache", "py123.tar.gz"))
+    archive.pack(old_prefix, path)
+
+    prefix = tmpdir.join("new", "py123")
+    archive.unpack(path, prefix)
+    assert prefix.join("lib", "libbar.so").readlink() == str(prefix.join("lib", "libfoo.so"))
+    assert prefix.join("lib", "zoneinfo").readlink() == str(tmpdir.join("share", "zoneinfo"))
+
+
+@pytest.fixture
+def http_store(tmpdir):
+    """A static file server also accepting uploads, standing in for a shared store."""
+    directory = tmpdir.mkdir("served")
+
+    class Handler(http.server.SimpleHTTPRequestHandler):
+        def translate_path(self, path):
+            return str(directory.join(path.lstrip("/")))
+
+        def do_PUT(self):
+            data = self.rfile.read(int(self.headers["Content-Length"]))
+            directory.join(self.path.lstrip("/")).write_binary(data)
+            self.send_response(201)
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    server = http.server.HTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    yield "http://127.0.0.1:{}/".format(server.server_port), directory
+    server.shutdown()
+    server.server_close()
+    thread.join()
+
+
+def test_conda_store(newconfig, mocksession, http_store):
+    url, served = http_store
+    ini = """
+        [testenv:py123]
+        conda_store = {}
+        conda_deps=
+            numpy
+    """.format(
+        url
+    )
+    venv, action, pcalls = create_test_env(newconfig([], ini), mocksession, "py123")
+    record = {"url": "https://repo.anaconda.com/pkgs/main/noarch/numpy-1.0-0.conda", "md5": "0f"}
+    venv.path.ensure("conda-meta", "numpy-1.0-0.json").write(json.dumps(record))
+    tox_testenv_install_deps(action=action, venv=venv)
+    key = marker.inputs_hash(venv.envconfig.conda_inputs)
+    spec_ref = served.join(key + ".txt.sha256")
+    archive_ref = served.join(key + archive.ARCHIVE_SUFFIX + ".sha256")
+    assert spec_ref.check() and archive_ref.check()
+    spec = served.join("{}.txt.{}".format(key, spec_ref.read()))
+    assert spec.read() == "@EXPLICIT\n{}#0f\n".format(record["url"])
+
+    # Another machine restores the archive, conda is not even started.
+    venv, action, pcalls = create_test_env(newconfig(["-r"], ini), mocksession, "py123")
+    assert venv.envconfig.conda_reused
+    assert venv.path.join("conda-meta", "numpy-1.0-0.json").check()
+
+    # A corrupted archive is not used, the env is created from the spec solved before.
+    blob = served.join("{}{}.{}".format(key, archive.ARCHIVE_SUFFIX, archive_ref.read()))
+    blob.write_binary(b"corrupted")
+    venv = VirtualEnv(newconfig(["-r"], ini).envconfigs["py123"])
+    with mocksession.newaction(venv.name, "getenv") as action:
+        tox_testenv_create(action=action, venv=venv)
+    assert venv.envconfig.conda_reused
+    conda_cmd = mocksession._pcalls[-1].args
+    assert conda_cmd[1:5] == ["create", "--yes", "-p", venv.path]
+    assert conda_cmd[5] == "--file"
+
+
 def create_test_env(config, mocksession, envname):
 
     venv = VirtualEnv(config.envconfigs[envname])
@@ -97,6 +969,187 @@ def test_install_deps_no_conda(newconfig, mocksession, monkeypatch):
     assert cmd[-6:] == ["-m", "pip", "install", "numpy", "-rrequirements.txt", "astropy"]
 
 
+def test_install_deps_activate_once(newconfig, mocksession, monkeypatch):
+    config = newconfig(
+        [],
+        """
+        [testenv:py123]
+        conda_activate_once = true
+        deps=
+            numpy
+    """,
+    )
+
+    computed = []
+
+    def compute(conda_exe, envdir):
+        computed.append(envdir)
+        before = {"PATH": os.pathsep.join(["/usr/bin"]), "HOME": "/home", "PS1": "$ "}
+        after = {
+            "PATH": os.pathsep.join([str(envdir.join("bin")), "/usr/bin"]),
+            "HOME": "/home",
+            "CONDA_PREFIX": str(envdir),
+            "SHLVL": "2",
+        }
+        return ActivationEnv.from_environs(before, after)
+
+    monkeypatch.setattr(ActivationEnv, "compute", compute)
+
+    venv, action, pcalls = create_test_env(config, mocksession, "py123")
+    tox_testenv_install_deps(action=action, venv=venv)
+    tox_testenv_install_deps(action=action, venv=venv)
+
+    envdir = venv.envconfig.envdir
+    assert computed == [envdir]
+    call = pcalls[-1]
+    assert call.args[-4:] == ["-m", "pip", "install", "numpy"]
+    assert call.env["CONDA_PREFIX"] == str(envdir)
+    assert call.env["PATH"].split(os.pathsep)[0] == str(envdir.join("bin"))
+    activation = venv.envconfig.conda_activation_env
+    assert activation.set_vars == {"CONDA_PREFIX": str(envdir)}
+    assert activation.unset_vars == ["PS1"]
+
+
+@pytest.mark.skipif(tox.INFO.IS_WIN, reason="reads the activation script")
+@pytest.mark.parametrize("uv", ["/opt/uv/bin/uv", None])
+def test_install_deps_uv(newconfig, mocksession, monkeypatch, uv):
+    monkeypatch.delattr(PopenInActivatedEnv, "__del__", raising=False)
+    monkeypatch.setattr(plugin, "find_uv", lambda: uv)
+    config = newconfig(
+        [],
+        """
+        [testenv:py123]
+        conda_pip_installer = uv
+        deps=
+            numpy
+    """,
+    )
+    venv, action, pcalls = create_test_env(config, mocksession, "py123")
+    envdir = venv.envconfig.envdir
+    site_packages = "lib/python3.9/site-packages/"
+    envdir.join("conda-meta", "pip-21.0-py_0.json").write(
+        json.dumps({"files": [site_packages + "pip-21.0.dist-info/METADATA"]}), ensure=True
+    )
+    envdir.join("conda-meta", "pyyaml-5.4-py39_0.json").write(
+        json.dumps({"files": [site_packages + "PyYAML-5.4-py3.9.egg-info/PKG-INFO"]}), ensure=True
+    )
+
+    constraints = []
+    write_pip_constraints = plugin.write_pip_constraints
+
+    def record_constraints(venv):
+        path = write_pip_constraints(venv)
+        with open(path) as stream:
+            constraints.append(stream.read())
+        return path
+
+    monkeypatch.setattr(plugin, "write_pip_constraints", record_constraints)
+    install_command = venv.envconfig.install_command
+    tox_testenv_install_deps(action=action, venv=venv)
+
+    assert constraints == ["PyYAML==5.4\npip==21.0\n"]
+    with open(pcalls[-1].args[1]) as stream:
+        cmd = stream.readlines()[1].split()
+    if uv is None:
+        assert cmd[-6:-3] == ["-m", "pip", "install"]
+    else:
+        assert cmd[:5] == [uv, "pip", "install", "--python", str(venv.envconfig.envpython)]
+    assert cmd[-3] == "-c"
+    assert not os.path.exists(cmd[-2])
+    assert cmd[-1] == "numpy"
+    assert venv.envconfig.install_command == install_command
+
+
+@pytest.mark.skipif(tox.INFO.IS_WIN, reason="reads the activation script")
+def test_install_deps_wheelhouse(tmpdir, newconfig, mocksession, monkeypatch):
+    monkeypatch.delattr(PopenInActivatedEnv, "__del__", raising=False)
+    config = newconfig(
+        [],
+        """
+        [testenv:py123]
+        conda_wheelhouse = {}
+        deps=
+            numpy
+            -rrequirements.txt
+    """.format(
+            tmpdir.join("wheelhouse")
+        ),
+    )
+    config.toxinidir.join("requirements.txt").write("astropy\n")
+    directory = tmpdir.join("wheelhouse", "cpython-39-linux-x86_64").ensure(dir=1)
+    monkeypatch.setattr(plugin, "get_wheelhouse_dir", lambda venv, action: directory)
+    venv, action, pcalls = create_test_env(config, mocksession, "py123")
+    venv.envconfig.envdir.join("bin", "python").ensure()
+
+    def commands():
+        lines = []
+        for call in pcalls:
+            with open(call.args[1]) as stream:
+                lines.append(stream.readlines()[1].split())
+        pcalls[:] = []
+        return lines
+
+    tox_testenv_install_deps(action=action, venv=venv)
+    build, install = commands()
+    # tox shortens the paths relative to the toxinidir.
+    find_links = ["--find-links", config.toxinidir.bestrelpath(directory)]
+    assert build[1:4] == ["-m", "pip", "wheel"]
+    assert build[-4:] == find_links + ["numpy", "-rrequirements.txt"]
+    assert install[-5:] == ["--no-index"] + find_links + build[-2:]
+    assert len(directory.listdir("*.deps")) == 1
+
+    # The wheels of these deps are known to be there, they are installed without any index.
+    tox_testenv_install_deps(action=action, venv=venv)
+    assert commands() == [install]
+
+    # Any change of the deps adds their wheels again.
+    config.toxinidir.join("requirements.txt").write("astropy<5\n")
+    tox_testenv_install_deps(action=action, venv=venv)
+    assert [command[3] for command in commands()] == ["wheel", "install"]
+
+    # Editable and local deps are left to pip, which installs them from their source.
+    config.toxinidir.ensure("local", dir=1)
+    for dep in ["-e.", "local"]:
+        venv.envconfig.deps = [DepConfig(dep)]
+        tox_testenv_install_deps(action=action, venv=venv)
+        (install,) = commands()
+        assert install[-1] == dep
+        assert "--no-index" not in install
+
+
+def test_conda_precompile(newconfig, mocksession):
+    config = newconfig(
+        [],
+        """
+        [testenv:py123]
+        conda_precompile = true
+        conda_deps=
+            numpy
+        deps=
+            astropy
+    """,
+    )
+    venv, action, pcalls = create_test_env(config, mocksession, "py123")
+    venv.envconfig.envdir.join("bin", "python").ensure()
+    tox_testenv_install_deps(action=action, venv=venv)
+    precompile = [venv.envconfig.envpython, "-c", plugin.PRECOMPILE_SCRIPT]
+    calls = [[str(arg) for arg in call.args] for call in pcalls]
+    # Once after the conda step, before the env is archived, once after the pip step.
+    assert calls[1] == calls[3] == [str(arg) for arg in precompile]
+    assert calls[0][1] == "install"
+
+
+def test_conda_pip_installer_unknown(newconfig):
+    with pytest.raises(tox.exception.ConfigError, match="conda_pip_installer"):
+        newconfig(
+            [],
+            """
+            [testenv:py123]
+            conda_pip_installer = poetry
+        """,
+        )
+
+
 def test_install_conda_deps(newconfig, mocksession):
     config = newconfig(
         [],
@@ -1,3 +1,14 @@
+import subprocess
+import sys
+
+import pytest
+import tox
+from tox.venv import VirtualEnv
+
+from tox_conda import marker, matchspec
+from tox_conda.plugin import get_conda_inputs, get_invalid_conda_specs, tox_testenv_create
+
+
 def test_conda_deps(tmpdir, newconfig):
     config = newconfig(
         [],
@@ -125,3 +136,186 @@ def test_conda_force_deps(tmpdir, newconfig):
     assert hasattr(config.envconfigs["py1"], "conda_deps")
     assert len(config.envconfigs["py1"].conda_deps) == 2
     assert "something<42.1" == config.envconfigs["py1"].conda_deps[0].name
+
+
+@pytest.mark.parametrize(
+    "spec, canonical",
+    [
+        ("numpy>=1.20", "numpy >=1.20"),
+        ("NumPy >= 1.20 , <2", "numpy >=1.20,<2"),
+        ("numpy=1.20", "numpy 1.20.*"),
+        ("numpy 1.20", "numpy ==1.20"),
+        ("numpy=1.20=py39_0", "numpy ==1.20 py39_0"),
+        ("https://conda.anaconda.org/conda-forge::numpy", "conda-forge::numpy"),
+        ("numpy[version='>=1.2', md5=abc]", "numpy >=1.2[md5='abc']"),
+        ("numpy * py39*  # comment", "numpy * py39*"),
+        ("blas=*=openblas", "blas * openblas"),
+        ("libblas=*=*mkl", "libblas * *mkl"),
+        ("numpy=1.11.1|1.11.3", "numpy 1.11.1.*|==1.11.3"),
+        ("numpy=1.11|1.12=py_0", "numpy 1.11.*|==1.12 py_0"),
+    ],
+)
+def test_matchspec_canonical(spec, canonical):
+    assert str(matchspec.parse(spec)) == canonical
+    assert str(matchspec.parse(canonical)) == canonical
+
+
+@pytest.mark.parametrize(
+    "first, second, order",
+    [
+        ("1.9", "1.10", -1),
+        ("1.20", "1.20.0", 0),
+        ("1.0rc1", "1.0", -1),
+        ("1.0dev", "1.0a", -1),
+        ("1.0", "1.0.post1", -1),
+        ("1!0.1", "2.0", 1),
+        ("1.0_1", "1.0.1", 0),
+    ],
+)
+def test_matchspec_compare_versions(first, second, order):
+    assert matchspec.compare_versions(first, second) == order
+    assert matchspec.compare_versions(second, first) == -order
+
+
+@pytest.mark.parametrize(
+    "spec, version, matches",
+    [
+        ("numpy", "1.21.2", True),
+        ("numpy>=1.20", "1.21.2", True),
+        ("numpy>=2", "1.21.2", False),
+        ("numpy=1.21", "1.21.2", True),
+        ("numpy=1.2", "1.21.2", False),
+        ("numpy==1.21", "1.21.0", True),
+        ("numpy>=1.20,<1.21|1.21.2", "1.21.2", True),
+        ("numpy!=1.21.*", "1.21.2", False),
+        ("numpy~=1.21.0", "1.22", False),
+        ("numpy 1.*.2", "1.21.2", True),
+    ],
+)
+def test_matchspec_matches_version(spec, version, matches):
+    assert matchspec.parse(spec).matches_version(version) is matches
+
+
+def test_conda_deps_canonical(tmpdir, newconfig):
+    ini = """
+        [testenv:py39]
+        conda_deps=
+            {}
+        conda_channels=
+            {}
+    """
+    config = newconfig([], ini.format("numpy>=1.20\n            scipy", "conda-forge"))
+    channel = "https://conda.anaconda.org/conda-forge/"
+    other = newconfig([], ini.format("scipy\n            NumPy >= 1.20", channel))
+    envconfig, other_envconfig = config.envconfigs["py39"], other.envconfigs["py39"]
+    assert [dep.name for dep in envconfig.deps][:2] == ["numpy >=1.20", "scipy"]
+    # The channel is the same, given by name or by URL.
+    assert [dep.name for dep in other_envconfig.deps] == [dep.name for dep in envconfig.deps]
+    inputs = get_conda_inputs(envconfig, ["python=3.9"])
+    assert marker.inputs_hash(inputs) == marker.inputs_hash(
+        get_conda_inputs(other_envconfig, ["python=3.9"])
+    )
+
+    # Neither the order nor the spelling of the specs of a spec file matter.
+    tmpdir.join("spec.txt").write("# packages\nscipy\nnumpy>=1.20\n")
+    tmpdir.join("other-spec.txt").write("numpy >= 1.20\nscipy\n")
+    assert marker.spec_file_digest(tmpdir.join("spec.txt")) == marker.spec_file_digest(
+        tmpdir.join("other-spec.txt")
+    )
+
+
+@pytest.mark.parametrize(
+    "option, message",
+    [
+        ("conda_deps = python=3.8", "conflicting conda specs python 3.8.* (conda_deps)"),
+        ("conda_deps = numpy==1.20\n    numpy=1.21", "numpy ==1.20 (conda_deps)"),
+    ],
+)
+def test_conda_deps_conflict(newconfig, option, message):
+    with pytest.raises(tox.exception.ConfigError) as error:
+        newconfig([], "[testenv:py39]\n{}".format(option))
+    assert message in str(error.value)
+
+
+@pytest.mark.parametrize(
+    "option, content, message",
+    [
+        ("conda_deps = numpy>=", None, "'numpy>=': missing version after '>=' (conda_deps)"),
+        ("conda_deps = num$py", None, "invalid package name 'num$py'"),
+        ("conda_spec = {path}", "numpy\nscipy=1.2=py=3\n", "spec.txt line 2)"),
+        ("conda_env = {path}", "dependencies:\n- numpy=>1.2\n", "invalid version '>1.2'"),
+    ],
+)
+def test_conda_deps_invalid(tmpdir, newconfig, mocksession, option, content, message):
+    """Test that invalid specs fail the env before conda runs, not reading the config."""
+    path = tmpdir.join("spec.txt")
+    if content is not None:
+        path.write(content)
+    config = newconfig([], "[testenv:py39]\n{}".format(option.format(path=path)))
+    envconfig = config.envconfigs["py39"]
+    assert get_conda_inputs(envconfig, ["python=3.9"])
+    venv = VirtualEnv(envconfig)
+    with pytest.raises(tox.exception.ConfigError) as error:
+        with mocksession.newaction(venv.name, "getenv") as action:
+            tox_testenv_create(action=action, venv=venv)
+    assert "py39: invalid spec" in str(error.value)
+    assert message in str(error.value)
+    assert mocksession._pcalls == []
+
+
+def test_conda_env_unreadable(tmpdir, newconfig):
+    """Test that an environment.yml file that cannot be read is left to conda."""
+    path = tmpdir.join("env.yml")
+    path.write("dependencies: [numpy\n")
+    config = newconfig([], "[testenv:py39]\nconda_env = {}".format(path))
+    envconfig = config.envconfigs["py39"]
+    assert get_conda_inputs(envconfig, ["python=3.9"])
+    assert get_invalid_conda_specs(envconfig) == []
+
+
+def test_conda_base_env_canonical(tmpdir, newconfig):
+    tmpdir.join("base.yml").write("name: base\ndependencies:\n- scipy\n- numpy>=1.20\n")
+    tmpdir.join("other.yml").write("name: other\ndependencies:\n- numpy >= 1.20\n- scipy\n")
+    inputs = []
+    for name in ("base.yml", "other.yml"):
+        config = newconfig([], "[testenv:py39]\nconda_base_env = {}".format(tmpdir.join(name)))
+        inputs.append(get_conda_inputs(config.envconfigs["py39"], ["python=3.9"]))
+    assert inputs[0]["base_env"] == inputs[1]["base_env"]
+
+
+def test_conda_base_env_missing(tmpdir, newconfig):
+    config = newconfig([], "[testenv:py39]\nconda_base_env = {}".format(tmpdir.join("base")))
+    other = newconfig([], "[testenv:py39]")
+    inputs = get_conda_inputs(config.envconfigs["py39"], ["python=3.9"])
+    assert inputs["base_env"] == str(tmpdir.join("base"))
+    assert inputs != get_conda_inputs(other.envconfigs["py39"], ["python=3.9"])
+
+
+@pytest.mark.parametrize(
+    "value, expected",
+    [
+        ("store", "{toxinidir}/store"),
+        ("/shared/store", "/shared/store"),
+        ("https://example.com/store", "https://example.com/store"),
+    ],
+)
+def test_conda_store_location(newconfig, value, expected):
+    config = newconfig([], "[testenv:py39]\nconda_store = {}".format(value))
+    location = config.envconfigs["py39"].conda_store
+    assert location == expected.format(toxinidir=config.toxinidir)
+
+
+def test_import_stays_light():
+    """Importing the plugin must not pull modules only some features need."""
+    code = "import tox, tox.config, tox.session, tox.venv; import tox_conda.hooks"
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+        check=True,
+    )
+    # Each line is "import time: <self us> | <cumulative us> | <indented module name>".
+    imported = [line.rsplit("|", 1)[-1].strip() for line in result.stderr.splitlines()]
+    plugin_imports = imported[imported.index("tox_conda.version") :]
+    heavy = {"concurrent.futures", "ruamel.yaml", "tarfile", "urllib.request"}
+    assert not heavy & set(plugin_imports)
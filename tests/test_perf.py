@@ -0,0 +1,179 @@
+"""Time the conda steps of the plugin end to end, against a local channel and without network.
+
+The channel holds synthetic noarch packages generated at test time, so the timings measure
+the plugin and conda, not the network nor the size of real packages. The wall-clock time of
+each phase is recorded as a property of the test, it ends up in the junit xml report.
+"""
+import hashlib
+import io
+import json
+import os
+import shutil
+import tarfile
+import time
+from contextlib import contextmanager
+
+import pytest
+import tox
+from tox.session import Session
+
+import tox_conda.plugin
+from tox_conda import marker, pkgs
+from tox_conda.env_activator import activate_env
+
+# Number of files of the base package, enough for linking to show in the timings.
+BASE_FILES = 200
+ACTIVATE_SCRIPT = "export TOX_CONDA_PERF_ACTIVATED=1\n"
+
+pytestmark = [
+    pytest.mark.skipif(tox.INFO.IS_WIN, reason="the synthetic packages only activate on posix"),
+    pytest.mark.skipif(
+        not os.environ.get("CONDA_EXE") and shutil.which("conda") is None,
+        reason="conda is not installed",
+    ),
+]
+
+
+def _sha256(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def build_package(directory, name, version, files, depends=()):
+    """Write the noarch package ``name`` with ``files``, a dict of path to bytes.
+
+    Return its repodata record.
+    """
+    index = {
+        "name": name,
+        "version": version,
+        "build": "0",
+        "build_number": 0,
+        "depends": list(depends),
+        "noarch": "generic",
+        "subdir": "noarch",
+        "arch": None,
+        "platform": None,
+        "license": "MIT",
+        "timestamp": 0,
+    }
+    paths = [
+        {
+            "_path": path,
+            "path_type": "hardlink",
+            "sha256": _sha256(data),
+            "size_in_bytes": len(data),
+        }
+        for path, data in sorted(files.items())
+    ]
+    members = dict(files)
+    members["info/index.json"] = json.dumps(index).encode()
+    members["info/paths.json"] = json.dumps({"paths": paths, "paths_version": 1}).encode()
+    members["info/files"] = "".join(path + "\n" for path in sorted(files)).encode()
+
+    filename = "{}-{}-0.tar.bz2".format(name, version)
+    path = os.path.join(directory, filename)
+    with tarfile.open(path, "w:bz2") as package:
+        for member, data in sorted(members.items()):
+            info = tarfile.TarInfo(member)
+            info.size = len(data)
+            package.addfile(info, io.BytesIO(data))
+
+    with open(path, "rb") as stream:
+        data = stream.read()
+    record = {key: index[key] for key in ("name", "version", "build", "build_number")}
+    record.update(depends=index["depends"], noarch="generic", subdir="noarch", license="MIT")
+    record.update(md5=hashlib.md5(data).hexdigest(), sha256=_sha256(data), size=len(data))
+    return filename, record
+
+
+def write_repodata(directory, subdir, records):
+    os.makedirs(directory, exist_ok=True)
+    repodata = {
+        "info": {"subdir": subdir},
+        "packages": records,
+        "packages.conda": {},
+        "repodata_version": 1,
+    }
+    with open(os.path.join(directory, "repodata.json"), "w") as stream:
+        json.dump(repodata, stream, sort_keys=True)
+
+
+@pytest.fixture(scope="module")
+def local_channel(tmpdir_factory):
+    """Return the ``file://`` URL of a channel of synthetic packages.
+
+    ``perf-app`` depends on ``perf-base``, which has an activation script.
+    """
+    channel = tmpdir_factory.mktemp("channel")
+    noarch = channel.ensure("noarch", dir=1)
+    base_files = {
+        "share/tox-conda-perf/{:04d}.txt".format(number): "{}\n".format(number).encode()
+        for number in range(BASE_FILES)
+    }
+    base_files["etc/conda/activate.d/tox-conda-perf.sh"] = ACTIVATE_SCRIPT.encode()
+    app_files = {"share/tox-conda-perf/app.txt": b"app\n"}
+    records = dict(
+        [
+            build_package(str(noarch), "perf-base", "1.0", base_files),
+            build_package(str(noarch), "perf-app", "1.0", app_files, depends=["perf-base"]),
+        ]
+    )
+    write_repodata(str(noarch), "noarch", records)
+    # conda also reads the channel for the platform of the machine.
+    write_repodata(str(channel.join(pkgs.current_subdir())), pkgs.current_subdir(), {})
+    return pkgs.path_to_url(str(channel))
+
+
+@contextmanager
+def timed(timings, phase):
+    start = time.perf_counter()
+    yield
+    timings[phase] = time.perf_counter() - start
+
+
+def test_offline_phases(newconfig, local_channel, tmpdir, monkeypatch, record_property):
+    # An empty package cache, so that the packages are extracted as part of the timings.
+    monkeypatch.setenv("CONDA_PKGS_DIRS", str(tmpdir.join("pkgs")))
+    config = newconfig(
+        [],
+        """
+        [tox]
+        skipsdist = True
+        [testenv:perf]
+        basepython = none
+        conda_channels = {}
+        conda_create_args = --override-channels
+        conda_install_args = --override-channels
+        conda_deps = perf-app
+        """.format(
+            local_channel
+        ),
+    )
+    timings = {}
+
+    venv = Session(config).getvenv("perf")
+    action = venv.new_action("perf")
+    with timed(timings, "create"):
+        tox_conda.plugin.tox_testenv_create(venv, action)
+    with timed(timings, "install"):
+        tox_conda.plugin.tox_testenv_install_deps(venv, action)
+    with timed(timings, "activate"), activate_env(venv, action):
+        output = action.popen(
+            ["sh", "-c", "echo $TOX_CONDA_PERF_ACTIVATED"], report_fail=True, returnout=True
+        )
+
+    envdir = venv.envconfig.envdir
+    assert envdir.join("share", "tox-conda-perf", "app.txt").check()
+    assert len(envdir.join("share", "tox-conda-perf").listdir()) == BASE_FILES + 1
+    assert output.strip() == "1"
+    assert marker.read_marker(envdir) is not None
+
+    # A new session finds the env up to date.
+    venv = Session(config).getvenv("perf")
+    action = venv.new_action("perf")
+    with timed(timings, "reuse"):
+        tox_conda.plugin.tox_testenv_create(venv, action)
+    assert venv.envconfig.conda_reused
+
+    for phase, seconds in sorted(timings.items()):
+        record_property("{}_seconds".format(phase), round(seconds, 3))
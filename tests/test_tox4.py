@@ -0,0 +1,70 @@
+import os
+import subprocess
+import sys
+import textwrap
+
+import pytest
+import tox
+
+pytestmark = [
+    pytest.mark.skipif(int(tox.__version__.split(".")[0]) < 4, reason="requires tox 4"),
+    pytest.mark.skipif(sys.platform == "win32", reason="the fake conda is a shell script"),
+]
+
+FAKE_CONDA = """#!/bin/sh
+if [ "$1" = "shell.posix" ]; then
+    echo "export CONDA_PREFIX='$3'"
+    exit 0
+fi
+echo "$@" >> "$(dirname "$0")/calls"
+while [ "$1" != "-p" ]; do shift; done
+mkdir -p "$2/bin" "$2/conda-meta"
+ln -sf "{python}" "$2/bin/python"
+"""
+
+
+def test_conda_runner(tmp_path):
+    fake_conda = tmp_path / "conda"
+    fake_conda.write_text(FAKE_CONDA.format(python=sys.executable))
+    fake_conda.chmod(0o755)
+    (tmp_path / "tox.ini").write_text(
+        textwrap.dedent(
+            """
+            [tox]
+            skipsdist = true
+            [testenv:py]
+            base_python = python{}.{}
+            conda_deps = numpy
+            conda_channels = conda-forge
+            commands = python -c "import os; print('prefix:', os.environ['CONDA_PREFIX'])"
+            """.format(
+                *sys.version_info[:2]
+            )
+        )
+    )
+    env = dict(os.environ, CONDA_EXE=str(fake_conda))
+    env.pop("_CONDA_EXE", None)
+
+    result = subprocess.run(
+        [sys.executable, "-m", "tox", "-e", "py", "-c", str(tmp_path / "tox.ini")],
+        cwd=str(tmp_path),
+        env=env,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        universal_newlines=True,
+    )
+
+    assert result.returncode == 0, result.stdout
+    envdir = tmp_path / ".tox" / "py"
+    assert "prefix: {}".format(envdir) in result.stdout
+    python = "python={}.{}".format(*sys.version_info[:2])
+    create, install = (tmp_path / "calls").read_text().splitlines()
+    assert create.split() == [
+        "create",
+        "--yes",
+        "-p",
+        str(envdir),
+        "--channel=conda-forge",
+        python,
+    ]
+    assert install.split()[-2:] == [python, "numpy"]
@@ -0,0 +1,70 @@
+"""Record the environment variables set by activating an anaconda env."""
+import json
+import os
+import shlex
+import subprocess
+import sys
+
+# Print the environment as JSON, without any space so that cmd.exe does not need quoting.
+_DUMP_ENVIRON = "import json,os;print(json.dumps(dict(os.environ)))"
+# Variables maintained by the shell itself rather than by the activation.
+_SHELL_VARIABLES = {"_", "OLDPWD", "PWD", "SHLVL"}
+
+
+class ActivationEnv:
+    """The changes made to the environment variables by activating an anaconda env."""
+
+    def __init__(self, path_prefix, set_vars, unset_vars):
+        self.path_prefix = path_prefix
+        self.set_vars = set_vars
+        self.unset_vars = unset_vars
+
+    @classmethod
+    def compute(cls, conda_exe, envdir, base_env=None):
+        """Activate ``envdir`` in a shell once and record what the activation changed.
+
+        The activation scripts of the env, e.g. the ones in ``etc/conda/activate.d``, are run
+        as part of it.
+        """
+        base_env = dict(os.environ if base_env is None else base_env)
+        if sys.platform == "win32":
+            args = ["cmd.exe", "/c", "conda.bat", "activate", str(envdir), "&&"]
+            args += [sys.executable, "-c", _DUMP_ENVIRON]
+        else:
+            script = 'eval "$({} shell.posix activate {})" && exec {} -c {}'.format(
+                shlex.quote(str(conda_exe)),
+                shlex.quote(str(envdir)),
+                shlex.quote(sys.executable),
+                shlex.quote(_DUMP_ENVIRON),
+            )
+            args = ["/bin/sh", "-c", script]
+        output = subprocess.check_output(args, env=base_env, universal_newlines=True)
+        return cls.from_environs(base_env, json.loads(output.strip().splitlines()[-1]))
+
+    @classmethod
+    def from_environs(cls, before, after):
+        path_key = _path_key(after)
+        before_path = before.get(_path_key(before), "").split(os.pathsep)
+        after_path = after.get(path_key, "").split(os.pathsep)
+        path_prefix = [entry for entry in after_path if entry and entry not in before_path]
+        set_vars = {
+            key: value
+            for key, value in after.items()
+            if key != path_key and key not in _SHELL_VARIABLES and before.get(key) != value
+        }
+        unset_vars = [key for key in before if key not in after and key != _path_key(before)]
+        return cls(path_prefix, set_vars, unset_vars)
+
+    def apply(self, env):
+        """Return a copy of ``env`` as it would be within the activated env."""
+        env = dict(env)
+        for key in self.unset_vars:
+            env.pop(key, None)
+        env.update(self.set_vars)
+        path_key = _path_key(env)
+        env[path_key] = os.pathsep.join(self.path_prefix + [env.get(path_key, "")])
+        return env
+
+
+def _path_key(env):
+    return next((key for key in env if key.upper() == "PATH"), "PATH")
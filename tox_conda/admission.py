@@ -0,0 +1,215 @@
+"""Hold back conda processes until the machine has the memory they are expected to need.
+
+Solving a big spec can take several GB, so starting the solves of many envs at once, e.g.
+with ``tox -p auto``, gets workers killed for lack of memory. Each conda process reserves
+the peak memory used by the last run of the same command with the same conda inputs in a
+ledger shared by the processes of the run. A process is started once the available memory
+can hold its reservation on top of the part of the reservations of the processes still
+running that they do not use yet; the first process always starts, so the run makes
+progress even on a small machine. The memory available went down by what the running
+processes use since the first of them was admitted, so that much of their reservations is
+already accounted for.
+
+The available memory is read from ``/proc/meminfo`` and the memory cgroup of the process,
+the peak memory of a conda process from ``getrusage``. Elsewhere than on Linux, nothing is
+held back.
+"""
+import json
+import os
+import time
+import uuid
+
+LEDGER_VERSION = 1
+# Reserved for a command that never ran before.
+DEFAULT_FOOTPRINT = 1 << 30
+POLL_INTERVAL = 1.0
+# Runs the command given as arguments, then writes the peak memory of its processes, in
+# bytes, to the file given as first argument.
+PEAK_SCRIPT = (
+    "import resource, subprocess, sys; "
+    "code = subprocess.call(sys.argv[2:]); "
+    "peak = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss; "
+    "open(sys.argv[1], 'w').write(str(peak * (1 if sys.platform == 'darwin' else 1024))); "
+    "sys.exit(code)"
+)
+# cgroup v1 reports this, rounded down to the page size, when there is no limit.
+_UNLIMITED = 1 << 62
+
+
+def meminfo_available(path="/proc/meminfo"):
+    """Return the memory available to new processes according to the kernel, in bytes."""
+    try:
+        with open(path) as stream:
+            for line in stream:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+def _read_int(path):
+    try:
+        with open(path) as stream:
+            value = stream.read().strip()
+    except OSError:
+        return None
+    if not value.isdigit():
+        # "max", the cgroup v2 value of no limit.
+        return None
+    return int(value)
+
+
+def _cgroup_dirs(root, cgroup_path):
+    """Yield the directories of the memory cgroup of the process, its own one first."""
+    subpaths = []
+    try:
+        with open(cgroup_path) as stream:
+            for line in stream:
+                _, controllers, subpath = line.rstrip("\n").split(":", 2)
+                if controllers == "" or "memory" in controllers.split(","):
+                    subpaths.append((controllers, subpath.lstrip("/")))
+    except (OSError, ValueError):
+        pass
+    for controllers, subpath in subpaths:
+        base = root if controllers == "" else os.path.join(root, "memory")
+        yield os.path.join(base, subpath)
+    yield root
+    yield os.path.join(root, "memory")
+
+
+def cgroup_available(root="/sys/fs/cgroup", cgroup_path="/proc/self/cgroup"):
+    """Return the memory left under the limit of the memory cgroup, ``None`` without limit."""
+    for directory in _cgroup_dirs(root, cgroup_path):
+        for limit_name, usage_name in (
+            ("memory.max", "memory.current"),
+            ("memory.limit_in_bytes", "memory.usage_in_bytes"),
+        ):
+            limit = _read_int(os.path.join(directory, limit_name))
+            usage = _read_int(os.path.join(directory, usage_name))
+            if limit is not None and usage is not None and limit < _UNLIMITED:
+                return max(limit - usage, 0)
+    return None
+
+
+def available_memory():
+    """Return the memory available to new processes, ``None`` when it cannot be told."""
+    values = [value for value in (meminfo_available(), cgroup_available()) if value is not None]
+    return min(values) if values else None
+
+
+def peak_command(args, python, peak_path):
+    """Return the command line ``args`` wrapped to write its peak memory to ``peak_path``."""
+    return [python, "-c", PEAK_SCRIPT, str(peak_path)] + [str(arg) for arg in args]
+
+
+def read_peak(peak_path):
+    """Return the peak memory written by a wrapped command, ``None`` if there is none."""
+    try:
+        with open(str(peak_path)) as stream:
+            return int(stream.read())
+    except (OSError, ValueError):
+        return None
+
+
+def _is_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def unused_reservations(reservations, available):
+    """Return the bytes of ``reservations`` that their processes do not use yet.
+
+    The memory used by the processes is taken as the drop of the memory ``available`` since
+    the first of them was admitted, before it started: the others were admitted later.
+    """
+    reservations = list(reservations)
+    reserved = sum(item["bytes"] for item in reservations)
+    first = min(reservations, key=lambda item: item.get("time", 0))
+    if first.get("available") is None:
+        return reserved
+    used = max(first["available"] - available, 0)
+    return max(reserved - used, 0)
+
+
+class Ledger:
+    """The reservations of the running conda processes and the peaks of earlier ones."""
+
+    def __init__(self, path, available=available_memory, sleep=time.sleep):
+        self.path = str(path)
+        self._available = available
+        self._sleep = sleep
+
+    def _lock(self):
+        import filelock
+
+        return filelock.FileLock(self.path + ".lock")
+
+    def _load(self):
+        try:
+            with open(self.path) as stream:
+                ledger = json.load(stream)
+        except (OSError, ValueError):
+            ledger = None
+        if not isinstance(ledger, dict) or ledger.get("version") != LEDGER_VERSION:
+            ledger = {"version": LEDGER_VERSION, "peaks": {}, "reservations": {}}
+        ledger["reservations"] = {
+            name: reservation
+            for name, reservation in ledger["reservations"].items()
+            if _is_alive(reservation["pid"])
+        }
+        return ledger
+
+    def _save(self, ledger):
+        tmp_path = "{}.{}.tmp".format(self.path, uuid.uuid4().hex)
+        with open(tmp_path, "w") as stream:
+            json.dump(ledger, stream, sort_keys=True)
+        os.replace(tmp_path, self.path)
+
+    def admit(self, key, on_wait=None):
+        """Wait until the process ``key`` fits in the available memory and reserve it.
+
+        ``on_wait(needed, available)`` is called once when the process has to wait, with
+        the bytes it needs and the ones available besides the reservations. Return
+        the name of the reservation, to release it once the process is done.
+        """
+        waited = False
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        while True:
+            with self._lock():
+                ledger = self._load()
+                needed = ledger["peaks"].get(key, DEFAULT_FOOTPRINT)
+                available = self._available()
+                if not ledger["reservations"] or available is None:
+                    fits = True
+                else:
+                    unused = unused_reservations(ledger["reservations"].values(), available)
+                    fits = unused + needed <= available
+                if fits:
+                    name = uuid.uuid4().hex
+                    ledger["reservations"][name] = {
+                        "pid": os.getpid(),
+                        "bytes": needed,
+                        "available": available,
+                        "time": time.time(),
+                    }
+                    self._save(ledger)
+                    return name
+            if not waited and on_wait is not None:
+                on_wait(needed, available - unused)
+            waited = True
+            self._sleep(POLL_INTERVAL)
+
+    def release(self, name, key, peak=None):
+        """Release the reservation ``name``, recording the ``peak`` memory of ``key``."""
+        with self._lock():
+            ledger = self._load()
+            ledger["reservations"].pop(name, None)
+            if peak:
+                ledger["peaks"][key] = peak
+            self._save(ledger)
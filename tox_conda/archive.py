@@ -0,0 +1,189 @@
+"""Pack complete conda prefixes into relocatable archives and restore them elsewhere.
+
+Conda embeds the absolute path of a prefix in some of its files. The files concerned are
+listed in ``conda-meta``, so they are recorded when packing and the old prefix is replaced
+by the new one when restoring, the same way conda does it when linking a package.
+"""
+import json
+import os
+import re
+import uuid
+
+from . import drift, marker, meta
+
+ARCHIVE_SUFFIX = ".tar.gz"
+INFO_NAME = ".tox-conda-archive.json"
+INFO_VERSION = 1
+# Entries of an env dir that are not part of the conda prefix.
+_EXCLUDED = {
+    "log",
+    ".lock",
+    ".tox-config1",
+    marker.MARKER_NAME,
+    drift.FINGERPRINT_NAME,
+    INFO_NAME,
+}
+
+
+class ArchiveError(Exception):
+    """An archive cannot be written or restored."""
+
+
+class RelocationError(ArchiveError):
+    """The prefix of a restored env cannot be rewritten."""
+
+
+def archive_path(cache_dir, inputs):
+    """Return the path of the archive of the prefixes built from ``inputs``."""
+    return os.path.join(str(cache_dir), marker.inputs_hash(inputs) + ARCHIVE_SUFFIX)
+
+
+def prefix_files(prefix):
+    """Return ``[path, mode]`` of the files of ``prefix`` embedding the prefix path.
+
+    ``mode`` is ``"text"`` or ``"binary"``, as conda records it.
+    """
+    files = []
+    for record in meta.iter_records(prefix):
+        for entry in (record.get("paths_data") or {}).get("paths", ()):
+            if "prefix_placeholder" in entry:
+                files.append([entry["_path"], entry.get("file_mode", "text")])
+            elif entry.get("path_type") in (
+                "unix_python_entry_point",
+                "windows_python_entry_point_script",
+            ):
+                # Created by conda at link time, the shebang points into the prefix.
+                files.append([entry["_path"], "text"])
+    return files
+
+
+def pack(prefix, path):
+    """Write the conda prefix ``prefix`` into the archive ``path``.
+
+    The archive is written to a temporary file first, so a concurrent reader sees either no
+    archive or a complete one.
+    """
+    import tarfile
+
+    prefix = os.path.normpath(str(prefix))
+    info = {"version": INFO_VERSION, "prefix": prefix, "files": prefix_files(prefix)}
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = "{}.{}.tmp".format(path, uuid.uuid4().hex)
+    try:
+        with tarfile.open(tmp_path, "w:gz", compresslevel=1) as archive:
+            # First member, so that it is known before any file is extracted from a stream.
+            info_path = os.path.join(prefix, INFO_NAME)
+            with open(info_path, "w") as stream:
+                json.dump(info, stream, sort_keys=True)
+            try:
+                archive.add(info_path, arcname=INFO_NAME)
+            finally:
+                os.remove(info_path)
+            for name in sorted(os.listdir(prefix)):
+                if name not in _EXCLUDED:
+                    archive.add(os.path.join(prefix, name), arcname=name)
+        os.replace(tmp_path, path)
+    except BaseException as exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        if isinstance(exception, tarfile.TarError):
+            raise ArchiveError(str(exception))
+        raise
+
+
+def unpack(path, prefix):
+    """Extract the archive ``path`` into ``prefix`` and make it a valid prefix there.
+
+    The archive is read as a stream, without seeking back into it.
+    """
+    import tarfile
+
+    prefix = os.path.normpath(str(prefix))
+    os.makedirs(prefix, exist_ok=True)
+    try:
+        with tarfile.open(path, "r|gz") as archive:
+            if hasattr(tarfile, "tar_filter"):
+                archive.extraction_filter = _extraction_filter
+            archive.extractall(prefix)
+    except tarfile.TarError as exception:
+        raise ArchiveError(str(exception))
+    info_path = os.path.join(prefix, INFO_NAME)
+    with open(info_path) as stream:
+        info = json.load(stream)
+    os.remove(info_path)
+    if info.get("version") != INFO_VERSION:
+        raise RelocationError("unsupported archive version {}".format(info.get("version")))
+    relocate(prefix, info["prefix"], info["files"])
+
+
+def _extraction_filter(member, dest_path):
+    """Filter ``member`` as ``tarfile.tar_filter`` does, except for the target of symlinks.
+
+    Conda prefixes hold absolute symlinks, into the prefix, rewritten by ``relocate``, or to
+    files of the system. Members are still refused a path outside of ``dest_path``.
+    """
+    import tarfile
+
+    if not member.issym():
+        return tarfile.tar_filter(member, dest_path)
+    filtered = tarfile.tar_filter(member.replace(linkname="", deep=False), dest_path)
+    return filtered.replace(linkname=member.linkname, deep=False)
+
+
+def relocate(prefix, old_prefix, files):
+    """Replace ``old_prefix`` by ``prefix`` in ``files`` and in the symlinks of ``prefix``."""
+    if prefix == old_prefix:
+        return
+    old, new = old_prefix.encode("utf-8"), prefix.encode("utf-8")
+    for name, mode in files:
+        path = os.path.join(prefix, name)
+        if os.path.islink(path) or not os.path.isfile(path):
+            continue
+        with open(path, "rb") as stream:
+            data = stream.read()
+        if old not in data:
+            continue
+        if mode == "binary":
+            data = binary_replace(data, old, new)
+        else:
+            data = data.replace(old, new)
+        _rewrite(path, data)
+
+    for root, dirs, names in os.walk(prefix):
+        for name in dirs + names:
+            path = os.path.join(root, name)
+            if not os.path.islink(path):
+                continue
+            target = os.readlink(path)
+            if target == old_prefix or target.startswith(old_prefix + os.sep):
+                os.remove(path)
+                os.symlink(prefix + target[len(old_prefix) :], path)
+
+
+def binary_replace(data, old, new):
+    """Replace ``old`` by ``new`` in the null terminated strings of ``data``.
+
+    The strings are padded with null bytes to keep all offsets of the binary unchanged, which
+    requires ``new`` to be at most as long as ``old``.
+    """
+    if len(new) > len(old):
+        raise RelocationError(
+            "cannot relocate binaries to {!r}, it is longer than {!r}".format(new, old)
+        )
+    padding = len(old) - len(new)
+
+    def replace(match):
+        occurrences = match.group().count(old)
+        return match.group().replace(old, new) + b"\0" * (padding * occurrences)
+
+    return re.sub(re.escape(old) + b"[^\0]*", replace, data)
+
+
+def _rewrite(path, data):
+    # Files may be hard links into conda's package cache, never write through them.
+    mode = os.stat(path).st_mode
+    tmp_path = "{}.{}.tmp".format(path, uuid.uuid4().hex)
+    with open(tmp_path, "wb") as stream:
+        stream.write(data)
+    os.chmod(tmp_path, mode)
+    os.replace(tmp_path, path)
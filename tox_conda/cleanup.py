@@ -0,0 +1,92 @@
+"""Discard old conda prefixes without blocking the creation of the new one."""
+import os
+import shutil
+import threading
+import uuid
+
+TRASH_DIR_NAME = ".tox-conda-trash"
+
+_pending = {}
+_pending_lock = threading.Lock()
+
+
+def trash_path(envdir):
+    """Return the trash directory used for prefixes discarded from ``envdir``.
+
+    It is a sibling of ``envdir`` so that moving a prefix there is a rename on the same
+    filesystem rather than a copy.
+    """
+    return os.path.join(os.path.dirname(os.path.normpath(str(envdir))), TRASH_DIR_NAME)
+
+
+def move_aside(envdir, keep=()):
+    """Rename the content of ``envdir`` into the trash and delete it in the background.
+
+    Entries listed in ``keep`` are left in place. When nothing has to be kept, the whole
+    directory is renamed in a single atomic operation. Return ``False`` if something could
+    not be renamed, in which case the caller has to delete it the slow way.
+    """
+    envdir = str(envdir)
+    trash = trash_path(envdir)
+    sweep(trash)
+    if not os.path.isdir(envdir):
+        return True
+
+    os.makedirs(trash, exist_ok=True)
+    if keep:
+        sources = [os.path.join(envdir, name) for name in os.listdir(envdir) if name not in keep]
+    else:
+        sources = [envdir]
+
+    moved_all = True
+    for source in sources:
+        target = os.path.join(trash, uuid.uuid4().hex)
+        try:
+            os.rename(source, target)
+        except OSError:
+            moved_all = False
+        else:
+            _delete_in_background(target)
+    return moved_all
+
+
+def sweep(trash):
+    """Delete the leftovers of previous runs that were interrupted before their cleanup."""
+    try:
+        names = os.listdir(trash)
+    except OSError:
+        return
+    for name in names:
+        _delete_in_background(os.path.join(trash, name))
+
+
+def wait():
+    """Block until all background deletions started by this process are done."""
+    with _pending_lock:
+        threads = list(_pending.values())
+    for thread in threads:
+        thread.join()
+
+
+def _delete_in_background(path):
+    with _pending_lock:
+        if path in _pending:
+            return
+        # Not a daemon thread: the interpreter waits for the deletion before exiting, and a
+        # deletion killed half way is picked up again by the next sweep anyway.
+        thread = threading.Thread(target=_delete, args=(path,), name="tox-conda-rmtree")
+        _pending[path] = thread
+    thread.start()
+
+
+def _delete(path):
+    try:
+        if os.path.isdir(path) and not os.path.islink(path):
+            shutil.rmtree(path, ignore_errors=True)
+        else:
+            os.remove(path)
+    except OSError:
+        pass
+    finally:
+        with _pending_lock:
+            _pending.pop(path, None)
@@ -0,0 +1,95 @@
+"""Detect the packages added to or removed from a conda prefix after it was provisioned.
+
+Once provisioned, the ``conda-meta`` records of a prefix are fingerprinted by their size and
+modification time, next to the spec line of each package. Checking a prefix then takes a
+single directory scan: when the records are unchanged, nothing else is read. Otherwise the
+missing packages can be installed again from their spec lines and the extra ones removed,
+without solving anything.
+"""
+import json
+import os
+
+from . import meta
+
+FINGERPRINT_NAME = ".tox-conda-fingerprint"
+FINGERPRINT_VERSION = 1
+
+
+class Drift:
+    """The packages of a prefix that differ from the ones it was provisioned with.
+
+    ``missing`` are the explicit spec lines of the packages to install again, ``None`` for
+    the ones whose origin is unknown, and ``extra`` the names of the packages to remove.
+    """
+
+    def __init__(self, missing, extra):
+        self.missing = missing
+        self.extra = extra
+
+    def __repr__(self):
+        return "Drift(missing={!r}, extra={!r})".format(self.missing, self.extra)
+
+
+def fingerprint_path(prefix):
+    return os.path.join(str(prefix), FINGERPRINT_NAME)
+
+
+def fingerprint(prefix):
+    """Return ``{record file name: [size, mtime_ns]}`` of the ``conda-meta`` records."""
+    result = {}
+    with os.scandir(meta.meta_dir(prefix)) as entries:
+        for entry in entries:
+            if entry.name.endswith(".json"):
+                stat = entry.stat()
+                result[entry.name] = [stat.st_size, stat.st_mtime_ns]
+    return result
+
+
+def record(prefix):
+    """Fingerprint the packages of ``prefix`` as it is now."""
+    specs = {}
+    directory = meta.meta_dir(prefix)
+    for name in os.listdir(directory):
+        if not name.endswith(".json"):
+            continue
+        with open(os.path.join(directory, name)) as stream:
+            package = json.load(stream)
+        url, md5 = package.get("url"), package.get("md5")
+        specs[name] = "{}#{}".format(url, md5) if url and md5 else url
+    content = {"version": FINGERPRINT_VERSION, "records": fingerprint(prefix), "specs": specs}
+    path = fingerprint_path(prefix)
+    tmp_path = "{}.{}.tmp".format(path, os.getpid())
+    with open(tmp_path, "w") as stream:
+        json.dump(content, stream, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def read_fingerprint(prefix):
+    try:
+        with open(fingerprint_path(prefix)) as stream:
+            content = json.load(stream)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(content, dict) or content.get("version") != FINGERPRINT_VERSION:
+        return None
+    return content
+
+
+def find_drift(prefix):
+    """Return the ``Drift`` of ``prefix`` since it was fingerprinted.
+
+    ``None`` is returned when it was never fingerprinted or nothing changed. An empty
+    ``Drift`` means that records changed without any package being added or removed.
+    """
+    recorded = read_fingerprint(prefix)
+    if recorded is None:
+        return None
+    current = fingerprint(prefix)
+    if current == recorded["records"]:
+        return None
+    missing = sorted(set(recorded["records"]) - set(current))
+    extra = []
+    for name in sorted(set(current) - set(recorded["records"])):
+        with open(os.path.join(meta.meta_dir(prefix), name)) as stream:
+            extra.append(json.load(stream)["name"])
+    return Drift([recorded["specs"].get(name) for name in missing], extra)
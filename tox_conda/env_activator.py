@@ -2,11 +2,14 @@
 import abc
 import os
 import shlex
+import subprocess
 import tempfile
 from contextlib import contextmanager
 
 import tox
 
+from .activation import ActivationEnv
+
 
 class PopenInActivatedEnvBase(abc.ABC):
     """A base functor that wraps popen calls in an activated anaconda env."""
@@ -17,12 +20,16 @@ class PopenInActivatedEnvBase(abc.ABC):
 
     def __call__(self, cmd_args, **kwargs):
         wrapped_cmd_args = self._wrap_cmd_args(cmd_args)
-        return self.__popen(wrapped_cmd_args, **kwargs)
+        return self.__popen(wrapped_cmd_args, **self._wrap_kwargs(kwargs))
 
     @abc.abstractmethod
     def _wrap_cmd_args(self, cmd_args):
         """Return the wrapped command arguments."""
 
+    def _wrap_kwargs(self, kwargs):
+        """Return the wrapped popen keyword arguments."""
+        return kwargs
+
 
 class PopenInActivatedEnvPosix(PopenInActivatedEnvBase):
     """Wrap popen calls in an activated anaconda env for POSIX platforms.
@@ -37,7 +44,7 @@ class PopenInActivatedEnvPosix(PopenInActivatedEnvBase):
 
     def _wrap_cmd_args(self, cmd_args):
         conda_exe = shlex.quote(str(self._venv.envconfig.conda_exe))
-        envdir = shlex.quote(str(self._venv.envconfig.envdir))
+        envdir = shlex.quote(str(get_prefix(self._venv.envconfig)))
 
         conda_activate_cmd = 'eval "$({conda_exe} shell.posix activate {envdir})"'.format(
             conda_exe=conda_exe, envdir=envdir
@@ -85,7 +92,7 @@ class PopenInActivatedEnvWindows(PopenInActivatedEnvBase):
         return output
 
     def _wrap_cmd_args(self, cmd_args):
-        return ["conda.bat", "activate", str(self._venv.envconfig.envdir), "&&"] + cmd_args
+        return ["conda.bat", "activate", str(get_prefix(self._venv.envconfig)), "&&"] + cmd_args
 
     def __ensure_comspecs_is_cmd_exe(self):
         if os.path.basename(os.environ.get("COMSPEC", "")).lower() == "cmd.exe":
@@ -104,6 +111,51 @@ class PopenInActivatedEnvWindows(PopenInActivatedEnvBase):
             raise SystemExit(0)
 
 
+class PopenWithActivationEnv(PopenInActivatedEnvBase):
+    """Run popen calls directly with the environment variables of an activated anaconda env.
+
+    The activation is computed once per env and run, instead of going through a shell that
+    activates the env for every single command.
+    """
+
+    def _wrap_cmd_args(self, cmd_args):
+        return cmd_args
+
+    def _wrap_kwargs(self, kwargs):
+        kwargs = dict(kwargs)
+        kwargs["env"] = get_activation_env(self._venv).apply(kwargs.get("env") or os.environ)
+        metrics = getattr(self._venv.envconfig.config, "conda_metrics", None)
+        if metrics is not None:
+            metrics.inc("tox_conda_activations_avoided_total")
+        return kwargs
+
+
+def get_prefix(envconfig):
+    """Return the conda prefix the env runs in, its ``conda_prefix`` or else its envdir."""
+    prefix = getattr(envconfig, "conda_prefix", None)
+    return envconfig.envdir if prefix is None else prefix
+
+
+def get_activation_env(venv):
+    """Return the activation of the env of ``venv``, computing it on first use.
+
+    ``None`` is returned when the activation could not be recorded, commands then have to
+    activate the env themselves.
+    """
+    envconfig = venv.envconfig
+    if not hasattr(envconfig, "conda_activation_env"):
+        try:
+            activation = ActivationEnv.compute(envconfig.conda_exe, get_prefix(envconfig))
+        except (OSError, ValueError, subprocess.CalledProcessError) as exception:
+            tox.reporter.warning(
+                "could not record the activation of {}, activating it for every command: "
+                "{}".format(get_prefix(envconfig), exception)
+            )
+            activation = None
+        envconfig.conda_activation_env = activation
+    return envconfig.conda_activation_env
+
+
 if tox.INFO.IS_WIN:
     PopenInActivatedEnv = PopenInActivatedEnvWindows
 else:
@@ -113,12 +165,17 @@ else:
 @contextmanager
 def activate_env(venv, action=None):
     """Run a command in a temporary activated anaconda env."""
+    if getattr(venv.envconfig, "conda_activate_once", False) and get_activation_env(venv):
+        popen_class = PopenWithActivationEnv
+    else:
+        popen_class = PopenInActivatedEnv
+
     if action is None:
         initial_popen = venv.popen
-        venv.popen = PopenInActivatedEnv(venv, initial_popen)
+        venv.popen = popen_class(venv, initial_popen)
     else:
         initial_popen = action.via_popen
-        action.via_popen = PopenInActivatedEnv(venv, initial_popen)
+        action.via_popen = popen_class(venv, initial_popen)
 
     yield
 
@@ -0,0 +1,17 @@
+"""The hooks registered with tox, from the implementation matching the installed tox."""
+from tox import __version__ as tox_version
+
+if int(tox_version.split(".")[0]) >= 4:
+    from .tox4 import tox_register_tox_env  # noqa: F401
+else:
+    from .plugin import (  # noqa: F401
+        tox_addoption,
+        tox_cleanup,
+        tox_configure,
+        tox_get_python_executable,
+        tox_runtest,
+        tox_runtest_post,
+        tox_runtest_pre,
+        tox_testenv_create,
+        tox_testenv_install_deps,
+    )
@@ -0,0 +1,145 @@
+"""Record which conda inputs an env prefix has been completely provisioned with.
+
+The marker is written atomically once all conda steps succeeded, so its presence proves
+that the prefix is complete and its content tells whether it still matches the config.
+"""
+import hashlib
+import json
+import os
+import platform
+import sys
+
+from . import matchspec
+
+MARKER_NAME = ".tox-conda-marker"
+MARKER_VERSION = 1
+
+
+def file_digest(path):
+    """Return the sha256 of the content of ``path``, ``None`` when it cannot be read."""
+    if path is None:
+        return None
+    digest = hashlib.sha256()
+    try:
+        with open(str(path), "rb") as stream:
+            for chunk in iter(lambda: stream.read(1 << 20), b""):
+                digest.update(chunk)
+    except OSError:
+        return None
+    return digest.hexdigest()
+
+
+def _text_digest(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def spec_file_digest(path):
+    """Return the digest of the specs of a conda spec file, ``None`` when it cannot be read.
+
+    The specs are digested in their canonical form and sorted, so that neither their
+    spelling nor their order changes the digest. An ``@EXPLICIT`` spec file is digested as
+    it is, its order matters.
+    """
+    if path is None:
+        return None
+    try:
+        specs = matchspec.read_spec_file(path)
+        if specs is None:
+            return file_digest(path)
+        return _text_digest("\n".join(matchspec.canonical_specs(spec for _, spec in specs)))
+    except OSError:
+        return None
+    except ValueError:
+        return file_digest(path)
+
+
+def env_file_digest(path):
+    """Return the digest of a conda environment.yml file in its canonical form."""
+    if path is None:
+        return None
+    try:
+        content = matchspec.canonical_env_file(matchspec.read_env_file(path))
+        return _text_digest(json.dumps(content, sort_keys=True, default=str))
+    except OSError:
+        return None
+    except ValueError:
+        return file_digest(path)
+
+
+def conda_inputs(
+    python_packages,
+    deps=(),
+    channels=(),
+    create_args=(),
+    install_args=(),
+    spec_file=None,
+    env_file=None,
+    base_env=None,
+):
+    """Collect everything that determines the content of a conda prefix.
+
+    The deps are in their canonical form and sorted, and the channels are named the way
+    conda names them, so that equivalent configs give the same inputs. The order of the
+    channels is kept, it sets their priority.
+    """
+    inputs = {
+        "platform": "{}-{}".format(sys.platform, platform.machine().lower()),
+        "python": list(python_packages),
+        "deps": matchspec.canonical_specs(deps),
+        "channels": [matchspec.canonical_channel(channel) for channel in channels],
+        "create_args": [str(arg) for arg in create_args],
+        "install_args": [str(arg) for arg in install_args],
+        "spec_file": spec_file_digest(spec_file),
+        "env_file": env_file_digest(env_file),
+    }
+    if base_env is not None:
+        # Only recorded when there is one, the inputs of other envs keep their hash.
+        inputs["base_env"] = base_env
+    return inputs
+
+
+def inputs_hash(inputs):
+    """Return a stable digest of the conda inputs."""
+    payload = json.dumps(inputs, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def marker_path(envdir):
+    return os.path.join(str(envdir), MARKER_NAME)
+
+
+def read_marker(envdir):
+    """Return the content of the marker of ``envdir``, ``None`` if missing or unreadable."""
+    try:
+        with open(marker_path(envdir)) as stream:
+            marker = json.load(stream)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(marker, dict) or marker.get("version") != MARKER_VERSION:
+        return None
+    return marker
+
+
+def write_marker(envdir, inputs):
+    """Atomically mark ``envdir`` as completely provisioned from ``inputs``."""
+    envdir = str(envdir)
+    os.makedirs(envdir, exist_ok=True)
+    marker = {"version": MARKER_VERSION, "inputs_hash": inputs_hash(inputs), "inputs": inputs}
+    path = marker_path(envdir)
+    tmp_path = "{}.{}.tmp".format(path, os.getpid())
+    with open(tmp_path, "w") as stream:
+        json.dump(marker, stream, sort_keys=True, indent=2)
+    os.replace(tmp_path, path)
+    return marker
+
+
+def is_complete(envdir, inputs):
+    """Tell whether ``envdir`` holds a complete prefix provisioned from ``inputs``.
+
+    This only reads the marker and checks for ``conda-meta``, neither conda nor python is
+    invoked.
+    """
+    marker = read_marker(envdir)
+    if marker is None or marker.get("inputs_hash") != inputs_hash(inputs):
+        return False
+    return os.path.isdir(os.path.join(str(envdir), "conda-meta"))
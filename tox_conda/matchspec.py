@@ -0,0 +1,429 @@
+"""Parse conda match specs, e.g. ``conda-forge::numpy >=1.20``, without starting conda.
+
+Specs are checked before conda runs, so that a typo fails the run at once instead of
+minutes into a solve, and brought to a canonical form, so that equivalent spellings, e.g.
+``numpy>=1.20`` and ``numpy >= 1.20``, give the same conda inputs. Only the syntax used in
+dependency lists is handled: ``[channel::]name[ version[ build]]``, the ``name=version=build``
+form and trailing ``[key=value, ...]`` brackets. Versions are ordered as conda orders them,
+to check the packages of an existing prefix against the specs.
+"""
+import fnmatch
+import re
+
+# Locations of channels that conda also knows by their name, e.g. ``conda-forge``.
+CHANNEL_URLS = (
+    "https://conda.anaconda.org/",
+    "http://conda.anaconda.org/",
+    "https://repo.anaconda.com/",
+    "http://repo.anaconda.com/",
+)
+_NAME = re.compile(r"^[a-z0-9_][a-z0-9_.\-]*$")
+_BUILD = re.compile(r"^[A-Za-z0-9_.+*]+$")
+_CONSTRAINT = re.compile(r"^(==|!=|<=|>=|~=|<|>|=)?([A-Za-z0-9_.+!*]+)$")
+_BRACKET_ITEM = re.compile(
+    r"\s*([a-z_][a-z0-9_]*)\s*=\s*" r"""(?:'([^']*)'|"([^"]*)"|([^,'"]*?))\s*(?:,|$)"""
+)
+_SPLIT_NAME = re.compile(r"^([^\s=<>!~]+)(.*)$")
+_VERSION_ATOM = re.compile(r"\d+|[a-z]+")
+# An atom added to pad a version, e.g. 1.20 is 1.20.0.
+_ZERO = (2, 0)
+
+
+class MatchSpecError(ValueError):
+    """A conda spec that cannot be parsed."""
+
+    def __init__(self, spec, reason):
+        super().__init__(spec, reason)
+        self.spec = spec
+        self.reason = reason
+
+    def __str__(self):
+        return "invalid spec {!r}: {}".format(self.spec, self.reason)
+
+
+class MatchSpec:
+    """A parsed conda spec, whose ``str`` is its canonical form."""
+
+    def __init__(self, name, version=None, build=None, channel=None, extras=None):
+        self.name = name
+        self.version = version
+        self.build = build
+        self.channel = channel
+        self.extras = dict(extras or {})
+
+    def __str__(self):
+        text = self.name if self.channel is None else "{}::{}".format(self.channel, self.name)
+        if self.version is not None or self.build is not None:
+            text += " {}".format(self.version or "*")
+        if self.build is not None:
+            text += " {}".format(self.build)
+        if self.extras:
+            items = ("{}='{}'".format(key, value) for key, value in sorted(self.extras.items()))
+            text += "[{}]".format(",".join(items))
+        return text
+
+    def __repr__(self):
+        return "MatchSpec({!r})".format(str(self))
+
+    def __eq__(self, other):
+        return isinstance(other, MatchSpec) and str(self) == str(other)
+
+    def __hash__(self):
+        return hash(str(self))
+
+    @property
+    def pin(self):
+        """Return ``(version, exact)`` when the spec pins a version, ``None`` otherwise.
+
+        ``exact`` is false for a version and all of its subversions, e.g. ``1.20.*``.
+        """
+        if self.version is None or re.search(r"[,|]", self.version):
+            return None
+        if self.version.startswith("=="):
+            version, exact = self.version[2:], True
+        elif self.version.endswith(".*"):
+            version, exact = self.version[:-2], False
+        else:
+            return None
+        if "*" in version:
+            return None
+        return version, exact
+
+    def matches_version(self, version):
+        """Tell whether the package ``version`` satisfies the version of the spec."""
+        return self.version is None or version_matches(self.version, version)
+
+
+def canonical_channel(channel):
+    """Return the name conda knows ``channel`` by, e.g. ``conda-forge`` for its URL."""
+    channel = str(channel).strip().rstrip("/")
+    for url in CHANNEL_URLS:
+        if channel.startswith(url) and len(channel) > len(url):
+            return channel[len(url) :]
+    return channel
+
+
+def _parse_brackets(spec, text):
+    """Return the spec without its trailing brackets, and the items of the brackets."""
+    if "[" not in text and "]" not in text:
+        return text, {}
+    start = text.find("[")
+    if start == -1 or not text.endswith("]") or text.count("[") != 1 or text.count("]") != 1:
+        raise MatchSpecError(spec, "unbalanced brackets")
+    content = text[start + 1 : -1]
+    items = {}
+    position = 0
+    while position < len(content):
+        match = _BRACKET_ITEM.match(content, position)
+        if match is None or match.end() == position:
+            raise MatchSpecError(spec, "invalid bracket item {!r}".format(content[position:]))
+        key = match.group(1)
+        value = next(group for group in match.group(2, 3, 4) if group is not None)
+        items[key] = value.strip()
+        position = match.end()
+    return text[:start], items
+
+
+def _canonical_constraint(spec, constraint):
+    match = _CONSTRAINT.match(constraint)
+    if match is None and constraint in ("==", "!=", "<=", ">=", "~=", "<", ">", "="):
+        raise MatchSpecError(spec, "missing version after {!r}".format(constraint))
+    if match is None:
+        raise MatchSpecError(spec, "invalid version {!r}".format(constraint))
+    operator, version = match.groups()
+    if operator is None:
+        # A bare version is exact, unless it is a pattern.
+        return version if "*" in version else "==" + version
+    if operator == "=":
+        # A version and all of its subversions.
+        return version if "*" in version else version + ".*"
+    if operator == "==" and version.endswith(".*"):
+        return version
+    if version == "*":
+        raise MatchSpecError(spec, "invalid version {!r}".format(constraint))
+    return operator + version
+
+
+def canonical_version(spec, version):
+    """Return the canonical form of the version constraints ``version``, ``None`` for any."""
+    version = re.sub(r"\s*([,|])\s*", r"\1", version.strip())
+    if version in ("", "*"):
+        return None
+    groups = []
+    for group in version.split("|"):
+        constraints = [_canonical_constraint(spec, item) for item in group.split(",")]
+        groups.append(",".join(constraints))
+    return "|".join(groups)
+
+
+def parse(spec):
+    """Parse the conda spec ``spec``, raising ``MatchSpecError`` when it is invalid."""
+    text = re.sub(r"(^|\s+)#.*$", "", str(spec)).strip()
+    if not text:
+        raise MatchSpecError(spec, "empty spec")
+    text, items = _parse_brackets(spec, text)
+    channel = None
+    if "::" in text:
+        channel, _, text = text.rpartition("::")
+        channel = canonical_channel(channel) or None
+    match = _SPLIT_NAME.match(text.strip())
+    if match is None:
+        raise MatchSpecError(spec, "missing package name")
+    name, rest = match.group(1).lower(), match.group(2)
+    if not _NAME.match(name):
+        raise MatchSpecError(spec, "invalid package name {!r}".format(name))
+
+    # No space around the separators of constraints, nor after an operator, e.g. ``>= 1.20``.
+    rest = re.sub(r"\s*([,|])\s*", r"\1", rest)
+    rest = re.sub(r"([=<>!~])\s+", r"\1", rest)
+    fields = rest.split()
+    if len(fields) > 2:
+        raise MatchSpecError(spec, "unexpected {!r}".format(" ".join(fields[2:])))
+    version = fields[0] if fields else ""
+    build = fields[1] if len(fields) == 2 else None
+    if version.startswith("=") and not version.startswith("=="):
+        # The ``name=version=build`` form.
+        version, _, version_build = version[1:].partition("=")
+        if re.search(r"[<>!~,]", version):
+            raise MatchSpecError(spec, "invalid version {!r}".format(version))
+        if version_build and build is not None:
+            raise MatchSpecError(spec, "build given twice")
+        if "|" in version:
+            # As with conda, only the first alternative is a version and its subversions.
+            version = "=" + version
+        elif version_build and version != "*":
+            version = "==" + version
+        elif version and not version.endswith("*"):
+            version += ".*"
+        build = version_build or build
+
+    # Brackets take precedence, as with conda.
+    if "channel" in items:
+        channel = canonical_channel(items.pop("channel")) or None
+    version = canonical_version(spec, items.pop("version", version))
+    build = items.pop("build", build)
+    if build == "*":
+        build = None
+    elif build is not None and not _BUILD.match(build):
+        raise MatchSpecError(spec, "invalid build {!r}".format(build))
+    return MatchSpec(name, version, build, channel, items)
+
+
+def pins_conflict(first, second):
+    """Tell whether two specs of the same package exclude each other by channel or pin."""
+    if first.channel is not None and second.channel is not None:
+        if first.channel != second.channel:
+            return True
+    if first.pin is None or second.pin is None:
+        return False
+    (first_version, first_exact), (second_version, second_exact) = first.pin, second.pin
+    first_parts = _version_parts(first_version, first_exact)
+    second_parts = _version_parts(second_version, second_exact)
+    if first_exact and second_exact:
+        return first_parts != second_parts
+    if second_exact:
+        return not _starts_with(second_parts, first_parts)
+    if first_exact:
+        return not _starts_with(first_parts, second_parts)
+    return not (_starts_with(first_parts, second_parts) or _starts_with(second_parts, first_parts))
+
+
+def _version_parts(version, exact):
+    parts = version.lower().split(".")
+    if exact:
+        # 1.20 and 1.20.0 are the same version.
+        while len(parts) > 1 and parts[-1] == "0":
+            parts.pop()
+    return parts
+
+
+def _starts_with(parts, prefix):
+    parts = parts + ["0"] * (len(prefix) - len(parts))
+    return parts[: len(prefix)] == prefix
+
+
+def find_conflicts(specs):
+    """Return the pairs of ``(source, spec)`` of ``specs`` that cannot be satisfied together."""
+    conflicts = []
+    for index, (source, spec) in enumerate(specs):
+        for other_source, other in specs[index + 1 :]:
+            if spec.name == other.name and pins_conflict(spec, other):
+                conflicts.append(((source, spec), (other_source, other)))
+    return conflicts
+
+
+def _version_atom(text):
+    # Ranked as conda does: dev releases first, then letters, numbers and post releases.
+    if text.isdigit():
+        return (2, int(text))
+    if text == "dev":
+        return (0, "")
+    if text == "post":
+        return (3, "")
+    return (1, text)
+
+
+def _version_components(version):
+    components = []
+    for part in re.split(r"[._-]", version) if version else ():
+        atoms = [_version_atom(atom) for atom in _VERSION_ATOM.findall(part)]
+        if not atoms or atoms[0][0] != 2:
+            # 1.0a1 comes before 1.0, as 1.0.0a1 before 1.0.0.
+            atoms.insert(0, _ZERO)
+        components.append(atoms)
+    return components
+
+
+def _version_order(version):
+    version = version.strip().lower()
+    epoch, _, version = version.rpartition("!")
+    version, _, local = version.partition("+")
+    epoch = [[_version_atom(epoch)]] if epoch.isdigit() else [[_ZERO]]
+    return epoch + _version_components(version), _version_components(local)
+
+
+def _pad(items, length, padding):
+    return list(items) + [padding] * (length - len(items))
+
+
+def _compare_components(first, second):
+    length = max(len(first), len(second))
+    for first_atoms, second_atoms in zip(_pad(first, length, []), _pad(second, length, [])):
+        atoms = max(len(first_atoms), len(second_atoms))
+        first_atoms, second_atoms = _pad(first_atoms, atoms, _ZERO), _pad(
+            second_atoms, atoms, _ZERO
+        )
+        if first_atoms != second_atoms:
+            return -1 if first_atoms < second_atoms else 1
+    return 0
+
+
+def compare_versions(first, second):
+    """Compare two conda versions as conda orders them, return -1, 0 or 1.
+
+    For instance 1.9 comes before 1.10, 1.0rc1 before 1.0, and 1.20 is 1.20.0.
+    """
+    (first_main, first_local), (second_main, second_local) = (
+        _version_order(first),
+        _version_order(second),
+    )
+    return _compare_components(first_main, second_main) or _compare_components(
+        first_local, second_local
+    )
+
+
+def _version_starts_with(version, prefix):
+    """Tell whether ``version`` is ``prefix`` or one of its subversions, e.g. 1.20.1 of 1.20."""
+    version, prefix = _version_order(version)[0], _version_order(prefix)[0]
+    if len(version) < len(prefix):
+        version = _pad(version, len(prefix), [_ZERO])
+    if _compare_components(version[: len(prefix) - 1], prefix[:-1]):
+        return False
+    last, prefix_last = version[len(prefix) - 1], prefix[-1]
+    return _pad(last, len(prefix_last), _ZERO)[: len(prefix_last)] == prefix_last
+
+
+def _satisfies(constraint, version):
+    operator, expected = _CONSTRAINT.match(constraint).groups()
+    operator = operator or "=="
+    if "*" in expected and operator in ("==", "!="):
+        if expected.endswith(".*") and "*" not in expected[:-2]:
+            matched = _version_starts_with(version, expected[:-2])
+        else:
+            matched = fnmatch.fnmatchcase(version.lower(), expected.lower())
+        return matched is (operator == "==")
+    if expected.endswith(".*"):
+        expected = expected[:-2]
+    order = compare_versions(version, expected)
+    if operator == "~=":
+        # ~=1.2.3 is >=1.2.3 and 1.2.*.
+        return order >= 0 and _version_starts_with(version, expected.rsplit(".", 1)[0])
+    return {
+        "==": order == 0,
+        "!=": order != 0,
+        "<": order < 0,
+        "<=": order <= 0,
+        ">": order > 0,
+        ">=": order >= 0,
+    }[operator]
+
+
+def version_matches(constraints, version):
+    """Tell whether ``version`` satisfies the canonical version ``constraints``.
+
+    ``constraints`` are alternatives separated by ``|`` of constraints separated by ``,``,
+    e.g. ``>=1.20,<2|==1.19.5``, as :func:`canonical_version` returns them.
+    """
+    return any(
+        all(_satisfies(constraint, version) for constraint in group.split(","))
+        for group in constraints.split("|")
+    )
+
+
+def canonical_spec(spec):
+    """Return the canonical form of ``spec``, or ``spec`` itself when it cannot be parsed.
+
+    Forms not handled here are left to conda, which reports the invalid ones.
+    """
+    try:
+        return str(parse(spec))
+    except MatchSpecError:
+        return str(spec)
+
+
+def canonical_specs(specs):
+    """Return the sorted canonical forms of ``specs``."""
+    return sorted(canonical_spec(spec) for spec in specs)
+
+
+def read_spec_file(path):
+    """Return the ``(line number, spec)`` of a conda spec file.
+
+    ``None`` is returned for an ``@EXPLICIT`` spec file, which lists package URLs.
+    """
+    specs = []
+    with open(str(path)) as stream:
+        for number, line in enumerate(stream, 1):
+            line = line.strip()
+            if line == "@EXPLICIT":
+                return None
+            if line and not line.startswith("#"):
+                specs.append((number, line))
+    return specs
+
+
+def read_env_file(path):
+    """Return the content of a conda environment.yml file."""
+    # Only loaded when there is an environment.yml file, it is slow to import.
+    from ruamel.yaml import YAML, YAMLError
+
+    with open(str(path)) as stream:
+        try:
+            content = YAML(typ="safe").load(stream)
+        except YAMLError as exception:
+            raise ValueError("{}: {}".format(path, exception))
+    if not isinstance(content, dict):
+        raise ValueError("{} is not a conda environment file".format(path))
+    return content
+
+
+def env_file_specs(content):
+    """Return the conda specs among the dependencies of an environment.yml ``content``."""
+    dependencies = content.get("dependencies") or []
+    return [str(dependency) for dependency in dependencies if not isinstance(dependency, dict)]
+
+
+def canonical_env_file(content):
+    """Return the canonical form of an environment.yml ``content``, e.g. to digest it.
+
+    The name and prefix of the env are left out, they do not change its content.
+    """
+    canonical = {key: value for key, value in content.items() if key not in ("name", "prefix")}
+    canonical["channels"] = [
+        canonical_channel(channel) for channel in content.get("channels") or []
+    ]
+    dependencies = content.get("dependencies") or []
+    canonical["dependencies"] = canonical_specs(env_file_specs(content)) + [
+        dependency for dependency in dependencies if isinstance(dependency, dict)
+    ]
+    return canonical
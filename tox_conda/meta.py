@@ -0,0 +1,155 @@
+"""Read the package records conda keeps in the ``conda-meta`` directory of a prefix."""
+import hashlib
+import json
+import os
+
+EXPLICIT_HEADER = "@EXPLICIT"
+# Values of the link type conda records for each package, see conda.models.enums.LinkType.
+LINK_TYPES = {1: "hardlink", 2: "softlink", 3: "copy", 4: "directory"}
+
+
+def meta_dir(prefix):
+    return os.path.join(str(prefix), "conda-meta")
+
+
+def iter_records(prefix):
+    """Yield the package records installed in ``prefix``, sorted by package name."""
+    directory = meta_dir(prefix)
+    for name in sorted(os.listdir(directory)):
+        if not name.endswith(".json"):
+            continue
+        with open(os.path.join(directory, name)) as stream:
+            yield json.load(stream)
+
+
+def explicit_spec(prefix):
+    """Return the ``@EXPLICIT`` spec file content reproducing the packages of ``prefix``.
+
+    Unlike ``conda list --explicit``, this does not start conda. ``None`` is returned when a
+    record does not tell where its package came from.
+    """
+    lines = [EXPLICIT_HEADER]
+    for record in iter_records(prefix):
+        url = record.get("url")
+        if not url:
+            return None
+        md5 = record.get("md5")
+        lines.append("{}#{}".format(url, md5) if md5 else url)
+    return "\n".join(lines) + "\n"
+
+
+def packages_cached(prefix):
+    """Tell whether all the packages of ``prefix`` are still extracted in a package cache."""
+    for record in iter_records(prefix):
+        extracted = record.get("extracted_package_dir")
+        if not extracted or not os.path.isdir(extracted):
+            return False
+    return True
+
+
+def _distribution_entries(paths):
+    """Yield ``(site_packages, name)`` of the distribution metadata among ``paths``."""
+    for path in paths:
+        parts = path.replace("\\", "/").split("/")
+        for index, name in enumerate(parts[1:], 1):
+            if parts[index - 1] == "site-packages" and name.endswith((".dist-info", ".egg-info")):
+                yield "/".join(parts[:index]), name
+
+
+def _parse_distribution(name):
+    """Return ``(name, version)`` of a ``.dist-info`` or ``.egg-info`` entry, or ``None``."""
+    fields = name.rsplit(".", 1)[0].split("-")
+    if len(fields) < 2:
+        return None
+    return fields[0], fields[1]
+
+
+def python_distributions(prefix):
+    """Yield ``(name, version)`` of the python distributions installed by conda in ``prefix``.
+
+    They are read from the ``.dist-info`` and ``.egg-info`` entries of the packages, so these
+    are the names pip knows, which may differ from the names of the conda packages.
+    """
+    for record in iter_records(prefix):
+        found = set()
+        for _, entry in _distribution_entries(record.get("files") or ()):
+            distribution = _parse_distribution(entry)
+            if distribution is not None and distribution not in found:
+                found.add(distribution)
+                yield distribution
+
+
+def pip_distributions(prefix):
+    """Return the sorted names of the python distributions of ``prefix`` not installed by conda.
+
+    These are the ones pip installed on top of the conda packages.
+    """
+    site_packages = set()
+    conda_entries = set()
+    for record in iter_records(prefix):
+        for path in record.get("files") or ():
+            parts = path.replace("\\", "/").split("/")
+            if "site-packages" in parts:
+                site_packages.add("/".join(parts[: parts.index("site-packages") + 1]))
+        for directory, entry in _distribution_entries(record.get("files") or ()):
+            conda_entries.add((directory, entry))
+
+    names = set()
+    for directory in site_packages:
+        try:
+            entries = os.listdir(os.path.join(str(prefix), directory))
+        except OSError:
+            continue
+        for entry in entries:
+            if (directory, entry) in conda_entries:
+                continue
+            if entry.endswith((".dist-info", ".egg-info")):
+                distribution = _parse_distribution(entry)
+                if distribution is not None:
+                    names.add(distribution[0])
+    return sorted(names)
+
+
+def prefix_digest(prefix):
+    """Return a digest of the packages installed in ``prefix``, read from the record names."""
+    digest = hashlib.sha256()
+    for name in sorted(os.listdir(meta_dir(prefix))):
+        if name.endswith(".json"):
+            digest.update(name.encode("utf-8") + b"\n")
+    return digest.hexdigest()
+
+
+def package_versions(prefix):
+    """Return ``{name: version}`` of the packages installed in ``prefix``.
+
+    Records are named ``<name>-<version>-<build>.json``, so none of them is parsed.
+    """
+    versions = {}
+    for name in os.listdir(meta_dir(prefix)):
+        fields = name[: -len(".json")].rsplit("-", 2) if name.endswith(".json") else ()
+        if len(fields) == 3:
+            versions[fields[0]] = fields[1]
+    return versions
+
+
+def link_types(prefix):
+    """Return the sorted names of the ways conda linked the packages of ``prefix``."""
+    types = set()
+    for record in iter_records(prefix):
+        link_type = (record.get("link") or {}).get("type")
+        if link_type is not None:
+            types.add(LINK_TYPES.get(link_type, str(link_type)))
+    return sorted(types)
+
+
+def linked_bytes(prefix):
+    """Return the bytes of the files of the packages of ``prefix``, by link type."""
+    sizes = {}
+    for record in iter_records(prefix):
+        link_type = (record.get("link") or {}).get("type")
+        if link_type is None:
+            continue
+        name = LINK_TYPES.get(link_type, str(link_type))
+        paths = (record.get("paths_data") or {}).get("paths", ())
+        sizes[name] = sizes.get(name, 0) + sum(path.get("size_in_bytes", 0) for path in paths)
+    return sizes
@@ -0,0 +1,154 @@
+"""Count what the plugin did across runs, in the Prometheus textfile format.
+
+Each run adds its samples to the ones already in the file, so the counters and histograms
+keep growing from run to run, as Prometheus expects. The file is rewritten atomically under
+a lock: concurrent runs, e.g. the envs of ``tox -p``, each add their own samples, and the
+node exporter never reads a partial file.
+"""
+import os
+import re
+import threading
+import uuid
+
+# Upper bounds of the buckets of the histograms, in seconds.
+BUCKETS = (1, 5, 15, 30, 60, 120, 300, 600, float("inf"))
+FAMILIES = {
+    "tox_conda_envs_total": (
+        "counter",
+        "Conda envs provisioned, by outcome: created, updated (only the pip deps installed "
+        "again), reused, or the way they were obtained without creating them.",
+    ),
+    "tox_conda_process_seconds": ("histogram", "Duration of the conda processes, by command."),
+    "tox_conda_activations_avoided_total": (
+        "counter",
+        "Commands started with the recorded activation instead of activating in a shell.",
+    ),
+    "tox_conda_linked_bytes_total": (
+        "counter",
+        "Bytes of package files put into conda envs, by link type.",
+    ),
+}
+_SAMPLE = re.compile(
+    r"^(?P<name>[a-zA-Z_:][a-zA-Z0-9_:]*)(?:\{(?P<labels>.*)\})?\s+(?P<value>\S+)$"
+)
+_LABEL = re.compile(r'(?P<key>[a-zA-Z_][a-zA-Z0-9_]*)="(?P<value>(?:[^"\\]|\\.)*)"')
+
+
+class Metrics:
+    """The samples recorded by a run, keyed by ``(name, labels)``."""
+
+    def __init__(self):
+        self.samples = {}
+        # Background builds record their conda processes from worker threads.
+        self._lock = threading.Lock()
+
+    def __bool__(self):
+        return bool(self.samples)
+
+    def inc(self, name, value=1, **labels):
+        key = (name, _labels_key(labels))
+        with self._lock:
+            self.samples[key] = self.samples.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        """Add ``value`` to the histogram ``name``."""
+        for bound in BUCKETS:
+            # Every bucket is exported, even when empty.
+            self.inc(name + "_bucket", int(value <= bound), le=_format_value(bound), **labels)
+        self.inc(name + "_sum", value, **labels)
+        self.inc(name + "_count", **labels)
+
+    def update_file(self, path):
+        """Add the samples of this run to the ones of the file ``path``."""
+        import filelock
+
+        path = str(path)
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with filelock.FileLock(path + ".lock"):
+            try:
+                with open(path) as stream:
+                    samples = parse(stream.read())
+            except FileNotFoundError:
+                samples = {}
+            for key, value in self.samples.items():
+                samples[key] = samples.get(key, 0) + value
+            tmp_path = "{}.{}.tmp".format(path, uuid.uuid4().hex)
+            with open(tmp_path, "w") as stream:
+                stream.write(format_samples(samples))
+            os.replace(tmp_path, path)
+
+
+def parse(text):
+    """Return the samples of the textfile ``text``, comments are ignored."""
+    samples = {}
+    for line in text.splitlines():
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        match = _SAMPLE.match(line)
+        if match is None:
+            continue
+        labels = {
+            label.group("key"): _unescape(label.group("value"))
+            for label in _LABEL.finditer(match.group("labels") or "")
+        }
+        try:
+            value = float(match.group("value"))
+        except ValueError:
+            continue
+        samples[(match.group("name"), _labels_key(labels))] = value
+    return samples
+
+
+def format_samples(samples):
+    """Return the textfile of ``samples``, grouped by family."""
+    families = {}
+    for name, labels in samples:
+        families.setdefault(_family(name), []).append((name, labels))
+    lines = []
+    for family in sorted(families):
+        if family in FAMILIES:
+            kind, help_text = FAMILIES[family]
+            lines.append("# HELP {} {}".format(family, help_text))
+            lines.append("# TYPE {} {}".format(family, kind))
+        for name, labels in sorted(families[family], key=_sort_key):
+            text = ",".join('{}="{}"'.format(key, _escape(value)) for key, value in labels)
+            lines.append(
+                "{}{} {}".format(
+                    name, "{" + text + "}" if text else "", _format_value(samples[name, labels])
+                )
+            )
+    return "\n".join(lines) + "\n"
+
+
+def _family(name):
+    for suffix in ("_bucket", "_sum", "_count"):
+        if name.endswith(suffix) and FAMILIES.get(name[: -len(suffix)], ("",))[0] == "histogram":
+            return name[: -len(suffix)]
+    return name
+
+
+def _sort_key(sample):
+    name, labels = sample
+    # Buckets in the order of their bounds, not of their text.
+    return name, [(key, float(value)) if key == "le" else (key, value) for key, value in labels]
+
+
+def _labels_key(labels):
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _unescape(value):
+    return re.sub(r"\\(.)", lambda match: "\n" if match.group(1) == "n" else match.group(1), value)
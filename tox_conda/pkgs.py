@@ -0,0 +1,148 @@
+"""Locate conda's package caches and index them as a local channel."""
+import json
+import os
+import platform
+import shutil
+import sys
+
+REPODATA_NAME = "repodata.json"
+RECORD_PATH = os.path.join("info", "repodata_record.json")
+# Keys of installed package records that are not part of a channel's repodata.
+_NON_REPODATA_KEYS = ("url", "channel", "fn", "auth", "schannel")
+
+
+def find_root_prefix(conda_exe):
+    """Return the root prefix of the conda installation ``conda_exe`` belongs to."""
+    if not os.path.isabs(str(conda_exe)):
+        conda_exe = shutil.which(str(conda_exe)) or conda_exe
+    # <root>/bin/conda, <root>/condabin/conda, <root>/Scripts/conda.exe, ...
+    return os.path.dirname(os.path.dirname(os.path.realpath(str(conda_exe))))
+
+
+def find_pkgs_dirs(conda_exe):
+    """Return the existing package cache directories conda uses, by priority.
+
+    ``CONDA_PKGS_DIRS`` takes precedence, otherwise the defaults of the installation are
+    used. Only the environment is looked at, ``pkgs_dirs`` set in a ``.condarc`` file is not.
+    """
+    configured = os.environ.get("CONDA_PKGS_DIRS")
+    if configured:
+        candidates = [path.strip() for path in configured.split(",") if path.strip()]
+    else:
+        candidates = [
+            os.path.join(find_root_prefix(conda_exe), "pkgs"),
+            os.path.join(os.path.expanduser("~"), ".conda", "pkgs"),
+        ]
+    return [os.path.expanduser(path) for path in candidates if os.path.isdir(path)]
+
+
+def device(path):
+    """Return the device of the filesystem of ``path``, or of its closest existing parent."""
+    path = os.path.abspath(str(path))
+    while not os.path.exists(path):
+        parent = os.path.dirname(path)
+        if parent == path:
+            break
+        path = parent
+    return os.stat(path).st_dev
+
+
+def can_hardlink(pkgs_dirs, prefix):
+    """Tell whether conda can hard link packages from one of ``pkgs_dirs`` into ``prefix``.
+
+    Hard links only work within a filesystem, otherwise conda copies every file.
+    """
+    target = device(prefix)
+    return any(device(pkgs_dir) == target for pkgs_dir in pkgs_dirs)
+
+
+def current_subdir():
+    """Return the conda subdir matching the running platform, e.g. ``linux-64``."""
+    machine = platform.machine().lower()
+    if sys.platform.startswith("win"):
+        system = "win"
+    elif sys.platform == "darwin":
+        system = "osx"
+    else:
+        system = "linux"
+    if machine in ("x86_64", "amd64"):
+        arch = "64"
+    elif machine in ("arm64", "aarch64"):
+        arch = "arm64" if system == "osx" else "aarch64"
+    elif machine in ("i386", "i686", "x86"):
+        arch = "32"
+    else:
+        arch = machine
+    return "{}-{}".format(system, arch)
+
+
+def iter_cached_records(pkgs_dirs):
+    """Yield ``(pkgs_dir, record)`` for every package extracted in the package caches."""
+    seen = set()
+    for pkgs_dir in pkgs_dirs:
+        for name in sorted(os.listdir(pkgs_dir)):
+            try:
+                with open(os.path.join(pkgs_dir, name, RECORD_PATH)) as stream:
+                    record = json.load(stream)
+            except (OSError, ValueError):
+                continue
+            fn = record.get("fn")
+            if not fn or fn in seen or "subdir" not in record:
+                continue
+            seen.add(fn)
+            yield pkgs_dir, record
+
+
+def build_local_channel(pkgs_dirs, channel_dir):
+    """Index the packages of the package caches as a ``file://`` channel in ``channel_dir``.
+
+    The repodata is generated from the records conda stored next to each extracted package,
+    so no package archive has to be opened. Archives still present in a cache are linked
+    into the channel; packages that only remain extracted are picked from the cache by
+    conda in offline mode. Return the URL of the channel.
+    """
+    channel_dir = os.path.abspath(str(channel_dir))
+    repodata = {
+        subdir: {"info": {"subdir": subdir}, "packages": {}, "packages.conda": {}}
+        for subdir in ("noarch", current_subdir())
+    }
+    for pkgs_dir, record in iter_cached_records(pkgs_dirs):
+        subdir = record["subdir"]
+        fn = record["fn"]
+        if subdir not in repodata:
+            repodata[subdir] = {"info": {"subdir": subdir}, "packages": {}, "packages.conda": {}}
+        key = "packages.conda" if fn.endswith(".conda") else "packages"
+        entry = {k: v for k, v in record.items() if k not in _NON_REPODATA_KEYS}
+        repodata[subdir][key][fn] = entry
+        _link_archive(os.path.join(pkgs_dir, fn), os.path.join(channel_dir, subdir, fn))
+
+    for subdir, content in repodata.items():
+        content["repodata_version"] = 1
+        path = os.path.join(channel_dir, subdir, REPODATA_NAME)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = "{}.{}.tmp".format(path, os.getpid())
+        with open(tmp_path, "w") as stream:
+            json.dump(content, stream, sort_keys=True)
+        os.replace(tmp_path, path)
+    return path_to_url(channel_dir)
+
+
+def path_to_url(path):
+    path = os.path.abspath(str(path)).replace(os.sep, "/")
+    if not path.startswith("/"):
+        # Windows drive letter
+        path = "/" + path
+    return "file://" + path
+
+
+def _link_archive(source, target):
+    if os.path.exists(target) or not os.path.isfile(source):
+        return
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    try:
+        os.link(source, target)
+    except OSError:
+        try:
+            os.symlink(source, target)
+        except OSError:
+            pass
@@ -0,0 +1,105 @@
+"""Tell what a run would do with the conda env of an env, and why, without running anything.
+
+Only the marker, ``conda-meta`` and the config recorded by tox are read: neither conda nor
+the python of the env is invoked, so planning all envs of a project takes no time.
+"""
+import os
+
+from . import marker
+
+CREATE = "create"
+RECREATE = "recreate"
+UPDATE = "update"
+REUSE = "reuse"
+UNKNOWN = "unknown"
+
+# Names of the conda inputs in the config, in the order their changes are reported.
+_LABELS = (
+    ("platform", "platform"),
+    ("python", "python"),
+    ("deps", "conda_deps"),
+    ("channels", "conda_channels"),
+    ("create_args", "conda_create_args"),
+    ("install_args", "conda_install_args"),
+    ("spec_file", "conda_spec"),
+    ("env_file", "conda_env"),
+    ("base_env", "conda_base_env"),
+)
+# Inputs recorded as the digest of a content.
+_DIGESTS = {"spec_file", "env_file", "base_env"}
+
+
+def list_changes(old, new):
+    """Describe the changes from the list ``old`` to the list ``new``, e.g. ``+a -b``."""
+    changes = ["+{}".format(item) for item in new if item not in old]
+    changes += ["-{}".format(item) for item in old if item not in new]
+    if not changes and old != new:
+        return "reordered"
+    return " ".join(changes)
+
+
+def inputs_changes(recorded, inputs):
+    """Describe the differences between the conda inputs ``recorded`` and ``inputs``."""
+    changes = []
+    labels = dict(_LABELS)
+    keys = [key for key, _ in _LABELS] + sorted((set(recorded) | set(inputs)) - set(labels))
+    for key in keys:
+        old, new = recorded.get(key), inputs.get(key)
+        if old == new:
+            continue
+        label = labels.get(key, key)
+        if isinstance(old, list) and isinstance(new, list):
+            changes.append("{} {}".format(label, list_changes(old, new)))
+        elif key in _DIGESTS:
+            if old is None:
+                changes.append("{} added".format(label))
+            elif new is None:
+                changes.append("{} removed".format(label))
+            else:
+                changes.append("{} content changed".format(label))
+        else:
+            changes.append("{} {} -> {}".format(label, old, new))
+    return changes
+
+
+def deps_changes(recorded, deps):
+    """Describe the changes between the ``(digest, name)`` pairs of deps ``recorded`` and ``deps``.
+
+    The digest tells when the content of a file, e.g. a requirements file, changed.
+    """
+    old = {name: digest for digest, name in recorded}
+    new = {name: digest for digest, name in deps}
+    changes = []
+    if set(old) != set(new):
+        changes.append("deps {}".format(list_changes(sorted(old), sorted(new))))
+    for name in sorted(new):
+        if name in old and old[name] != new[name]:
+            changes.append("{} content changed".format(name))
+    return changes
+
+
+def plan_env(envdir, inputs, recreate=False, pip_changes=()):
+    """Return what a run would do with the conda env in ``envdir`` and the reasons for it.
+
+    ``inputs`` are the current conda inputs, ``pip_changes`` describe what changed on the pip
+    side since tox recorded the env. The decision is one of ``CREATE``, ``RECREATE``,
+    ``UPDATE``, the pip deps being installed again on the same prefix, or ``REUSE``.
+    """
+    if not os.path.isdir(os.path.join(str(envdir), "conda-meta")):
+        return CREATE, ["no conda env"]
+    if recreate:
+        return RECREATE, ["-r flag"]
+    recorded = marker.read_marker(envdir)
+    if recorded is None:
+        return RECREATE, ["no complete provisioning recorded"]
+    if recorded.get("inputs_hash") != marker.inputs_hash(inputs):
+        return RECREATE, inputs_changes(recorded.get("inputs") or {}, inputs) or ["inputs changed"]
+    if pip_changes:
+        return UPDATE, list(pip_changes)
+    return REUSE, []
+
+
+def format_plan(name, decision, reasons):
+    if not reasons:
+        return "{}: {}".format(name, decision)
+    return "{}: {} ({})".format(name, decision, "; ".join(reasons))
@@ -1,23 +1,65 @@
 import copy
+import functools
 import os
 import re
 import shutil
-import subprocess
+import sys
 import tempfile
+import time
+from contextlib import ExitStack, contextmanager
 from pathlib import Path
 
+import filelock
 import pluggy
 import py.path
 import tox
-from ruamel.yaml import YAML
 from tox.config import DepConfig, DepOption, TestenvConfig
-from tox.venv import VirtualEnv
-
-from .env_activator import activate_env
+from tox.config.parallel import ENV_VAR_KEY_PRIVATE as PARALLEL_ENV_VAR_KEY_PRIVATE
+from tox.venv import CreationConfig, VirtualEnv, getdigest
+
+from . import (
+    admission,
+    archive,
+    cleanup,
+    drift,
+    marker,
+    matchspec,
+    meta,
+    metrics,
+    pkgs,
+    plan,
+    profiling,
+    store,
+    wheelhouse,
+)
+from .env_activator import activate_env, get_prefix
+from .prebuild import Prebuilder, PrebuildFailed, PrebuildJob
 
 hookimpl = pluggy.HookimplMarker("tox")
 
 MISSING_CONDA_ERROR = "Cannot locate the conda executable."
+STORE_DOWNLOAD_DIR = ".tox-conda-store"
+BASE_ENV_DIR = ".tox-conda-base"
+LOCAL_PKGS_DIR = ".tox-conda-pkgs"
+MEMORY_LEDGER = ".tox-conda-memory.json"
+# Run by the python of an env, compiles its site-packages with a process per core. Modules
+# with an up to date .pyc are skipped, errors are left to the import of the module.
+PRECOMPILE_SCRIPT = (
+    "import compileall, sys, sysconfig; "
+    "kwargs = {'workers': 0} if sys.version_info >= (3, 5) else {}; "
+    "compileall.compile_dir(sysconfig.get_paths()['purelib'], quiet=2, **kwargs)"
+)
+PIP_INSTALLERS = ("pip", "uv")
+# A basepython giving the python package of the env by its name alone, e.g. python3.9.
+BASEPYTHON = re.compile(r"(python|pypy)(\d)(?:\.(\d+))?(?:\.?(\d))?")
+
+
+class UnusablePrefix(tox.exception.UnsupportedInterpreter):
+    """The ``conda_prefix`` of an env does not provide what the env declares.
+
+    tox reports an ``UnsupportedInterpreter`` raised while creating an env as the failure of
+    that env, the other envs still run.
+    """
 
 
 class CondaDepOption(DepOption):
@@ -31,12 +73,29 @@ def postprocess_path_option(testenv_config, value):
     return value
 
 
+def postprocess_store_option(testenv_config, value):
+    if value is None or value.startswith(("http://", "https://", "file://")):
+        return value
+    # A directory is relative to the tox.ini, as the options of type path.
+    return os.path.join(str(testenv_config.config.toxinidir), os.path.expanduser(value))
+
+
+def postprocess_pip_installer(testenv_config, value):
+    if value not in PIP_INSTALLERS:
+        raise tox.exception.ConfigError(
+            "conda_pip_installer must be one of {}, not {!r}".format(
+                ", ".join(PIP_INSTALLERS), value
+            )
+        )
+    return value
+
+
 def get_python_packages(envconfig, action):
     if envconfig.basepython.lower() == "none":
         return []
 
     # Try to use basepython
-    match = re.match(r"(python|pypy)(\d)(?:\.(\d+))?(?:\.?(\d))?", envconfig.basepython)
+    match = BASEPYTHON.match(envconfig.basepython)
     if match:
         groups = match.groups()
         version = groups[1]
@@ -54,6 +113,8 @@ def get_python_packages(envconfig, action):
         version = "{}.{}".format(*envconfig.python_info.version_info[:2])
 
     # Second fallback
+    elif action is None:
+        return None
     else:
         code = "import sys; print('{}.{}'.format(*sys.version_info[:2]))"
         result = action.popen([envconfig.basepython, "-c", code], report_fail=True, returnout=True)
@@ -70,6 +131,13 @@ def tox_addoption(parser):
         help="specify a conda environment.yml file",
         postprocess=postprocess_path_option,
     )
+    parser.add_testenv_attribute(
+        name="conda_base_env",
+        type="path",
+        help="specify a conda prefix or environment.yml file to create the conda env from, "
+        "before installing the conda dependencies on top of it",
+        postprocess=postprocess_path_option,
+    )
     parser.add_testenv_attribute(
         name="conda_spec",
         type="path",
@@ -77,6 +145,14 @@ def tox_addoption(parser):
         postprocess=postprocess_path_option,
     )
 
+    parser.add_testenv_attribute(
+        name="conda_prefix",
+        type="path",
+        help="specify an existing conda prefix to run the env in, instead of creating a conda "
+        "env; it is only checked to provide the python and conda dependencies of the env",
+        postprocess=postprocess_path_option,
+    )
+
     parser.add_testenv_attribute_obj(CondaDepOption())
 
     parser.add_testenv_attribute(
@@ -95,6 +171,107 @@ def tox_addoption(parser):
         help="each line specifies a conda create argument",
     )
 
+    parser.add_testenv_attribute(
+        name="conda_offline",
+        type="bool",
+        default=False,
+        help="create the conda env without network access, from the packages already present "
+        "in conda's package caches",
+    )
+
+    parser.add_testenv_attribute(
+        name="conda_activate_once",
+        type="bool",
+        default=False,
+        help="activate the conda env once per run and start commands directly with the "
+        "resulting environment variables, instead of activating it in a shell for each command",
+    )
+
+    parser.add_testenv_attribute(
+        name="conda_cache_dir",
+        type="path",
+        default=None,
+        help="directory keeping an archive of each conda env, by conda inputs, to restore "
+        "the env from instead of creating it",
+    )
+
+    parser.add_testenv_attribute(
+        name="conda_store",
+        type="string",
+        default=None,
+        help="directory or http(s) URL of a store shared between machines, to fetch and "
+        "publish the explicit specs and archives of conda envs",
+        postprocess=postprocess_store_option,
+    )
+
+    parser.add_testenv_attribute(
+        name="conda_pip_installer",
+        type="string",
+        default="pip",
+        help="installer of the pip dependencies, pip or uv; with uv the python packages "
+        "installed by conda are kept as they are",
+        postprocess=postprocess_pip_installer,
+    )
+
+    parser.add_testenv_attribute(
+        name="conda_wheelhouse",
+        type="path",
+        default=None,
+        help="directory keeping the wheels of the pip dependencies, by interpreter ABI and "
+        "platform, to install them from without an index",
+    )
+
+    parser.add_testenv_attribute(
+        name="conda_precompile",
+        type="bool",
+        default=False,
+        help="compile the modules of the env in parallel once it is provisioned, instead of "
+        "one by one as the commands import them",
+    )
+
+    parser.add_testenv_attribute(
+        name="conda_repair",
+        type="bool",
+        default=False,
+        help="before the commands run, install again the conda packages removed from the env "
+        "and remove the ones added to it since it was provisioned",
+    )
+
+    parser.add_argument(
+        "--conda-prebuild",
+        type=int,
+        default=0,
+        metavar="N",
+        help="in sequential runs, create the conda envs of up to N upcoming envs in the "
+        "background while the current env runs its commands",
+    )
+    parser.add_argument(
+        "--conda-profile",
+        action="store_true",
+        help="profile the conda processes and the hooks of tox-conda with cProfile, into "
+        ".prof files and a summary of them in the log dir of each env",
+    )
+    parser.add_argument(
+        "--conda-metrics-file",
+        default=os.environ.get("TOX_CONDA_METRICS_FILE"),
+        metavar="PATH",
+        help="add the counts of envs provisioned, conda processes and bytes linked of the run "
+        "to the Prometheus textfile PATH, defaults to $TOX_CONDA_METRICS_FILE",
+    )
+    parser.add_argument(
+        "--conda-admission",
+        action="store_true",
+        help="hold back each conda process until the available memory, according to "
+        "/proc/meminfo and the memory cgroup, can hold the peak memory of its last run, on "
+        "top of the conda processes already running, e.g. in parallel runs",
+    )
+    parser.add_argument(
+        "--conda-plan",
+        action="store_true",
+        help="show whether the conda env of each selected env would be created, recreated, "
+        "updated or reused, and why, without running anything",
+    )
+
 
 @hookimpl
 def tox_configure(config):
@@ -102,26 +279,174 @@ def tox_configure(config):
     # the conda dependencies when it decides whether an existing environment
     # needs to be updated before being used.
 
+    patch_tox()
+
     # Set path to the conda executable because it cannot be determined once
-    # an env has already been created.
-    conda_exe = find_conda()
+    # an env has already been created. Listing the envs or showing the config
+    # does not need it.
+    option = config.option
+    if option.listenvs or option.listenvs_all or option.showconfig or option.conda_plan:
+        conda_exe = None
+    else:
+        conda_exe = find_conda()
+
+    config.conda_metrics = metrics.Metrics() if option.conda_metrics_file else None
+    config.conda_prebuilder = None
+    within_parallel = PARALLEL_ENV_VAR_KEY_PRIVATE in os.environ
+    if config.option.conda_prebuild > 0 and not (within_parallel or config.option.parallel):
+        config.conda_prebuilder = Prebuilder(config.option.conda_prebuild)
 
     for envconfig in config.envconfigs.values():
         # Make sure the right environment is activated. This works because we're
         # creating environments using the `-p/--prefix` option in `tox_testenv_create`
-        envconfig.setenv["CONDA_DEFAULT_ENV"] = envconfig.setenv["TOX_ENV_DIR"]
-
-        conda_deps = [DepConfig(str(name)) for name in envconfig.conda_deps]
+        if envconfig.conda_prefix is None:
+            envconfig.setenv["CONDA_DEFAULT_ENV"] = envconfig.setenv["TOX_ENV_DIR"]
+        else:
+            for name in ("conda_env", "conda_spec", "conda_base_env"):
+                if getattr(envconfig, name) is not None:
+                    raise tox.exception.ConfigError(
+                        "{}: conda_prefix and {} cannot be combined".format(
+                            envconfig.envname, name
+                        )
+                    )
+            envconfig.setenv["CONDA_DEFAULT_ENV"] = str(envconfig.conda_prefix)
+
+        check_conda_specs(envconfig)
+        conda_deps = [
+            DepConfig(spec)
+            for spec in matchspec.canonical_specs(dep.name for dep in envconfig.conda_deps)
+        ]
         # Append filenames of additional dependency sources. tox will automatically hash
         # their contents to detect changes.
         if envconfig.conda_spec is not None:
             conda_deps.append(DepConfig(envconfig.conda_spec))
         if envconfig.conda_env is not None:
             conda_deps.append(DepConfig(envconfig.conda_env))
+        if envconfig.conda_base_env is not None:
+            if envconfig.conda_env is not None:
+                raise tox.exception.ConfigError(
+                    "{}: conda_env and conda_base_env cannot be combined".format(envconfig.envname)
+                )
+            if is_base_env_file(envconfig):
+                conda_deps.append(DepConfig(envconfig.conda_base_env))
+        envconfig.conda_options_dep = get_conda_options_dep(envconfig)
+        if envconfig.conda_options_dep is not None:
+            conda_deps.append(envconfig.conda_options_dep)
         envconfig.deps.extend(conda_deps)
 
         envconfig.conda_exe = conda_exe
 
+    if option.conda_plan:
+        report_plan(config)
+        raise SystemExit(0)
+
+
+def get_conda_options_dep(envconfig):
+    """Return a dep standing for the conda inputs that are neither specs nor files, if any.
+
+    tox only creates an env again when its deps change, so the channels, the conda arguments
+    and the content of a base env prefix are folded into the name of a dep: a change of any
+    of them then recreates the env, as a change of the conda deps does.
+    """
+    if envconfig.conda_prefix is not None:
+        return None
+    options = {
+        "channels": [matchspec.canonical_channel(channel) for channel in envconfig.conda_channels],
+        "create_args": [str(arg) for arg in envconfig.conda_create_args],
+        "install_args": [str(arg) for arg in envconfig.conda_install_args],
+    }
+    if envconfig.conda_base_env is not None and not is_base_env_file(envconfig):
+        options["base_env"] = get_base_env_digest(envconfig)
+    if not any(options.values()):
+        # The deps of envs using none of them are left as they were.
+        return None
+    return DepConfig("conda-inputs:{}".format(marker.inputs_hash(options)[:16]))
+
+
+def get_conda_spec_sources(envconfig):
+    """Return the ``(source, text)`` of the conda specs of ``envconfig``, as they are written.
+
+    The specs are read from ``conda_deps`` and the spec and environment.yml files. Files
+    that cannot be read are left to conda, which reports them.
+    """
+    sources = [("conda_deps", str(dep.name)) for dep in envconfig.conda_deps]
+    if envconfig.conda_spec is not None:
+        try:
+            lines = matchspec.read_spec_file(envconfig.conda_spec)
+        except (OSError, ValueError):
+            lines = None
+        for number, spec in lines or ():
+            sources.append(("{} line {}".format(envconfig.conda_spec, number), spec))
+    env_files = [envconfig.conda_env]
+    if is_base_env_file(envconfig):
+        env_files.append(envconfig.conda_base_env)
+    for env_file in env_files:
+        if env_file is None:
+            continue
+        try:
+            content = matchspec.read_env_file(env_file)
+        except (OSError, ValueError):
+            continue
+        sources += [(str(env_file), spec) for spec in matchspec.env_file_specs(content)]
+    return sources
+
+
+def get_conda_specs(envconfig):
+    """Return the ``(source, spec)`` of the conda specs of ``envconfig``, parsed.
+
+    Specs that cannot be parsed are skipped here: a config error would keep tox from even
+    listing the envs. ``check_conda_spec_syntax`` fails on them once the env is run.
+    """
+    specs = []
+    for source, text in get_conda_spec_sources(envconfig):
+        try:
+            specs.append((source, matchspec.parse(text)))
+        except matchspec.MatchSpecError:
+            continue
+    return specs
+
+
+def get_invalid_conda_specs(envconfig):
+    """Return the ``(source, error)`` of the conda specs of ``envconfig`` that cannot be parsed."""
+    invalid = []
+    for source, text in get_conda_spec_sources(envconfig):
+        try:
+            matchspec.parse(text)
+        except matchspec.MatchSpecError as exception:
+            invalid.append((source, exception))
+    return invalid
+
+
+def check_conda_spec_syntax(envconfig):
+    """Fail on the first conda spec of ``envconfig`` that cannot be parsed.
+
+    This is done before any conda process starts, so that a typo fails the run at once.
+    """
+    invalid = get_invalid_conda_specs(envconfig)
+    if invalid:
+        source, exception = invalid[0]
+        raise tox.exception.ConfigError("{}: {} ({})".format(envconfig.envname, exception, source))
+
+
+def check_conda_specs(envconfig):
+    """Fail on conda specs of ``envconfig`` that pin different versions of a package.
+
+    This way a conflict fails the run at once, rather than minutes into a solve. The python
+    package is checked too when basepython gives it without running python.
+    """
+    specs = get_conda_specs(envconfig)
+    if BASEPYTHON.match(envconfig.basepython):
+        for package in get_python_packages(envconfig, None):
+            specs.append(("basepython", matchspec.parse(package)))
+    conflicts = matchspec.find_conflicts(specs)
+    if conflicts:
+        (source, spec), (other_source, other) = conflicts[0]
+        raise tox.exception.ConfigError(
+            "{}: conflicting conda specs {} ({}) and {} ({})".format(
+                envconfig.envname, spec, source, other, other_source
+            )
+        )
+
 
 def find_conda():
     # This should work if we're not already in an environment
@@ -139,11 +464,6 @@ def find_conda():
     if path is None:
         _exit_on_missing_conda()
 
-    try:
-        subprocess.run([str(path), "-h"], stdout=subprocess.DEVNULL)
-    except subprocess.CalledProcessError:
-        _exit_on_missing_conda()
-
     return path
 
 
@@ -152,64 +472,675 @@ def _exit_on_missing_conda():
     raise SystemExit(0)
 
 
-def _run_conda_process(args, venv, action, cwd):
-    redirect = tox.reporter.verbosity() < tox.reporter.Verbosity.DEBUG
-    venv._pcall(args, venv=False, action=action, cwd=cwd, redirect=redirect)
+def _run_conda_process(args, venv, action, cwd, redirect=None, inputs=None):
+    if redirect is None:
+        redirect = tox.reporter.verbosity() < tox.reporter.Verbosity.DEBUG
+    env = None
+    pkgs_dirs = get_pkgs_dirs(venv.envconfig)
+    if pkgs_dirs is not None:
+        env = venv._get_os_environ()
+        env["CONDA_PKGS_DIRS"] = pkgs_dirs
+    command = str(args[1])
+    profile = None
+    python = get_conda_python(venv.envconfig)
+    if python is not None:
+        directory = venv.envconfig.envlogdir.ensure(dir=1)
+        profile = profiling.profile_path(directory, "conda-{}".format(command))
+        args = profiling.profile_command(args, python, profile)
+    ledger = get_memory_ledger(venv.envconfig)
+    peak_path = None
+    if ledger is not None:
+        key = get_admission_key(venv.envconfig, command, inputs)
+        reservation = ledger.admit(
+            key, on_wait=lambda needed, available: report_memory_wait(venv, needed, available)
+        )
+        # The peak of a profiled conda is not the one of conda alone, it is not recorded.
+        if profile is None:
+            with tempfile.NamedTemporaryFile(
+                dir=os.path.dirname(ledger.path), prefix="tox_conda_tmp", delete=False
+            ) as peak_file:
+                peak_path = peak_file.name
+            args = admission.peak_command(args, sys.executable, peak_path)
+    start = time.monotonic()
+    try:
+        venv._pcall(args, venv=False, action=action, cwd=cwd, redirect=redirect, env=env)
+    finally:
+        if ledger is not None:
+            peak = None if peak_path is None else admission.read_peak(peak_path)
+            ledger.release(reservation, key, peak)
+            if peak_path is not None and os.path.exists(peak_path):
+                os.remove(peak_path)
+        conda_metrics = venv.envconfig.config.conda_metrics
+        if conda_metrics is not None:
+            duration = time.monotonic() - start
+            conda_metrics.observe("tox_conda_process_seconds", duration, command=command)
+        if profile is not None and os.path.isfile(profile):
+            report_profile(venv, profile)
+
+
+def get_memory_ledger(envconfig):
+    """Return the ledger admitting conda processes, ``None`` without ``--conda-admission``."""
+    config = envconfig.config
+    if not config.option.conda_admission or tox.INFO.IS_WIN:
+        return None
+    return admission.Ledger(config.toxworkdir.join(MEMORY_LEDGER))
 
 
-@hookimpl
-def tox_testenv_create(venv, action):
-    tox.venv.cleanup_for_venv(venv)
-    basepath = venv.path.dirpath()
+def get_admission_key(envconfig, command, inputs=None):
+    """Name the conda processes expected to need the same memory as this one.
 
-    # Check for venv.envconfig.sitepackages and venv.config.alwayscopy here
-    envdir = venv.envconfig.envdir
-    python_packages = get_python_packages(venv.envconfig, action)
+    ``inputs`` are the conda inputs of the env, by default the ones it was created from.
+    """
+    if inputs is None:
+        inputs = getattr(envconfig, "conda_inputs", None)
+    if inputs is None:
+        return command
+    return "{}-{}".format(command, marker.inputs_hash(inputs))
 
-    if venv.envconfig.conda_env is not None:
-        env_path = Path(venv.envconfig.conda_env)
-        # conda env create does not have a --channel argument nor does it take
-        # dependencies specifications (e.g., python=3.8). These must all be specified
-        # in the conda-env.yml file
-        yaml = YAML()
-        env_file = yaml.load(env_path)
-        for package in python_packages:
-            env_file["dependencies"].append(package)
-
-        tmp_env = tempfile.NamedTemporaryFile(
-            dir=env_path.parent,
-            prefix="tox_conda_tmp",
-            suffix=".yaml",
-            delete=False,
+
+def report_memory_wait(venv, needed, available):
+    tox.reporter.verbosity0(
+        "{}: waiting for {} MiB of memory to run conda, {} MiB available".format(
+            venv.name, needed >> 20, max(available, 0) >> 20
         )
-        yaml.dump(env_file, tmp_env)
-
-        args = [
-            venv.envconfig.conda_exe,
-            "env",
-            "create",
-            "-p",
-            envdir,
-            "--file",
-            tmp_env.name,
-        ]
-        tmp_env.close()
-        _run_conda_process(args, venv, action, basepath)
-        Path(tmp_env.name).unlink()
+    )
+
+
+def count_metric(config, name, value=1, **labels):
+    """Add ``value`` to the counter ``name`` of the run, if metrics are exported."""
+    conda_metrics = getattr(config, "conda_metrics", None)
+    if conda_metrics is not None:
+        conda_metrics.inc(name, value, **labels)
 
+
+def get_conda_python(envconfig):
+    """Return the interpreter to profile conda with, ``None`` when not profiling."""
+    config = envconfig.config
+    if not config.option.conda_profile:
+        return None
+    if not hasattr(config, "conda_profile_python"):
+        config.conda_profile_python = profiling.conda_python(envconfig.conda_exe)
+        if config.conda_profile_python is None:
+            tox.reporter.warning(
+                "cannot profile conda, {} is not a python script".format(envconfig.conda_exe)
+            )
+    return config.conda_profile_python
+
+
+def profile_hook(hook):
+    """Profile ``hook`` into the log dir of the env when ``--conda-profile`` is given."""
+
+    @functools.wraps(hook)
+    def profiled_hook(venv, action):
+        envconfig = venv.envconfig
+        if not envconfig.config.option.conda_profile:
+            return hook(venv, action)
+        report = functools.partial(report_profile, venv)
+        with profiling.profiled(envconfig.envlogdir, hook.__name__, report=report):
+            return hook(venv, action)
+
+    return profiled_hook
+
+
+def report_profile(venv, path):
+    """Add the profile ``path`` to the summary file of the env and print its top functions."""
+    summary_path = profiling.add_summary(path)
+    tox.reporter.line(
+        "{} profile {} (summarized in {}):".format(venv.name, os.path.basename(path), summary_path)
+    )
+    tox.reporter.line(profiling.summarize(path, profiling.REPORT_TOP))
+
+
+def get_pkgs_dirs(envconfig):
+    """Return the ``CONDA_PKGS_DIRS`` to run conda with, ``None`` to leave it to conda.
+
+    When none of conda's package caches is on the filesystem of the tox work dir, conda
+    copies every file of every package into each env. A package cache in the work dir is
+    used instead then, from which conda hard links. This is decided once per run and only
+    when ``CONDA_PKGS_DIRS`` is not set already. Offline envs keep conda's package caches,
+    which are all they can install from.
+    """
+    config = envconfig.config
+    if not hasattr(config, "conda_pkgs_dirs"):
+        config.conda_pkgs_dirs = None
+        workdir = config.toxworkdir
+        if "CONDA_PKGS_DIRS" not in os.environ:
+            pkgs_dirs = pkgs.find_pkgs_dirs(envconfig.conda_exe)
+            if pkgs_dirs and not pkgs.can_hardlink(pkgs_dirs, workdir):
+                config.conda_pkgs_dirs = str(workdir.join(LOCAL_PKGS_DIR))
+                tox.reporter.verbosity0(
+                    "conda package caches {} are on another filesystem than {}, using "
+                    "{} for online envs".format(
+                        ", ".join(pkgs_dirs), workdir, config.conda_pkgs_dirs
+                    )
+                )
+    if envconfig.conda_offline:
+        return None
+    return config.conda_pkgs_dirs
+
+
+def cleanup_for_venv(venv):
+    """Empty ``envdir`` before a new conda env is created in it.
+
+    Removing a conda prefix can take minutes on slow filesystems, so an existing prefix is
+    renamed aside and deleted in the background while the new env gets created. Anything
+    else is left to tox, which refuses to delete directories that do not look like an env.
+    """
+    if venv.path.join("conda-meta").check(dir=1):
+        # Within parallel runs the log folder is still used by the parent process.
+        keep = {"log", ".lock"} if PARALLEL_ENV_VAR_KEY_PRIVATE in os.environ else ()
+        cleanup.move_aside(venv.path, keep=keep)
     else:
-        args = [venv.envconfig.conda_exe, "create", "--yes", "-p", envdir]
-        for channel in venv.envconfig.conda_channels:
-            args += ["--channel", channel]
+        cleanup.sweep(cleanup.trash_path(venv.path))
+    tox.venv.cleanup_for_venv(venv)
 
-        # Add end-user conda create args
-        args += venv.envconfig.conda_create_args
 
-        args += python_packages
+def get_local_channel(envconfig):
+    """Return the URL of the channel indexing conda's package caches, built once per run."""
+    config = envconfig.config
+    if getattr(config, "conda_local_channel", None) is None:
+        channel_dir = config.toxworkdir.join(".tox-conda-offline-channel")
+        pkgs_dirs = pkgs.find_pkgs_dirs(envconfig.conda_exe)
+        tox.reporter.verbosity1("indexing {} as {}".format(", ".join(pkgs_dirs), channel_dir))
+        config.conda_local_channel = pkgs.build_local_channel(pkgs_dirs, channel_dir)
+    return config.conda_local_channel
+
+
+def get_channel_args(envconfig):
+    """Return the conda arguments selecting the channels to install packages from."""
+    if envconfig.conda_offline:
+        # Only the local channel is usable, do not let conda wait for the network.
+        return ["--offline", "--override-channels", "--channel", get_local_channel(envconfig)]
+    args = []
+    for channel in envconfig.conda_channels:
+        args += ["--channel", channel]
+    return args
+
+
+def get_conda_inputs(envconfig, python_packages):
+    return marker.conda_inputs(
+        python_packages,
+        deps=[dep.name for dep in envconfig.conda_deps],
+        channels=envconfig.conda_channels,
+        create_args=envconfig.conda_create_args,
+        install_args=envconfig.conda_install_args,
+        spec_file=envconfig.conda_spec,
+        env_file=envconfig.conda_env,
+        base_env=get_base_env_digest(envconfig),
+    )
+
+
+def is_base_env_file(envconfig):
+    """Tell whether the base env is an environment.yml file rather than a prefix."""
+    return envconfig.conda_base_env is not None and envconfig.conda_base_env.check(file=1)
+
 
-        _run_conda_process(args, venv, action, basepath)
+def get_base_env_digest(envconfig):
+    """Return the digest of the content of the base env, ``None`` when there is none.
+
+    The path of a base env that cannot be read, e.g. a prefix not created yet, is returned
+    instead: the inputs then differ from the ones of an env without a base env.
+    """
+    if envconfig.conda_base_env is None:
+        return None
+    if is_base_env_file(envconfig):
+        return marker.env_file_digest(envconfig.conda_base_env)
+    try:
+        return meta.prefix_digest(envconfig.conda_base_env)
+    except OSError:
+        return str(envconfig.conda_base_env)
+
+
+def can_reuse_env(venv):
+    """Tell whether the conda prefix left in ``envdir`` can be used as is.
+
+    This is the case when a previous run provisioned it completely from the same conda
+    inputs, tox recreating the env for another reason: the pip dependencies changed, or the
+    previous run was interrupted before tox recorded the env as done, e.g. while installing
+    the pip dependencies. Only ``-r`` recreates a complete prefix.
+    """
+    if venv.envconfig.recreate:
+        return False
+    return marker.is_complete(venv.path, venv.envconfig.conda_inputs)
+
+
+def check_conda_prefix(envconfig, python_packages):
+    """Check that the ``conda_prefix`` of ``envconfig`` provides its python and conda deps.
+
+    The names and versions of the packages are taken from the names of the ``conda-meta``
+    records, so that an env run in a prebuilt prefix costs no more than a directory scan.
+    """
+    prefix = envconfig.conda_prefix
+    try:
+        installed = meta.package_versions(prefix)
+    except OSError:
+        raise UnusablePrefix("conda_prefix {} is not a conda env".format(prefix))
+    specs = list(python_packages or []) + [str(dep.name) for dep in envconfig.conda_deps]
+    unmet = []
+    for spec in specs:
+        try:
+            parsed = matchspec.parse(spec)
+        except matchspec.MatchSpecError:
+            # Not a form handled here, it cannot be checked.
+            continue
+        version = installed.get(parsed.name)
+        if version is None:
+            unmet.append(spec)
+        elif not parsed.matches_version(version):
+            unmet.append("{} ({} installed)".format(spec, version))
+    if unmet:
+        raise UnusablePrefix(
+            "conda_prefix {} does not provide {}".format(prefix, ", ".join(unmet))
+        )
+
+
+def uninstall_pip_packages(venv, action):
+    """Uninstall what pip installed on top of the conda prefix, to install the deps afresh."""
+    envconfig = venv.envconfig
+    if envconfig.conda_env is not None and has_pip_dependencies(envconfig.conda_env):
+        # The pip dependencies of the environment.yml file would not be installed again.
+        return
+    try:
+        names = meta.pip_distributions(venv.path)
+    except (OSError, ValueError):
+        return
+    if not names:
+        return
+    action.setactivity("uninstallpipdeps", ", ".join(names))
+    redirect = tox.reporter.verbosity() < tox.reporter.Verbosity.DEBUG
+    venv._pcall(
+        [envconfig.envpython, "-m", "pip", "uninstall", "--yes"] + names,
+        cwd=venv.path.dirpath(),
+        action=action,
+        redirect=redirect,
+    )
+
+
+def get_live_config(venv):
+    """Return the config tox compares with the one it recorded to decide to reuse the env.
+
+    This is what ``VirtualEnv._getliveconfig`` returns, except that the interpreter is only
+    looked up, not run to ask for its version.
+    """
+    envconfig = venv.envconfig
+    python = envconfig.config.interpreters.get_executable(envconfig)
+    return CreationConfig(
+        getdigest(python),
+        python,
+        tox.__version__,
+        envconfig.sitepackages,
+        envconfig.usedevelop,
+        [(getdigest(dep.name), dep.name) for dep in venv.get_resolved_dependencies()],
+        envconfig.alwayscopy,
+    )
+
+
+def get_pip_changes(venv):
+    """Describe why tox would not reuse the env as it recorded it, if it would not."""
+    recorded = CreationConfig.readconfig(venv.path_config)
+    if recorded is None:
+        return ["no pip deps recorded"]
+    live = get_live_config(venv)
+    if recorded.matches(live, getattr(venv.envconfig, "deps_matches_subset", False)):
+        return []
+    changes = plan.deps_changes(recorded.deps, live.deps)
+    if recorded.base_resolved_python_path != live.base_resolved_python_path:
+        changes.append(
+            "python {} -> {}".format(
+                recorded.base_resolved_python_path, live.base_resolved_python_path
+            )
+        )
+    elif recorded.base_resolved_python_sha256 != live.base_resolved_python_sha256:
+        changes.append("python content changed")
+    for name in ("tox_version", "sitepackages", "usedevelop", "alwayscopy"):
+        if getattr(recorded, name) != getattr(live, name):
+            changes.append(
+                "{} {} -> {}".format(name, getattr(recorded, name), getattr(live, name))
+            )
+    return changes or ["recorded config changed"]
+
+
+def plan_env(envconfig):
+    """Return what a run would do with the conda env of ``envconfig``, and why.
+
+    tox itself first decides whether to call tox-conda at all: an env it recorded with the
+    same deps, which include the conda inputs, is reused as it is.
+    """
+    python_packages = get_python_packages(envconfig, None)
+    if python_packages is None:
+        return plan.UNKNOWN, ["cannot find {}".format(envconfig.basepython)]
+    pip_changes = get_pip_changes(VirtualEnv(envconfig))
+    if not envconfig.recreate and not pip_changes:
+        return plan.REUSE, []
+    if envconfig.conda_prefix is not None:
+        # Nothing is provisioned on the conda side, at most the pip deps are installed again.
+        return plan.UPDATE, pip_changes or ["-r flag"]
+    return plan.plan_env(
+        envconfig.envdir,
+        get_conda_inputs(envconfig, python_packages),
+        recreate=envconfig.recreate,
+        pip_changes=pip_changes,
+    )
+
+
+def report_plan(config):
+    """Print what a run would do with the conda env of each selected env."""
+    for name in config.envlist:
+        decision, reasons = plan_env(config.envconfigs[name])
+        tox.reporter.line(plan.format_plan(name, decision, reasons))
+
+
+def adopt_prebuilt_env(venv):
+    """Wait for the background build of this env, if any, and tell whether it can be used."""
+    prebuilder = getattr(venv.envconfig.config, "conda_prebuilder", None)
+    if prebuilder is None:
+        return False
+    try:
+        job = prebuilder.wait(venv.name)
+    except PrebuildFailed as exception:
+        tox.reporter.warning(str(exception))
+        return False
+    return job is not None and marker.is_complete(venv.path, venv.envconfig.conda_inputs)
+
+
+def has_pip_dependencies(env_path):
+    """Tell whether a conda environment.yml file also lists pip dependencies."""
+    from ruamel.yaml import YAML
+
+    dependencies = YAML().load(Path(env_path)).get("dependencies") or []
+    return any(isinstance(dependency, dict) and "pip" in dependency for dependency in dependencies)
+
+
+def find_identical_env(venv):
+    """Return the envdir of another selected env provisioned from the same conda inputs."""
+    config = venv.envconfig.config
+    for name in config.envlist:
+        envconfig = config.envconfigs.get(name)
+        if envconfig is None or envconfig.envdir == venv.path:
+            continue
+        if marker.is_complete(envconfig.envdir, venv.envconfig.conda_inputs):
+            return envconfig.envdir
+    return None
+
+
+def clone_identical_env(venv, action):
+    """Materialize the conda env from an identical env of this run instead of building it.
+
+    The packages of the other env are linked from the package cache through an explicit
+    spec, so conda neither solves nor downloads anything. Only the pip step remains to be
+    done afterwards. Return ``False`` when there is no env to clone from.
+    """
+    source = find_identical_env(venv)
+    if source is None:
+        return False
+    # Packages installed by pip from an environment.yml file are unknown to conda-meta.
+    if venv.envconfig.conda_env is not None and has_pip_dependencies(venv.envconfig.conda_env):
+        return False
+    try:
+        spec = meta.explicit_spec(source)
+        offline = spec is not None and meta.packages_cached(source)
+    except (OSError, ValueError):
+        spec = None
+    if spec is None:
+        return False
+
+    action.setactivity("clonecondaenv", source)
+    create_from_explicit_spec(venv, action, spec, offline)
+    marker.write_marker(venv.path, venv.envconfig.conda_inputs)
+    return True
 
+
+def create_from_explicit_spec(venv, action, spec, offline=False):
+    """Create the conda env from the content of an ``@EXPLICIT`` spec file."""
+    venv.path.dirpath().ensure(dir=1)
+    run_explicit_spec(venv, action, "create", spec, offline)
+
+
+def run_explicit_spec(venv, action, command, spec, offline=False):
+    """Run the conda ``command`` on the env with the content of an ``@EXPLICIT`` spec file."""
+    tmp_spec = tempfile.NamedTemporaryFile(
+        "w",
+        dir=str(venv.path.dirpath()),
+        prefix="tox_conda_tmp",
+        suffix=".txt",
+        delete=False,
+    )
+    with tmp_spec:
+        tmp_spec.write(spec)
+    args = [venv.envconfig.conda_exe, command, "--yes", "-p", venv.path, "--file", tmp_spec.name]
+    if offline or venv.envconfig.conda_offline:
+        # Everything is linked from the package cache, spare conda any network access.
+        args.append("--offline")
+    try:
+        _run_conda_process(args, venv, action, venv.path.dirpath())
+    finally:
+        os.remove(tmp_spec.name)
+
+
+def repair_env(venv, action):
+    """Undo the changes made to the conda packages of the env since it was provisioned.
+
+    The packages added are removed and the ones removed installed again from their recorded
+    spec lines, neither requires solving. Nothing is done when the fingerprint of
+    ``conda-meta`` is unchanged, which only takes stat calls.
+    """
+    try:
+        env_drift = drift.find_drift(venv.path)
+    except (OSError, ValueError, KeyError) as exception:
+        tox.reporter.warning("cannot check the conda env for changes: {}".format(exception))
+        return
+    if env_drift is None:
+        return
+    if None in env_drift.missing:
+        tox.reporter.warning(
+            "cannot repair the conda env, the origin of a removed package is unknown: "
+            "recreate it with -r"
+        )
+        return
+    if env_drift.extra:
+        action.setactivity("removecondapkgs", ", ".join(env_drift.extra))
+        args = [venv.envconfig.conda_exe, "remove", "--yes", "--force", "-p", venv.path]
+        _run_conda_process(args + env_drift.extra, venv, action, venv.path.dirpath())
+    if env_drift.missing:
+        names = [line.split("#")[0].rsplit("/", 1)[-1] for line in env_drift.missing]
+        action.setactivity("restorecondapkgs", ", ".join(names))
+        spec = "\n".join([meta.EXPLICIT_HEADER] + env_drift.missing) + "\n"
+        run_explicit_spec(venv, action, "install", spec)
+    drift.record(venv.path)
+
+
+def get_store(envconfig):
+    if envconfig.conda_store is None:
+        return None
+    return store.open_store(envconfig.conda_store)
+
+
+def stored_spec_name(envconfig):
+    return marker.inputs_hash(envconfig.conda_inputs) + ".txt"
+
+
+def stored_archive_name(envconfig):
+    return marker.inputs_hash(envconfig.conda_inputs) + archive.ARCHIVE_SUFFIX
+
+
+def fetch_cached_archive(venv, action):
+    """Return the path of an archive of the conda env, ``None`` if there is none.
+
+    The archive cache is looked into first, then the store. An archive fetched from the
+    store is kept in the archive cache, if any.
+    """
+    envconfig = venv.envconfig
+    if envconfig.conda_cache_dir is not None:
+        path = archive.archive_path(envconfig.conda_cache_dir, envconfig.conda_inputs)
+        if os.path.isfile(path):
+            return path
+    conda_store = get_store(envconfig)
+    if conda_store is None:
+        return None
+    if envconfig.conda_cache_dir is None:
+        path = str(
+            envconfig.config.toxworkdir.join(STORE_DOWNLOAD_DIR, stored_archive_name(envconfig))
+        )
+
+    action.setactivity(
+        "fetchcondaenv", "{} from {}".format(stored_archive_name(envconfig), conda_store)
+    )
+    try:
+        if conda_store.fetch(stored_archive_name(envconfig), path):
+            return path
+    except store.StoreError as exception:
+        tox.reporter.warning("cannot fetch the conda env: {}".format(exception))
+    return None
+
+
+def restore_cached_env(venv, action):
+    """Restore the conda env from an archive instead of building it.
+
+    Return ``False`` when there is no archive for the conda inputs of the env, or when it
+    could not be restored.
+    """
+    path = fetch_cached_archive(venv, action)
+    if path is None:
+        return False
+
+    action.setactivity("restorecondaenv", path)
+    try:
+        archive.unpack(path, venv.path)
+    except (OSError, ValueError, archive.ArchiveError) as exception:
+        tox.reporter.warning("cannot restore {}: {}".format(path, exception))
+        cleanup_for_venv(venv)
+        return False
+    finally:
+        if venv.envconfig.conda_cache_dir is None and os.path.isfile(path):
+            os.remove(path)
+    marker.write_marker(venv.path, venv.envconfig.conda_inputs)
+    return True
+
+
+def create_from_stored_spec(venv, action):
+    """Create the conda env from the explicit spec solved by another machine, if any."""
+    envconfig = venv.envconfig
+    conda_store = get_store(envconfig)
+    if conda_store is None:
+        return False
+    if envconfig.conda_env is not None and has_pip_dependencies(envconfig.conda_env):
+        return False
+
+    name = stored_spec_name(envconfig)
+    path = str(envconfig.config.toxworkdir.join(STORE_DOWNLOAD_DIR, name))
+    try:
+        if not conda_store.fetch(name, path):
+            return False
+        with open(path) as stream:
+            spec = stream.read()
+    except (OSError, store.StoreError) as exception:
+        tox.reporter.warning("cannot fetch the conda spec: {}".format(exception))
+        return False
+    finally:
+        if os.path.isfile(path):
+            os.remove(path)
+
+    action.setactivity("createcondaenv", "from {} of {}".format(name, conda_store))
+    create_from_explicit_spec(venv, action, spec)
+    marker.write_marker(venv.path, envconfig.conda_inputs)
+    return True
+
+
+def store_cached_env(venv, action):
+    """Add the complete conda env to the archive cache, unless it is already there."""
+    cache_dir = venv.envconfig.conda_cache_dir
+    if cache_dir is None:
+        return
+    path = archive.archive_path(cache_dir, venv.envconfig.conda_inputs)
+    if os.path.isfile(path) or not marker.is_complete(venv.path, venv.envconfig.conda_inputs):
+        return
+
+    action.setactivity("packcondaenv", path)
+    try:
+        archive.pack(venv.path, path)
+    except (OSError, ValueError, archive.ArchiveError) as exception:
+        tox.reporter.warning("cannot cache {}: {}".format(venv.path, exception))
+
+
+def publish_env(venv, action):
+    """Publish the explicit spec and the archive of the complete conda env to the store."""
+    envconfig = venv.envconfig
+    conda_store = get_store(envconfig)
+    if conda_store is None or not marker.is_complete(venv.path, envconfig.conda_inputs):
+        return
+
+    download_dir = envconfig.config.toxworkdir.join(STORE_DOWNLOAD_DIR)
+    try:
+        name = stored_spec_name(envconfig)
+        pip_dependencies = envconfig.conda_env is not None and has_pip_dependencies(
+            envconfig.conda_env
+        )
+        if not pip_dependencies and not conda_store.contains(name):
+            spec = meta.explicit_spec(venv.path)
+            if spec is not None:
+                action.setactivity("publishcondaspec", "{} to {}".format(name, conda_store))
+                path = download_dir.ensure(name)
+                path.write(spec)
+                try:
+                    conda_store.publish(name, str(path))
+                finally:
+                    path.remove()
+
+        name = stored_archive_name(envconfig)
+        if not conda_store.contains(name):
+            action.setactivity("publishcondaenv", "{} to {}".format(name, conda_store))
+            if envconfig.conda_cache_dir is not None:
+                path = archive.archive_path(envconfig.conda_cache_dir, envconfig.conda_inputs)
+            else:
+                path = str(download_dir.join(name))
+            if not os.path.isfile(path):
+                archive.pack(venv.path, path)
+            try:
+                conda_store.publish(name, path)
+            finally:
+                if envconfig.conda_cache_dir is None:
+                    os.remove(path)
+    except (OSError, ValueError, archive.ArchiveError, store.StoreError) as exception:
+        tox.reporter.warning("cannot publish the conda env: {}".format(exception))
+
+
+@hookimpl
+@profile_hook
+def tox_testenv_create(venv, action):
+    check_conda_spec_syntax(venv.envconfig)
+    python_packages = get_python_packages(venv.envconfig, action)
     venv.envconfig.conda_python_packages = python_packages
+    venv.envconfig.conda_inputs = get_conda_inputs(venv.envconfig, python_packages)
+    venv.envconfig.conda_reused = True
+
+    if venv.envconfig.conda_prefix is not None:
+        check_conda_prefix(venv.envconfig, python_packages)
+        action.setactivity("usecondaprefix", venv.envconfig.conda_prefix)
+        # Only tox keeps its own records and logs in envdir.
+        venv.path.ensure(dir=1)
+        outcome = "external"
+    elif adopt_prebuilt_env(venv):
+        action.setactivity("adoptcondaenv", venv.envconfig.envdir)
+        outcome = "prebuilt"
+    elif can_reuse_env(venv):
+        action.setactivity("reusecondaenv", venv.envconfig.envdir)
+        uninstall_pip_packages(venv, action)
+        outcome = "updated"
+    else:
+        cleanup_for_venv(venv)
+        materializers = (
+            ("cloned", clone_identical_env),
+            ("restored", restore_cached_env),
+            ("fetched", create_from_stored_spec),
+        )
+        outcome = next(
+            (name for name, materialize in materializers if materialize(venv, action)), None
+        )
+        if outcome is None:
+            venv.envconfig.conda_reused = False
+            create_conda_env(venv, action, python_packages)
+            outcome = "created"
+    count_metric(venv.envconfig.config, "tox_conda_envs_total", outcome=outcome)
 
     # let the venv know about the target interpreter just installed in our conda env, otherwise
     # we'll have a mismatch later because tox expects the interpreter to be existing outside of
@@ -224,35 +1155,408 @@ def tox_testenv_create(venv, action):
     return True
 
 
-def install_conda_deps(venv, action, basepath, envdir):
+@contextmanager
+def conda_create_command(envconfig, python_packages):
+    """Yield the command line creating the conda env of ``envconfig``."""
+    # Check for venv.envconfig.sitepackages and venv.config.alwayscopy here
+    envdir = envconfig.envdir
+
+    if envconfig.conda_env is not None:
+        with env_file_create_command(
+            envconfig, envconfig.conda_env, python_packages, envdir
+        ) as args:
+            yield args
+
+    else:
+        args = [envconfig.conda_exe, "create", "--yes", "-p", envdir]
+        args += get_channel_args(envconfig)
+
+        # Add end-user conda create args
+        args += envconfig.conda_create_args
+
+        args += python_packages
+
+        yield args
+
+
+@contextmanager
+def env_file_create_command(envconfig, env_path, python_packages, prefix):
+    """Yield the command line creating ``prefix`` from the environment.yml ``env_path``."""
+    env_path = Path(str(env_path))
+    # Only loaded when there is an environment.yml file, it is slow to import.
+    from ruamel.yaml import YAML
+
+    # conda env create does not have a --channel argument nor does it take
+    # dependencies specifications (e.g., python=3.8). These must all be specified
+    # in the conda-env.yml file
+    yaml = YAML()
+    env_file = yaml.load(env_path)
+    for package in python_packages:
+        env_file["dependencies"].append(package)
+    if envconfig.conda_offline:
+        env_file["channels"] = [get_local_channel(envconfig), "nodefaults"]
+
+    tmp_env = tempfile.NamedTemporaryFile(
+        dir=env_path.parent,
+        prefix="tox_conda_tmp",
+        suffix=".yaml",
+        delete=False,
+    )
+    yaml.dump(env_file, tmp_env)
+
+    args = [
+        envconfig.conda_exe,
+        "env",
+        "create",
+        "-p",
+        prefix,
+        "--file",
+        tmp_env.name,
+    ]
+    if envconfig.conda_offline:
+        args.append("--offline")
+    tmp_env.close()
+    yield args
+    Path(tmp_env.name).unlink()
+
+
+def get_conda_deps(envconfig):
     # Account for the fact that we have a list of DepOptions
-    conda_deps = [str(dep.name) for dep in venv.envconfig.conda_deps]
+    conda_deps = [str(dep.name) for dep in envconfig.conda_deps]
     # Add the conda-spec.txt file to the end of the conda deps b/c any deps
     # after --file option(s) are ignored
-    if venv.envconfig.conda_spec is not None:
-        conda_deps.append("--file={}".format(venv.envconfig.conda_spec))
+    if envconfig.conda_spec is not None:
+        conda_deps.append("--file={}".format(envconfig.conda_spec))
+    return conda_deps
 
-    action.setactivity("installcondadeps", ", ".join(conda_deps))
+
+def conda_install_command(envconfig, python_packages, envdir):
+    """Return the command line installing the conda deps, ``None`` if there are none."""
+    conda_deps = get_conda_deps(envconfig)
+    if not conda_deps:
+        return None
 
     # Install quietly to make the log cleaner
-    args = [venv.envconfig.conda_exe, "install", "--quiet", "--yes", "-p", envdir]
-    for channel in venv.envconfig.conda_channels:
-        args += ["--channel", channel]
+    args = [envconfig.conda_exe, "install", "--quiet", "--yes", "-p", envdir]
+    args += get_channel_args(envconfig)
 
     # Add end-user conda install args
-    args += venv.envconfig.conda_install_args
+    args += envconfig.conda_install_args
 
     # We include the python version in the conda requirements in order to make
     # sure that none of the other conda requirements inadvertently downgrade
     # python in this environment. If any of the requirements are in conflict
     # with the installed python version, installation will fail (which is what
     # we want).
-    args += venv.envconfig.conda_python_packages + conda_deps
+    return args + python_packages + conda_deps
+
+
+def get_prebuild_job(envconfig, venv):
+    """Return the job building the conda env of ``envconfig`` ahead of time.
+
+    ``None`` is returned for envs that tox is likely to reuse as they are, and for envs whose
+    conda inputs cannot be determined without running an action. The command lines are
+    built here, in the main thread and the action of ``venv``, the env being run.
+    """
+    envdir = envconfig.envdir
+    if not envconfig.recreate and envdir.join(".tox-config1").check():
+        return None
+    if envconfig.conda_base_env is not None:
+        # The base env may have to be created first, which is left to the env itself.
+        return None
+    if envconfig.conda_prefix is not None:
+        return None
+    if get_invalid_conda_specs(envconfig):
+        # The env fails on them itself, before running conda.
+        return None
+    if envdir.check() and not envdir.join("conda-meta").check(dir=1):
+        if {path.basename for path in envdir.listdir()} - {"log"}:
+            # Leave it to tox to decide whether it is safe to delete.
+            return None
 
+    python_packages = get_python_packages(envconfig, None)
+    if python_packages is None:
+        return None
+    inputs = get_conda_inputs(envconfig, python_packages)
+    if marker.is_complete(envdir, inputs):
+        return None
+
+    resources = ExitStack()
+    try:
+        commands = [resources.enter_context(conda_create_command(envconfig, python_packages))]
+        install_args = conda_install_command(envconfig, python_packages, envdir)
+    except BaseException:
+        resources.close()
+        raise
+    if install_args is not None:
+        commands.append(install_args)
+
+    prebuild_venv = VirtualEnv(
+        envconfig, popen=venv.popen, env_log=venv.env_log.reportlog.get_envlog(envconfig.envname)
+    )
+    return PrebuildJob(
+        envconfig.envname,
+        envdir,
+        inputs,
+        commands,
+        run_command=functools.partial(run_prebuild_command, prebuild_venv, inputs),
+        log_path=envconfig.envlogdir.join("conda-prebuild.log"),
+        resources=resources,
+    )
+
+
+def run_prebuild_command(venv, inputs, args):
+    """Run one step of a background build, as the env would run it itself."""
+    with venv.new_action("prebuild") as action:
+        # The output of a background build must not mix with the one of the current env.
+        _run_conda_process(args, venv, action, venv.path.dirpath(), redirect=True, inputs=inputs)
+
+
+def schedule_prebuilds(venv):
+    """Start building the conda envs of the next selected envs in the background."""
+    config = venv.envconfig.config
+    prebuilder = getattr(config, "conda_prebuilder", None)
+    if prebuilder is None or venv.name not in config.envlist:
+        return
+
+    upcoming = config.envlist[config.envlist.index(venv.name) + 1 :]
+    for name in upcoming[: prebuilder.max_workers]:
+        envconfig = config.envconfigs.get(name)
+        if envconfig is None or prebuilder.is_scheduled(name):
+            continue
+        job = get_prebuild_job(envconfig, venv)
+        if job is not None:
+            tox.reporter.verbosity1("{} prebuild: starting in the background".format(name))
+            prebuilder.submit(job)
+
+
+def get_base_prefix(venv, action, python_packages):
+    """Return the prefix of the base env, creating it first from its environment.yml file.
+
+    A base env created from a file is kept in the tox work dir, by content of the file and
+    python version, and shared by all envs of this and later runs.
+    """
+    envconfig = venv.envconfig
+    if not is_base_env_file(envconfig):
+        return envconfig.conda_base_env
+
+    inputs = marker.conda_inputs(python_packages, env_file=envconfig.conda_base_env)
+    base_dir = envconfig.config.toxworkdir.join(BASE_ENV_DIR).ensure(dir=1)
+    prefix = base_dir.join(marker.inputs_hash(inputs)[:16])
+    # Concurrent tox runs wait for the one creating the base env.
+    with filelock.FileLock(str(prefix) + ".lock"):
+        if not marker.is_complete(prefix, inputs):
+            cleanup.move_aside(prefix)
+            action.setactivity("createcondabase", envconfig.conda_base_env)
+            with env_file_create_command(
+                envconfig, envconfig.conda_base_env, python_packages, prefix
+            ) as args:
+                _run_conda_process(args, venv, action, base_dir)
+            marker.write_marker(prefix, inputs)
+    return prefix
+
+
+def create_from_base_env(venv, action, python_packages):
+    """Create the conda env from its base env, before the conda deps are installed on top.
+
+    The packages of the base env are linked through an explicit spec, so the base env is
+    neither solved nor downloaded again. Base envs whose records do not tell where their
+    packages come from are cloned instead.
+    """
+    envconfig = venv.envconfig
+    prefix = get_base_prefix(venv, action, python_packages)
+    try:
+        spec = meta.explicit_spec(prefix)
+        offline = spec is not None and meta.packages_cached(prefix)
+    except (OSError, ValueError):
+        spec = None
+
+    action.setactivity("createcondaenv", "from base {}".format(prefix))
+    if spec is not None:
+        create_from_explicit_spec(venv, action, spec, offline)
+        return
+    args = [envconfig.conda_exe, "create", "--yes", "-p", venv.path, "--clone", prefix]
+    if envconfig.conda_offline:
+        args.append("--offline")
+    _run_conda_process(args, venv, action, venv.path.dirpath())
+
+
+def create_conda_env(venv, action, python_packages):
+    if venv.envconfig.conda_base_env is not None:
+        create_from_base_env(venv, action, python_packages)
+        return
+    with conda_create_command(venv.envconfig, python_packages) as args:
+        _run_conda_process(args, venv, action, venv.path.dirpath())
+
+
+def install_conda_deps(venv, action, basepath, envdir):
+    args = conda_install_command(venv.envconfig, venv.envconfig.conda_python_packages, envdir)
+    if args is None:
+        return
+
+    action.setactivity("installcondadeps", ", ".join(get_conda_deps(venv.envconfig)))
     _run_conda_process(args, venv, action, basepath)
 
 
+def find_uv():
+    """Return the path of the uv executable, ``None`` if there is none.
+
+    uv is looked for next to the python running tox first, where ``pip install uv`` puts it.
+    """
+    path = os.pathsep.join([os.path.dirname(sys.executable), os.environ.get("PATH", os.defpath)])
+    return shutil.which("uv", path=path)
+
+
+def write_pip_constraints(venv):
+    """Write the python packages installed by conda as pip constraints, return the file path."""
+    constraints = sorted(
+        "{}=={}\n".format(name, version) for name, version in meta.python_distributions(venv.path)
+    )
+    tmp_constraints = tempfile.NamedTemporaryFile(
+        "w",
+        dir=str(venv.path.dirpath()),
+        prefix="tox_conda_tmp",
+        suffix=".txt",
+        delete=False,
+    )
+    with tmp_constraints:
+        tmp_constraints.writelines(constraints)
+    return tmp_constraints.name
+
+
+@contextmanager
+def pip_installer(venv):
+    """Install the pip dependencies with the installer selected by ``conda_pip_installer``.
+
+    With uv, the python packages installed by conda are given as constraints, so that neither
+    uv nor pip, when uv cannot be found, replace them.
+    """
+    envconfig = venv.envconfig
+    if envconfig.conda_pip_installer == "pip":
+        yield
+        return
+
+    install_command = envconfig.install_command
+    uv = find_uv()
+    if uv is None:
+        tox.reporter.warning("cannot find uv, the pip dependencies are installed by pip")
+        command = list(install_command)
+    else:
+        command = [uv, "pip", "install", "--python", str(envconfig.envpython)]
+        command += ["{opts}", "{packages}"]
+    constraints = write_pip_constraints(venv)
+    index = command.index("{packages}")
+    command[index:index] = ["-c", constraints]
+    envconfig.install_command = command
+    try:
+        yield
+    finally:
+        envconfig.install_command = install_command
+        os.remove(constraints)
+
+
+def get_wheelhouse_dir(venv, action):
+    """Return the directory of the wheelhouse for the ABI and platform of the env python."""
+    output = action.popen(
+        [venv.envconfig.envpython, "-c", wheelhouse.TAG_SCRIPT], report_fail=True, returnout=True
+    )
+    return venv.envconfig.conda_wheelhouse.join(output.strip()).ensure(dir=1)
+
+
+def install_deps_from_wheelhouse(venv, action):
+    """Install the pip dependencies from the wheelhouse, adding their wheels first if needed.
+
+    The wheels are built or downloaded once per set of deps and ABI, later envs install them
+    without any index. Return ``False`` when there is no wheelhouse, when dependencies use
+    another index server than the default one, or when some are editable or local paths.
+    """
+    envconfig = venv.envconfig
+    if envconfig.conda_wheelhouse is None:
+        return False
+    deps = venv.get_resolved_dependencies()
+    if not deps or any(dep.indexserver is not None for dep in deps):
+        return False
+
+    packages = [dep.name for dep in deps]
+    options = venv._installopts(envconfig.config.indexserver["default"].url)
+    inputs = wheelhouse.deps_inputs(packages, options, str(envconfig.config.toxinidir))
+    if inputs is None:
+        # Left to pip, which installs them from their source.
+        return False
+    directory = get_wheelhouse_dir(venv, action)
+    if not wheelhouse.is_stamped(directory, inputs):
+        action.setactivity("buildwheels", "{} into {}".format(", ".join(packages), directory))
+        build_dir = tempfile.mkdtemp(dir=str(directory), prefix=".tox_conda_tmp")
+        try:
+            args = [envconfig.envpython, "-m", "pip", "wheel", "--wheel-dir", build_dir]
+            args += ["--find-links", str(directory)] + options + packages
+            redirect = tox.reporter.verbosity() < tox.reporter.Verbosity.DEBUG
+            venv._pcall(args, cwd=envconfig.config.toxinidir, action=action, redirect=redirect)
+            wheelhouse.add_wheels(build_dir, directory, inputs)
+        finally:
+            shutil.rmtree(build_dir, ignore_errors=True)
+
+    action.setactivity("installdeps", "{} from {}".format(", ".join(packages), directory))
+    options = ["--no-index", "--find-links", str(directory)]
+    if envconfig.pip_pre:
+        options.append("--pre")
+    venv.run_install_command(packages, action, options)
+    return True
+
+
+def record_fingerprint(venv):
+    """Fingerprint the packages of the env, unless they already are since it was provisioned.
+
+    Only envs with ``conda_repair`` are fingerprinted, nothing else compares the packages.
+    Envs provisioned in another way than by a ``conda create`` of this run, e.g. restored
+    from an archive or provisioned by an older version, are fingerprinted on their first use.
+    """
+    if not venv.envconfig.conda_repair or not venv.path.join("conda-meta").check(dir=1):
+        return
+    reused = getattr(venv.envconfig, "conda_reused", True)
+    if not reused or drift.read_fingerprint(venv.path) is None:
+        try:
+            drift.record(venv.path)
+        except (OSError, ValueError) as exception:
+            tox.reporter.warning("cannot fingerprint the conda env: {}".format(exception))
+
+
+def report_link_types(venv, action):
+    """Report how conda linked the packages into the env, copies being much slower."""
+    try:
+        link_types = meta.link_types(venv.path)
+    except (OSError, ValueError):
+        return
+    if link_types:
+        action.setactivity("condalink", ", ".join(link_types))
+    if getattr(venv.envconfig.config, "conda_metrics", None) is not None:
+        try:
+            linked_bytes = meta.linked_bytes(venv.path)
+        except (OSError, ValueError):
+            return
+        for link_type, size in sorted(linked_bytes.items()):
+            count_metric(
+                venv.envconfig.config, "tox_conda_linked_bytes_total", size, link_type=link_type
+            )
+
+
+def precompile_env(venv, action):
+    """Compile the modules of the env ahead of the commands, if enabled."""
+    envconfig = venv.envconfig
+    if not envconfig.conda_precompile:
+        return
+    action.setactivity("precompile", envconfig.envdir)
+    redirect = tox.reporter.verbosity() < tox.reporter.Verbosity.DEBUG
+    venv._pcall(
+        [envconfig.envpython, "-c", PRECOMPILE_SCRIPT],
+        cwd=envconfig.envdir,
+        action=action,
+        redirect=redirect,
+    )
+
+
 @hookimpl
+@profile_hook
 def tox_testenv_install_deps(venv, action):
     # Save the deps before we make temporary changes.
     saved_deps = copy.deepcopy(venv.envconfig.deps)
@@ -261,19 +1565,38 @@ def tox_testenv_install_deps(venv, action):
     if venv.envconfig.conda_spec is not None:
         num_conda_deps += 1
 
-    if num_conda_deps > 0:
-        install_conda_deps(venv, action, venv.path.dirpath(), venv.envconfig.envdir)
+    # A conda_prefix is managed outside of tox, only the pip deps are installed into it.
+    if venv.envconfig.conda_prefix is None:
+        if not getattr(venv.envconfig, "conda_reused", False):
+            install_conda_deps(venv, action, venv.path.dirpath(), venv.envconfig.envdir)
+            # All conda steps succeeded, the prefix is complete from now on.
+            marker.write_marker(venv.envconfig.envdir, venv.envconfig.conda_inputs)
+            report_link_types(venv, action)
+        elif venv.envconfig.conda_repair:
+            repair_env(venv, action)
+        record_fingerprint(venv)
+        # Before archiving, so that envs restored from the archive start with compiled modules.
+        precompile_env(venv, action)
+        store_cached_env(venv, action)
+        publish_env(venv, action)
 
     # Account for the fact that we added the conda_deps to the deps list in
     # tox_configure (see comment there for rationale). We don't want them
     # to be present when we call pip install.
     if venv.envconfig.conda_env is not None:
         num_conda_deps += 1
+    if is_base_env_file(venv.envconfig):
+        num_conda_deps += 1
+    if getattr(venv.envconfig, "conda_options_dep", None) is not None:
+        num_conda_deps += 1
     if num_conda_deps > 0:
         venv.envconfig.deps = venv.envconfig.deps[:-num_conda_deps]
 
-    with activate_env(venv, action):
-        tox.venv.tox_testenv_install_deps(venv=venv, action=action)
+    with activate_env(venv, action), pip_installer(venv):
+        if not install_deps_from_wheelhouse(venv, action):
+            tox.venv.tox_testenv_install_deps(venv=venv, action=action)
+    if venv.envconfig.deps:
+        precompile_env(venv, action)
 
     # Restore the deps.
     venv.envconfig.deps = saved_deps
@@ -281,12 +1604,28 @@ def tox_testenv_install_deps(venv, action):
     return True
 
 
+@hookimpl
+def tox_cleanup(session):
+    config = session.config
+    prebuilder = getattr(config, "conda_prebuilder", None)
+    if prebuilder is not None:
+        prebuilder.shutdown()
+    conda_metrics = getattr(config, "conda_metrics", None)
+    if not conda_metrics:
+        return
+    try:
+        conda_metrics.update_file(config.option.conda_metrics_file)
+    except OSError as exception:
+        tox.reporter.warning("cannot write the conda metrics: {}".format(exception))
+
+
 @hookimpl
 def tox_get_python_executable(envconfig):
+    prefix = get_prefix(envconfig)
     if tox.INFO.IS_WIN:
-        path = envconfig.envdir.join("python.exe")
+        path = prefix.join("python.exe")
     else:
-        path = envconfig.envdir.join("bin", "python")
+        path = prefix.join("bin", "python")
     if path.exists():
         return path
 
@@ -298,11 +1637,17 @@ def get_envpython(self):
     if original_envpython.exists():
         return original_envpython
     if tox.INFO.IS_WIN:
-        return self.envdir.join("python")
+        return get_prefix(self).join("python")
 
 
-TestenvConfig.__get_envpython = TestenvConfig.get_envpython
-TestenvConfig.get_envpython = get_envpython
+# Monkey patch TestenvConfig get_envbindir to run the commands of an env from its conda_prefix
+def get_envbindir(self):
+    """Override get_envbindir to look for scripts in the conda prefix the env runs in."""
+    envbindir = self.__get_envbindir()
+    prefix = get_prefix(self)
+    if prefix == self.envdir:
+        return envbindir
+    return prefix.join(envbindir.basename)
 
 
 # Monkey patch TestenvConfig _venv_lookup to fix tox behavior with tox-conda under windows
@@ -314,15 +1659,32 @@ def venv_lookup(self, name):
     # is installed in the Scripts directory. Tox assumes that looking in the
     # Scripts directory is sufficient, which is why this workaround is required.
     if tox.INFO.IS_WIN:
-        paths += [self.envconfig.envdir]
+        paths += [get_prefix(self.envconfig)]
     return py.path.local.sysfind(name, paths=paths)
 
 
-VirtualEnv._venv_lookup = venv_lookup
+def patch_tox():
+    """Apply the monkey patches above, once per process."""
+    if TestenvConfig.get_envpython is get_envpython:
+        return
+    TestenvConfig.__get_envpython = TestenvConfig.get_envpython
+    TestenvConfig.get_envpython = get_envpython
+    TestenvConfig.__get_envbindir = TestenvConfig.get_envbindir
+    TestenvConfig.get_envbindir = get_envbindir
+    VirtualEnv._venv_lookup = venv_lookup
 
 
 @hookimpl(hookwrapper=True)
 def tox_runtest_pre(venv):
+    # The env is provisioned, prepare the next ones while its commands run.
+    schedule_prebuilds(venv)
+    if not hasattr(venv.envconfig, "conda_inputs"):
+        # tox found the env up to date, none of the hooks provisioning it were called.
+        count_metric(venv.envconfig.config, "tox_conda_envs_total", outcome="reused")
+    if venv.envconfig.conda_repair and venv.envconfig.conda_prefix is None:
+        with venv.new_action("repaircondaenv") as action:
+            repair_env(venv, action)
+    record_fingerprint(venv)
     with activate_env(venv):
         yield
 
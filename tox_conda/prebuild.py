@@ -0,0 +1,124 @@
+"""Provision upcoming conda envs in the background while the current env runs its tests."""
+import os
+import threading
+
+from . import cleanup, marker
+
+
+class PrebuildJob:
+    """Everything needed to provision one conda env while another env runs its commands.
+
+    ``commands`` are the command lines of the conda steps, built in the main thread;
+    ``run_command`` runs one of them in the worker thread and raises when it fails.
+    ``resources`` holds what the commands use until the job ends, e.g. temporary files.
+    """
+
+    def __init__(self, name, envdir, inputs, commands, run_command, log_path, resources=None):
+        self.name = name
+        self.envdir = str(envdir)
+        self.inputs = inputs
+        self.commands = commands
+        self.run_command = run_command
+        self.log_path = str(log_path)
+        self.resources = resources
+        self._cancelled = threading.Event()
+
+    def cancel(self):
+        """Do not start the steps that are not running yet."""
+        self._cancelled.set()
+
+    def close(self):
+        if self.resources is not None:
+            self.resources.close()
+
+    def run(self):
+        try:
+            return self._run()
+        finally:
+            self.close()
+
+    def _run(self):
+        if self._cancelled.is_set():
+            return False
+        cleanup.move_aside(self.envdir)
+        os.makedirs(os.path.dirname(self.log_path), exist_ok=True)
+        with open(self.log_path, "w") as log:
+            for args in self.commands:
+                if self._cancelled.is_set():
+                    log.write("cancelled\n")
+                    return False
+                log.write("$ {}\n".format(" ".join(str(arg) for arg in args)))
+                log.flush()
+                try:
+                    self.run_command(args)
+                except Exception as exception:
+                    log.write("failed: {}\n".format(exception))
+                    raise
+        marker.write_marker(self.envdir, self.inputs)
+        return True
+
+
+class Prebuilder:
+    """Run prebuild jobs on a bounded pool of worker threads."""
+
+    def __init__(self, max_workers):
+        self.max_workers = max_workers
+        self._executor = None
+        self._futures = {}
+        self._lock = threading.Lock()
+
+    def is_scheduled(self, name):
+        with self._lock:
+            return name in self._futures
+
+    def submit(self, job):
+        with self._lock:
+            if job.name in self._futures:
+                return
+            if self._executor is None:
+                from concurrent.futures import ThreadPoolExecutor
+
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers)
+            self._futures[job.name] = (job, self._executor.submit(job.run))
+
+    def wait(self, name):
+        """Wait for the prebuild of ``name``.
+
+        Return the job when it succeeded, ``None`` when it was never scheduled. A failed job
+        is raised as :class:`PrebuildFailed` so that the caller can fall back to a regular
+        build.
+        """
+        with self._lock:
+            scheduled = self._futures.pop(name, None)
+        if scheduled is None:
+            return None
+        job, future = scheduled
+        try:
+            succeeded = future.result()
+        except Exception as exception:
+            raise PrebuildFailed(job, repr(exception))
+        if not succeeded:
+            raise PrebuildFailed(job, "see {}".format(job.log_path))
+        return job
+
+    def shutdown(self):
+        """Drop the jobs that did not start, and stop the running ones after their step.
+
+        Called when the run ends, also on an interrupt, so that tox does not wait for the
+        builds of envs it will not run.
+        """
+        with self._lock:
+            scheduled, self._futures = self._futures, {}
+            executor, self._executor = self._executor, None
+        for job, future in scheduled.values():
+            job.cancel()
+            if future.cancel():
+                job.close()
+        if executor is not None:
+            executor.shutdown(wait=False)
+
+
+class PrebuildFailed(Exception):
+    def __init__(self, job, reason):
+        super().__init__("background build of {} failed: {}".format(job.name, reason))
+        self.job = job
@@ -0,0 +1,107 @@
+"""Profile the conda processes and the hooks of the plugin with ``cProfile``.
+
+Conda processes are run under ``cProfile`` by the interpreter of the conda installation, so
+the profile shows whether their time goes to reading the repodata, solving or linking. Each
+profile is written to a ``.prof`` file, which ``pstats`` or ``snakeviz`` can open, and
+summarized in a text file next to it.
+"""
+import io
+import os
+import shlex
+from contextlib import contextmanager
+
+PROFILE_SUFFIX = ".prof"
+SUMMARY_NAME = "conda-profile.txt"
+# Number of functions listed for each profile in the summary file, and on the console.
+SUMMARY_TOP = 25
+REPORT_TOP = 10
+# Runs the script given as second argument, with the arguments that follow, under cProfile
+# and writes the profile to the file given as first argument. Unlike ``python -m cProfile``,
+# it exits with the exit code of the script.
+PROFILE_SCRIPT = """\
+import cProfile, os, sys
+path, sys.argv = sys.argv[1], sys.argv[2:]
+sys.path[0] = os.path.dirname(sys.argv[0])
+with open(sys.argv[0], "rb") as stream:
+    code = compile(stream.read(), sys.argv[0], "exec")
+globs = {"__file__": sys.argv[0], "__name__": "__main__", "__package__": None}
+profiler = cProfile.Profile()
+try:
+    profiler.runctx(code, globs, None)
+finally:
+    profiler.dump_stats(path)
+"""
+
+
+def conda_python(conda_exe):
+    """Return the interpreter running the ``conda_exe`` script, ``None`` if it is no script."""
+    try:
+        with open(str(conda_exe), "rb") as stream:
+            line = stream.readline(4096)
+    except OSError:
+        return None
+    if not line.startswith(b"#!"):
+        return None
+    try:
+        words = shlex.split(line[2:].decode().strip())
+    except (UnicodeDecodeError, ValueError):
+        return None
+    if not words or not os.path.isfile(words[0]):
+        return None
+    return words[0]
+
+
+def profile_command(args, python, path):
+    """Return the conda command line ``args`` run under ``cProfile``, writing to ``path``."""
+    return [python, "-c", PROFILE_SCRIPT, str(path)] + [str(arg) for arg in args]
+
+
+def profile_path(directory, name):
+    """Return a path for the profile ``name`` in ``directory`` not used by earlier profiles."""
+    directory = str(directory)
+    count = sum(1 for entry in os.listdir(directory) if entry.endswith(PROFILE_SUFFIX))
+    return os.path.join(directory, "{:02d}-{}{}".format(count + 1, name, PROFILE_SUFFIX))
+
+
+@contextmanager
+def profiled(directory, name, report=None):
+    """Profile the code run within the context into a new profile ``name`` in ``directory``.
+
+    The profile is summarized as soon as it is written, by ``report`` if given.
+    """
+    import cProfile
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        # Created last, the code profiled may have replaced the directory.
+        os.makedirs(str(directory), exist_ok=True)
+        path = profile_path(directory, name)
+        profiler.dump_stats(path)
+        (add_summary if report is None else report)(path)
+
+
+def summarize(path, top=SUMMARY_TOP):
+    """Return the ``top`` functions of the profile ``path`` by cumulative time, as text."""
+    import pstats
+
+    stream = io.StringIO()
+    stats = pstats.Stats(str(path), stream=stream)
+    stats.sort_stats("cumulative").print_stats(top)
+    return stream.getvalue()
+
+
+def add_summary(path, top=SUMMARY_TOP):
+    """Append the summary of the profile ``path`` to the summary file of its directory.
+
+    Return the path of the summary file.
+    """
+    summary_path = os.path.join(os.path.dirname(str(path)), SUMMARY_NAME)
+    with open(summary_path, "a") as stream:
+        stream.write("==> {} <==\n".format(os.path.basename(str(path))))
+        stream.write(summarize(path, top))
+        stream.write("\n")
+    return summary_path
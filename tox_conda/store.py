@@ -0,0 +1,229 @@
+"""Share the explicit specs and archives of conda envs between machines.
+
+An artifact ``name`` is stored as a blob named after its sha256, ``<name>.<sha256>``, next
+to a reference ``<name>.sha256`` holding that digest. The blob is always published before
+the reference, so a reader that finds a reference also finds the complete blob, and the
+digest lets it verify what it downloaded. Concurrent writers of the same artifact at worst
+overwrite each other's reference with another valid one.
+"""
+import abc
+import hashlib
+import os
+import shutil
+import uuid
+
+REF_SUFFIX = ".sha256"
+_CHUNK_SIZE = 1 << 20
+
+
+class StoreError(Exception):
+    """The store cannot be read or written."""
+
+
+def open_store(location):
+    """Return the store at ``location``, a directory or an ``http(s)://`` URL."""
+    location = str(location)
+    if location.startswith(("http://", "https://")):
+        return HTTPStore(location)
+    if location.startswith("file://"):
+        import urllib.request
+
+        location = urllib.request.url2pathname(location[len("file://") :])
+    return LocalStore(location)
+
+
+class Store(abc.ABC):
+    """A store of named artifacts; subclasses implement reading and writing raw files."""
+
+    def fetch(self, name, path):
+        """Download the artifact ``name`` to ``path``, return ``False`` if it does not exist.
+
+        ``path`` is only created once the content has been verified.
+        """
+        digest = self._read_ref(name)
+        if digest is None:
+            return False
+        tmp_path = "{}.{}.tmp".format(path, uuid.uuid4().hex)
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        try:
+            with open(tmp_path, "wb") as stream:
+                actual = self._download(_blob_name(name, digest), _HashingWriter(stream))
+            if actual is None:
+                return False
+            if actual != digest:
+                raise StoreError("{} does not match its sha256 {}".format(name, digest))
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        return True
+
+    def publish(self, name, path):
+        """Upload the file ``path`` as the artifact ``name``."""
+        digest = file_sha256(path)
+        self._upload(_blob_name(name, digest), path)
+        self._write_ref(name, digest)
+
+    def contains(self, name):
+        return self._read_ref(name) is not None
+
+    @abc.abstractmethod
+    def _read_ref(self, name):
+        """Return the digest the reference of ``name`` holds, ``None`` if missing."""
+
+    @abc.abstractmethod
+    def _write_ref(self, name, digest):
+        """Make the reference of ``name`` hold ``digest``."""
+
+    @abc.abstractmethod
+    def _download(self, name, writer):
+        """Write the file ``name`` to ``writer``, return its digest or ``None`` if missing."""
+
+    @abc.abstractmethod
+    def _upload(self, name, path):
+        """Upload the file ``path`` as ``name``."""
+
+
+class LocalStore(Store):
+    """A store in a directory, possibly on a filesystem shared between machines."""
+
+    def __init__(self, directory):
+        self.directory = os.path.abspath(str(directory))
+
+    def __repr__(self):
+        return "LocalStore({!r})".format(self.directory)
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _read_ref(self, name):
+        try:
+            with open(self._path(name + REF_SUFFIX)) as stream:
+                return stream.read().strip() or None
+        except FileNotFoundError:
+            return None
+        except OSError as exception:
+            raise StoreError(str(exception))
+
+    def _write_ref(self, name, digest):
+        self._replace(self._path(name + REF_SUFFIX), lambda stream: stream.write(digest.encode()))
+
+    def _download(self, name, writer):
+        try:
+            with open(self._path(name), "rb") as stream:
+                shutil.copyfileobj(stream, writer, _CHUNK_SIZE)
+        except FileNotFoundError:
+            return None
+        except OSError as exception:
+            raise StoreError(str(exception))
+        return writer.hexdigest()
+
+    def _upload(self, name, path):
+        target = self._path(name)
+        if os.path.exists(target):
+            return
+
+        def copy(stream):
+            with open(path, "rb") as source:
+                shutil.copyfileobj(source, stream, _CHUNK_SIZE)
+
+        self._replace(target, copy)
+
+    def _replace(self, path, write):
+        tmp_path = "{}.{}.tmp".format(path, uuid.uuid4().hex)
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(tmp_path, "wb") as stream:
+                write(stream)
+            os.replace(tmp_path, path)
+        except OSError as exception:
+            raise StoreError(str(exception))
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+
+class HTTPStore(Store):
+    """A store behind a HTTP server.
+
+    Reading only needs ``GET``, so any static file server does. Publishing uses ``PUT``.
+    """
+
+    def __init__(self, url, timeout=30):
+        self.url = url.rstrip("/") + "/"
+        self.timeout = timeout
+
+    def __repr__(self):
+        return "HTTPStore({!r})".format(self.url)
+
+    def _open(self, name, method="GET", data=None, headers=None):
+        # Only loaded when a HTTP store is used, it is slow to import.
+        import urllib.error
+        import urllib.parse
+        import urllib.request
+
+        request = urllib.request.Request(
+            self.url + urllib.parse.quote(name), data=data, headers=headers or {}, method=method
+        )
+        try:
+            return urllib.request.urlopen(request, timeout=self.timeout)
+        except urllib.error.HTTPError as exception:
+            if exception.code == 404 and method == "GET":
+                return None
+            raise StoreError("{} {}: {}".format(method, request.full_url, exception))
+        except (OSError, urllib.error.URLError) as exception:
+            raise StoreError("{} {}: {}".format(method, request.full_url, exception))
+
+    def _read_ref(self, name):
+        response = self._open(name + REF_SUFFIX)
+        if response is None:
+            return None
+        with response:
+            return response.read().decode("ascii", "replace").strip() or None
+
+    def _write_ref(self, name, digest):
+        self._put(name + REF_SUFFIX, digest.encode(), len(digest))
+
+    def _download(self, name, writer):
+        response = self._open(name)
+        if response is None:
+            return None
+        try:
+            with response:
+                shutil.copyfileobj(response, writer, _CHUNK_SIZE)
+        except OSError as exception:
+            raise StoreError("GET {}{}: {}".format(self.url, name, exception))
+        return writer.hexdigest()
+
+    def _upload(self, name, path):
+        with open(path, "rb") as stream:
+            self._put(name, stream, os.path.getsize(path))
+
+    def _put(self, name, data, size):
+        headers = {"Content-Length": str(size), "Content-Type": "application/octet-stream"}
+        self._open(name, method="PUT", data=data, headers=headers).close()
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(str(path), "rb") as stream:
+        for chunk in iter(lambda: stream.read(_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _blob_name(name, digest):
+    return "{}.{}".format(name, digest)
+
+
+class _HashingWriter:
+    def __init__(self, stream):
+        self._stream = stream
+        self._digest = hashlib.sha256()
+
+    def write(self, data):
+        self._digest.update(data)
+        return self._stream.write(data)
+
+    def hexdigest(self):
+        return self._digest.hexdigest()
@@ -0,0 +1,327 @@
+"""Run the environments of tox 4 in conda envs.
+
+Unlike the tox 3 plugin, nothing of tox is patched: conda envs are a runner of their own,
+and the env is activated once, its environment variables being passed to every command.
+"""
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+from contextlib import contextmanager
+from pathlib import Path
+from typing import List, Optional
+
+from tox.execute.local_sub_process import LocalSubProcessExecutor
+from tox.execute.request import StdinSource
+from tox.plugin import impl
+from tox.tox_env.errors import Fail
+from tox.tox_env.python.api import PythonInfo, VersionInfo
+from tox.tox_env.python.pip.pip_install import Pip
+from tox.tox_env.python.runner import PythonRun
+from tox.tox_env.python.virtual_env.api import VirtualEnv
+from virtualenv.discovery.py_spec import PythonSpec
+
+from . import marker
+from .activation import ActivationEnv
+
+MISSING_CONDA_ERROR = "Cannot locate the conda executable."
+_PYTHON_VERSION = "import sys; print('{}.{}.{}'.format(*sys.version_info[:3]))"
+
+
+def find_conda():
+    for variable in ("_CONDA_EXE", "CONDA_EXE"):
+        conda_exe = os.environ.get(variable)
+        if conda_exe:
+            return conda_exe
+    path = shutil.which("conda")
+    if path is None:
+        raise Fail(MISSING_CONDA_ERROR)
+    return path
+
+
+class CondaEnvRunner(PythonRun):
+    """A tox environment living in a conda env."""
+
+    def __init__(self, create_args):
+        self._executor = None
+        self._installer = None
+        self._activation = None
+        super().__init__(create_args)
+
+    @staticmethod
+    def id():
+        return "conda"
+
+    @property
+    def _package_tox_env_type(self):
+        return "virtualenv-pep-517"
+
+    @property
+    def _external_pkg_tox_env_type(self):
+        return "virtualenv-cmd-builder"
+
+    @property
+    def default_pkg_type(self):
+        tox_root = self.core["tox_root"]
+        if not any((tox_root / i).exists() for i in ("pyproject.toml", "setup.py", "setup.cfg")):
+            return "skip"
+        return super().default_pkg_type
+
+    def register_config(self):
+        super().register_config()
+        root = self.core["tox_root"]
+
+        def resolve_path(value):
+            return None if value is None else root / value
+
+        self.conf.add_config(
+            keys=["conda_deps"],
+            of_type=List[str],
+            default=[],
+            desc="each line specifies a conda dependency in pip/setuptools format",
+        )
+        self.conf.add_config(
+            keys=["conda_spec"],
+            of_type=Optional[Path],
+            default=None,
+            desc="path to a conda spec file",
+            post_process=resolve_path,
+        )
+        self.conf.add_config(
+            keys=["conda_env"],
+            of_type=Optional[Path],
+            default=None,
+            desc="path to a conda environment.yml file",
+            post_process=resolve_path,
+        )
+        self.conf.add_config(
+            keys=["conda_channels"],
+            of_type=List[str],
+            default=[],
+            desc="each line specifies a conda channel",
+        )
+        self.conf.add_config(
+            keys=["conda_install_args"],
+            of_type=List[str],
+            default=[],
+            desc="each line specifies a conda install argument",
+        )
+        self.conf.add_config(
+            keys=["conda_create_args"],
+            of_type=List[str],
+            default=[],
+            desc="each line specifies a conda create argument",
+        )
+
+    @property
+    def conda_exe(self):
+        return find_conda()
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            self._executor = LocalSubProcessExecutor(self.options.is_colored)
+        return self._executor
+
+    @property
+    def installer(self):
+        if self._installer is None:
+            self._installer = Pip(self)
+        return self._installer
+
+    @property
+    def runs_on_platform(self):
+        return sys.platform
+
+    def _default_pass_env(self):
+        env = super()._default_pass_env()
+        env.append("CONDA_*")  # conda settings, e.g. CONDA_PKGS_DIRS
+        env.append("PIP_*")  # we use pip as installer
+        return env
+
+    @property
+    def _allow_externals(self):
+        result = super()._allow_externals
+        result.append(str(self.conda_exe))
+        return result
+
+    @classmethod
+    def python_spec_for_path(cls, path):
+        return VirtualEnv.python_spec_for_path(path)
+
+    def _get_python(self, base_python):
+        for base in base_python:
+            if os.path.isabs(base):
+                if os.path.realpath(base) == os.path.realpath(sys.executable):
+                    version = sys.version_info[:3]
+                else:
+                    output = subprocess.check_output([base, "-c", _PYTHON_VERSION])
+                    version = tuple(int(part) for part in output.decode().split("."))
+                implementation = "PyPy" if "pypy" in os.path.basename(base).lower() else "CPython"
+                package_version = "{}.{}".format(*version[:2])
+            else:
+                spec = PythonSpec.from_string_spec(base)
+                if spec.major is None:
+                    continue
+                version = (spec.major, spec.minor or 0, spec.micro or 0)
+                implementation = "PyPy" if spec.implementation == "pypy" else "CPython"
+                package_version = ".".join(
+                    str(part) for part in (spec.major, spec.minor, spec.micro) if part is not None
+                )
+            if implementation == "PyPy":
+                # PyPy doesn't pull pip as a dependency, so we need to manually specify it
+                packages = ["pypy{}".format(package_version), "pip"]
+            else:
+                packages = ["python={}".format(package_version)]
+            return PythonInfo(
+                implementation=implementation,
+                version_info=VersionInfo(*(tuple(version) + ("final", 0))),
+                version=package_version,
+                is_64=sys.maxsize > 2**32,
+                platform=sys.platform,
+                extra={"conda_packages": packages},
+            )
+        return None
+
+    @property
+    def conda_python_packages(self):
+        return self.base_python.extra["conda_packages"]
+
+    def conda_inputs(self):
+        """Collect everything that determines the content of the conda env."""
+        return marker.conda_inputs(
+            self.conda_python_packages,
+            deps=self.conf["conda_deps"],
+            channels=self.conf["conda_channels"],
+            create_args=self.conf["conda_create_args"],
+            install_args=self.conf["conda_install_args"],
+            spec_file=self.conf["conda_spec"],
+            env_file=self.conf["conda_env"],
+        )
+
+    def python_cache(self):
+        result = super().python_cache()
+        # Any change of the conda inputs recreates the env.
+        result["conda"] = self.conda_inputs()
+        return result
+
+    def create_python_env(self):
+        self._activation = None
+        with self.conda_create_command() as cmd:
+            self._execute_conda(cmd, "conda create")
+        cmd = self.conda_install_command()
+        if cmd is not None:
+            self._execute_conda(cmd, "conda install")
+        marker.write_marker(self.env_dir, self.conda_inputs())
+
+    def _execute_conda(self, cmd, run_id):
+        outcome = self.execute(cmd, stdin=StdinSource.OFF, run_id=run_id, show=None)
+        outcome.assert_success()
+
+    @contextmanager
+    def conda_create_command(self):
+        """Yield the command line creating the conda env."""
+        env_file = self.conf["conda_env"]
+        if env_file is None:
+            cmd = [self.conda_exe, "create", "--yes", "-p", str(self.env_dir)]
+            cmd += ["--channel={}".format(channel) for channel in self.conf["conda_channels"]]
+            cmd += self.conf["conda_create_args"]
+            cmd += self.conda_python_packages
+            yield cmd
+            return
+
+        from ruamel.yaml import YAML
+
+        # conda env create does not have a --channel argument nor does it take
+        # dependencies specifications (e.g., python=3.8). These must all be specified
+        # in the conda-env.yml file
+        yaml = YAML()
+        content = yaml.load(env_file)
+        content["dependencies"] = list(content.get("dependencies") or [])
+        content["dependencies"].extend(self.conda_python_packages)
+        tmp_env = tempfile.NamedTemporaryFile(
+            dir=str(env_file.parent), prefix="tox_conda_tmp", suffix=".yaml", delete=False
+        )
+        with tmp_env:
+            yaml.dump(content, tmp_env)
+        try:
+            yield [
+                self.conda_exe,
+                "env",
+                "create",
+                "-p",
+                str(self.env_dir),
+                "--file",
+                tmp_env.name,
+            ]
+        finally:
+            os.remove(tmp_env.name)
+
+    def conda_install_command(self):
+        """Return the command line installing the conda deps, ``None`` if there are none."""
+        deps = list(self.conf["conda_deps"])
+        # Any deps after --file option(s) are ignored
+        if self.conf["conda_spec"] is not None:
+            deps.append("--file={}".format(self.conf["conda_spec"]))
+        if not deps:
+            return None
+        cmd = [self.conda_exe, "install", "--quiet", "--yes", "-p", str(self.env_dir)]
+        cmd += ["--channel={}".format(channel) for channel in self.conf["conda_channels"]]
+        cmd += self.conf["conda_install_args"]
+        # Make sure that python is explicitly given as part of every conda install
+        # in order to avoid inadvertent upgrades of python itself.
+        return cmd + self.conda_python_packages + deps
+
+    @property
+    def environment_variables(self):
+        env = super().environment_variables
+        activation = self.activation
+        if activation is None:
+            return env
+        return activation.apply(env)
+
+    @property
+    def activation(self):
+        """The activation of the conda env, recorded once it exists, ``None`` before."""
+        if self._activation is None and (self.env_dir / "conda-meta").is_dir():
+            try:
+                self._activation = ActivationEnv.compute(self.conda_exe, self.env_dir)
+            except (OSError, ValueError, subprocess.CalledProcessError) as exception:
+                raise Fail("cannot activate {}: {}".format(self.env_dir, exception))
+        return self._activation
+
+    def prepend_env_var_path(self):
+        if sys.platform == "win32":
+            library = self.env_dir / "Library"
+            return [
+                self.env_dir,
+                library / "mingw-w64" / "bin",
+                library / "usr" / "bin",
+                library / "bin",
+                self.env_dir / "Scripts",
+            ]
+        return [self.env_dir / "bin"]
+
+    def env_bin_dir(self):
+        if sys.platform == "win32":
+            return self.env_dir / "Scripts"
+        return self.env_dir / "bin"
+
+    def env_python(self):
+        if sys.platform == "win32":
+            return self.env_dir / "python.exe"
+        return self.env_dir / "bin" / "python"
+
+    def env_site_package_dir(self):
+        if sys.platform == "win32":
+            return self.env_dir / "Lib" / "site-packages"
+        implementation = "pypy" if self.base_python.impl_lower == "pypy" else "python"
+        name = "{}{}".format(implementation, self.base_python.version_dot)
+        return self.env_dir / "lib" / name / "site-packages"
+
+
+@impl
+def tox_register_tox_env(register):
+    register.add_run_env(CondaEnvRunner)
+    register.default_env_runner = CondaEnvRunner.id()
@@ -0,0 +1,62 @@
+"""Keep the wheels of the pip deps of conda envs, to share them between envs of an ABI.
+
+The wheels are kept in a directory per interpreter ABI and platform. Once the wheels of a
+set of deps have been added, a stamp named after the deps is written next to them: the
+envs with the same deps then install them from the wheelhouse with ``--no-index``, without
+resolving them against an index nor building anything.
+"""
+import os
+import uuid
+
+from . import marker
+
+STAMP_SUFFIX = ".deps"
+# Printed by the python of an env, names the wheelhouse of its ABI and platform.
+TAG_SCRIPT = (
+    "import sys, sysconfig; print('{}{}-{}'.format(sys.implementation.cache_tag, "
+    "getattr(sys, 'abiflags', ''), sysconfig.get_platform()))"
+)
+
+
+def deps_inputs(packages, options, basedir):
+    """Collect everything that determines the wheels of ``packages``.
+
+    ``None`` is returned when a package is editable or a local path, whose content is not
+    tracked: it cannot be installed from the wheelhouse.
+    """
+    files = {}
+    for package in packages:
+        if package.startswith(("-r", "-c")):
+            name = package[2:].strip()
+            files[name] = marker.file_digest(os.path.join(basedir, name))
+        elif package.startswith(("-e", "--editable")):
+            return None
+        elif os.path.exists(os.path.join(basedir, package)):
+            return None
+    return {"packages": list(packages), "options": list(options), "files": files}
+
+
+def stamp_path(directory, inputs):
+    return os.path.join(str(directory), marker.inputs_hash(inputs) + STAMP_SUFFIX)
+
+
+def is_stamped(directory, inputs):
+    """Tell whether the wheels of the deps ``inputs`` have all been added to ``directory``."""
+    return inputs is not None and os.path.isfile(stamp_path(directory, inputs))
+
+
+def add_wheels(build_dir, directory, inputs):
+    """Move the wheels built in ``build_dir`` into ``directory`` and stamp ``inputs``.
+
+    Each wheel is moved atomically, so concurrent envs never see a partial one.
+    """
+    for name in sorted(os.listdir(build_dir)):
+        if name.endswith(".whl"):
+            os.replace(os.path.join(build_dir, name), os.path.join(str(directory), name))
+    if inputs is None:
+        return
+    path = stamp_path(directory, inputs)
+    tmp_path = "{}.{}.tmp".format(path, uuid.uuid4().hex)
+    with open(tmp_path, "w") as stream:
+        stream.write("\n".join(inputs["packages"]) + "\n")
+    os.replace(tmp_path, path)